@@ -0,0 +1,96 @@
+import functools
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+
+#----------------------------------------------------------------------------#
+# Token buckets.
+#----------------------------------------------------------------------------#
+
+class TokenBuckets:
+    # one bucket per key, refilled at `rate` tokens a second up to `burst`;
+    # only the `size` most recently seen keys are kept, a forgotten key starts
+    # over with a full bucket
+    def __init__(self, rate, burst, size=10000):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.buckets = OrderedDict() # key -> (tokens, updated)
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        # 0 when a token was taken, else seconds until the next one
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+            if len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+#----------------------------------------------------------------------------#
+# Admission control.
+#----------------------------------------------------------------------------#
+
+class AdmissionControl:
+    # @admission.limited on a view: a client (remote address) gets
+    # SEARCH_RATE requests a second per endpoint with bursts of SEARCH_BURST,
+    # beyond that 429 with Retry-After. At most SEARCH_MAX_CONCURRENCY limited
+    # requests run at once in this process; a request that cannot get a slot
+    # within SEARCH_QUEUE_TIMEOUT seconds is shed with 503 rather than piling
+    # onto a database that is already busy. Shed requests are counted in
+    # `stats` and summarized in the log every SEARCH_STATS_INTERVAL seconds.
+    # Behind a proxy, set PROXY_FIX_X_FOR so remote_addr is the client's.
+    def __init__(self):
+        self.app = None
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('SEARCH_LIMITS', True)
+        self.buckets = TokenBuckets(app.config.get('SEARCH_RATE', 1.0), app.config.get('SEARCH_BURST', 10))
+        self.slots = threading.BoundedSemaphore(app.config.get('SEARCH_MAX_CONCURRENCY', 4))
+        self.queue_timeout = app.config.get('SEARCH_QUEUE_TIMEOUT', 0.1)
+        self.stats_interval = app.config.get('SEARCH_STATS_INTERVAL', 60)
+        self.reported = time.monotonic()
+
+    def count(self, endpoint, outcome):
+        with self.lock:
+            self.stats[(endpoint, outcome)] += 1
+            now = time.monotonic()
+            if outcome == 'admitted' or now - self.reported < self.stats_interval:
+                return
+            self.reported = now
+            summary = ', '.join(f'{key[0]} {key[1]}: {count}' for key, count in sorted(self.stats.items()))
+        self.app.logger.warning('search admission since start (this process): %s', summary)
+
+    def limited(self, view):
+        @functools.wraps(view)
+        def admit(*args, **kwargs):
+            if not self.enabled:
+                return view(*args, **kwargs)
+            wait = self.buckets.take((request.remote_addr, request.endpoint))
+            if wait:
+                self.count(request.endpoint, 'rate_limited')
+                raise TooManyRequests(retry_after=math.ceil(wait))
+            if not self.slots.acquire(timeout=self.queue_timeout):
+                self.count(request.endpoint, 'overloaded')
+                raise ServiceUnavailable(retry_after=1)
+            try:
+                self.count(request.endpoint, 'admitted')
+                return view(*args, **kwargs)
+            finally:
+                self.slots.release()
+        return admit
+
+
+admission = AdmissionControl()
@@ -2,27 +2,50 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import csv
 import json
+import click
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, stream_with_context, send_file
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
-from logging import Formatter, FileHandler
+from log_config import configure_logging
 from flask_wtf import Form
 from forms import SearchForm, ShowForm, VenueForm, ArtistForm
 import collections
 collections.Callable = collections.abc.Callable
 from flask_migrate import Migrate
-from sqlalchemy import func
-from datetime import datetime
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import func, delete, update
+from datetime import datetime, timedelta
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask import abort 
 # Import models
-from models import db, Venue, Artist, Show 
+from models import db, is_postgres, Venue, Artist, Show, Location, SHOW_DURATION
+from genres import genre_filter, genre_facets
+from show_calendar import parse_range, shows_between, month_calendar
+from show_archive import past_shows, upcoming_shows, archive_past_shows
+from booking import find_conflict, import_shows
+from venue_directory import directory, read_directory, refresh_directory, refresher
+from updates import ARTIST_FIELDS, VENUE_FIELDS, patch_row, validate_changes
+from jobs import work
+from profiling import profiler
+from query_log import query_log
+from typeahead import preload_index, suggest
+from matching import matches_for
+from export import FORMATS, KINDS, export_until, generate_export
+from ical import feed, feeds
+from snapshot import snapshot
+from images import MAX_AGE, WIDTHS, thumbnails
+from compression import compression, compressor
+from fragment_cache import fragments
+from admission import admission
+from search_cache import normalize, search_cache
+from geo import geocode_venues, geocoder, nearby_venues
 # Import CSRF
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFError, CSRFProtect, generate_csrf
+from werkzeug.middleware.proxy_fix import ProxyFix
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -31,9 +54,26 @@ app = Flask(__name__)
 csrf = CSRFProtect(app)
 moment = Moment(app)
 app.config.from_object('config')
+app.config.from_prefixed_env() # FLASK_* overrides, e.g. the load test's database
+if app.config.get('PROXY_FIX_X_FOR'):
+    # behind that many proxies remote_addr (logs, search rate limits) is
+    # taken from X-Forwarded-For
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 db.init_app(app)
 
 migrate = Migrate(app, db)
+refresher.init_app(app)
+profiler.init_app(app)
+query_log.init_app(app)
+feeds.init_app(app)
+snapshot.init_app(app)
+thumbnails.init_app(app)
+compressor.init_app(app)
+fragments.init_app(app)
+admission.init_app(app)
+search_cache.init_app(app)
+geocoder.init_app(app)
+preload_index(app)
 
 # Inject forms
 @app.context_processor
@@ -56,6 +96,8 @@ def format_datetime(value, format='medium'):
   return babel.dates.format_datetime(date, format, locale='en')
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['thumbnail'] = thumbnails.url
+app.jinja_env.filters['srcset'] = thumbnails.srcset
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -73,49 +115,109 @@ def index():
 def venues():
   # TODO: replace with real venues data. >> done!
   #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  # get all distinct city and state pairs
-    locations = db.session.query(Venue.city, Venue.state).distinct()
-
-    data = []
-    for location in locations:
-        # for each pair, query the database for venues in the city/state
-        venues = db.session.query(Venue.id, Venue.name).filter(Venue.city == location[0], Venue.state == location[1])
-        venue_data = []
-        for venue in venues:
-            # calculate the number of upcoming shows for each venue
-            num_upcoming_shows = db.session.query(func.count(Show.id)).filter(Show.venue_id == venue[0], Show.start_time > datetime.now()).scalar()
-            venue_data.append({
-                "id": venue[0],
-                "name": venue[1],
-                "num_upcoming_shows": num_upcoming_shows,
-            })
-
-        data.append({
-            "city": location[0],
-            "state": location[1],
-            "venues": venue_data,
-        })
-
-    return render_template('pages/venues.html', areas=data)
+  # optional ?genre=Jazz&genre=Folk filter, a venue must carry every selected genre
+    selected_genres = request.args.getlist('genre')
+    criteria = [Venue.active]
+    if selected_genres:
+        criteria.append(genre_filter(Venue, selected_genres))
+
+  # optional ?location=<id> to browse a single area
+    location_id = request.args.get('location', type=int)
+    if location_id:
+        criteria.append(Venue.location_id == location_id)
+
+  # served from the precomputed directory (see venue_directory.py), one indexed read
+    directory_criteria = []
+    if location_id:
+        directory_criteria.append(directory.c.location_id == location_id)
+    if selected_genres:
+        directory_criteria.append(directory.c.venue_id.in_(db.session.query(Venue.id).filter(*criteria)))
+  # or, unfiltered, from the snapshot shared by all workers (see snapshot.py)
+    shared = None if directory_criteria else snapshot.current()
+    data = shared.areas() if shared else read_directory(*directory_criteria)
+
+    return render_template('pages/venues.html', areas=data,
+                           facets=genre_facets(Venue, *criteria), selected_genres=selected_genres)
+
+def search_term_too_short(search_term):
+  # a term under SEARCH_MIN_LENGTH characters would match (and scan) nearly
+  # every row, so it is not run at all
+  minimum = app.config.get('SEARCH_MIN_LENGTH', 2)
+  if len(search_term) < minimum:
+    flash(f'Please enter at least {minimum} characters to search.')
+    return True
+  return False
+
+def search_by_name(model, search_term, selected_genres):
+  # active rows whose name contains the (normalized) term, by name, at most
+  # SEARCH_RESULT_LIMIT of them; repeated searches come from search_cache.py
+  limit = app.config.get('SEARCH_RESULT_LIMIT', 50)
+  def search():
+    # % and _ in the term are matched literally
+    pattern = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    criteria = [model.active, model.name.ilike(f'%{pattern}%', escape='\\')]
+    if selected_genres:
+      criteria.append(genre_filter(model, selected_genres))
+    rows = db.session.query(model.id, model.name).filter(*criteria).order_by(model.name).limit(limit + 1).all()
+    return {
+      "count": min(len(rows), limit),
+      "truncated": len(rows) > limit,
+      "data": [{"id": id, "name": name} for id, name in rows[:limit]],
+      "facets": genre_facets(model, *criteria),
+    }
+  return search_cache.get(model.__tablename__, search_term, selected_genres, limit, search)
+
 
 @app.route('/venues/search', methods=['POST'])
+@admission.limited
 def search_venues():
   # TODO: implement search on venues with partial string search. Ensure it is case-insensitive. >> done!
   # seach for Hop should return "The Musical Hop". >> done!
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee" >> done!
-    search_term = request.form.get('search_term', '')
-    venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-
-    response = {
-        "count": len(venues),
-        "data": [{
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len([show for show in venue.shows if show.start_time > datetime.now()]),
-        } for venue in venues]
-    }
+  # rate limited and capped per process, see admission.py
+    search_term = request.form.get('search_term', '').strip()
+    selected_genres = request.values.getlist('genre')
+    if search_term_too_short(search_term):
+        return render_template('pages/search_venues.html', results={"count": 0, "data": []},
+                               search_term=search_term, facets=[], selected_genres=selected_genres)
+    response = search_by_name(Venue, normalize(search_term), selected_genres)
+
+    return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                           facets=response["facets"], selected_genres=selected_genres)
+
+
+@app.route('/venues/nearby')
+def venues_nearby():
+  # ?lat=&lon= (the browser's position) or ?city=&state= (looked up in the
+  # geocoding table); at most ?k= venues within ?radius= km, nearest first,
+  # see geo.py. ?format=json for the API
+    try:
+        radius = min(request.args.get('radius', app.config.get('NEARBY_RADIUS_KM', 50), type=float),
+                     app.config.get('NEARBY_MAX_RADIUS_KM', 500))
+        k = min(request.args.get('k', app.config.get('NEARBY_LIMIT', 20), type=int), 100)
+        if 'lat' in request.args:
+            point = float(request.args['lat']), float(request.args['lon'])
+            if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+                abort(400)
+        else:
+            point = geocoder.lookup(request.args.get('city'), request.args.get('state'))
+    except (KeyError, ValueError):
+        abort(400)
+    if not radius > 0 or k < 1:
+        abort(400)
+
+    if point is None:
+        flash(f"Sorry, we don't know where {request.args.get('city', '')} {request.args.get('state', '')} is. "
+              "Please try a nearby city.")
+        return redirect(url_for('venues'))
+
+    data = nearby_venues(point[0], point[1], radius_km=radius, k=k)
 
-    return render_template('pages/search_venues.html', results=response, search_term=search_term)
+    if request.args.get('format') == 'json':
+        return jsonify({"latitude": point[0], "longitude": point[1], "radius": radius, "count": len(data), "data": data})
+
+    return render_template('pages/venues_nearby.html', venues=data, radius=radius,
+                           city=request.args.get('city'), state=request.args.get('state'))
 
 
 @app.route('/venues/<int:venue_id>')
@@ -128,25 +230,30 @@ def show_venue(venue_id):
   if not venue:
     return render_template('errors/404.html')
 
-  past_shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id).filter(Show.start_time<datetime.now()).all()
-  upcoming_shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id).filter(Show.start_time>datetime.now()).all()
+  # upcoming shows come from the hot Show table, past ones also from ShowArchive
+  past_shows_query = past_shows(venue_id=venue_id)
+  upcoming_shows_query = upcoming_shows(venue_id=venue_id)
 
 
-  past_shows = []
+  past_shows_data = []
   for show in past_shows_query:
-    past_shows.append({
+    past_shows_data.append({
+      "id": show.id,
+      "version": show.artist_version, # tile cache key, see show_venue.html
       "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
+      "artist_name": show.artist_name,
+      "artist_image_link": show.artist_image_link,
       "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
     })
 
-  upcoming_shows = []
+  upcoming_shows_data = []
   for show in upcoming_shows_query:
-    upcoming_shows.append({
+    upcoming_shows_data.append({
+      "id": show.id,
+      "version": show.artist_version, # tile cache key, see show_venue.html
       "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
+      "artist_name": show.artist_name,
+      "artist_image_link": show.artist_image_link,
       "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
     })
 
@@ -163,10 +270,10 @@ def show_venue(venue_id):
     "seeking_talent": venue.seeking_talent,
     "seeking_description": venue.seeking_description,
     "image_link": venue.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
-    "upcoming_shows_count": len(upcoming_shows),
+    "past_shows": past_shows_data,
+    "upcoming_shows": upcoming_shows_data,
+    "past_shows_count": len(past_shows_data),
+    "upcoming_shows_count": len(upcoming_shows_data),
   }
   
   form = SearchForm()
@@ -204,11 +311,14 @@ def create_venue_submission():
         else:
           setattr(venue, field, form.data.get(field))  
 
+      venue.location = Location.get_or_create(venue.city, venue.state)
+
       # adding the new venue to the session
       db.session.add(venue)
       
       # commit all changes
       db.session.commit()
+      venue_id = venue.id
       
       # on successful db insert, flash success
       flash('Venue ' + form.data['name'] + ' was successfully listed!')  
@@ -227,7 +337,9 @@ def create_venue_submission():
       # close the session
       db.session.close()
       
-    return redirect(url_for('venues'))
+    # the venue's own page; /venues is served from the directory, which
+    # picks the new venue up only after its debounced refresh
+    return redirect(url_for('show_venue', venue_id=venue_id))
   else:
     message = []
     for field, err in form.errors.items():
@@ -245,7 +357,8 @@ def delete_venue(venue_id):
   # clicking that button delete it from the db then redirect the user to the homepage >> done!
 
   if request.form.get('_method_delete') == 'DELETE':
-    # try to delete the venue from the database
+    # try to delete the venue from the database, its shows are removed by
+    # ON DELETE CASCADE without being loaded into the session
     try:
         venue = Venue.query.get(venue_id)
         db.session.delete(venue)
@@ -261,6 +374,202 @@ def delete_venue(venue_id):
     return redirect(url_for('index'))
 
 
+#  CSRF token for API clients
+#  ----------------------------------------------------------------
+
+# CSRFProtect covers the JSON endpoints too (PATCH /venues/<id>,
+# PATCH /artists/<id>, POST /venues/bulk, POST /artists/bulk). A client GETs
+# this, keeps the session cookie it sets, and sends the token back in an
+# X-CSRFToken header; it expires after WTF_CSRF_TIME_LIMIT (an hour by
+# default). Pages carry the same token in <meta name="csrf-token">.
+
+@app.route('/csrf-token')
+def csrf_token():
+  return jsonify({"csrf_token": generate_csrf()})
+
+
+@app.errorhandler(CSRFError)
+def csrf_error(error):
+  # a missing or expired token on a JSON request gets a JSON answer
+  if request.is_json:
+    return jsonify({"error": error.description}), 400
+  return error
+
+
+#  Bulk delete / deactivate
+#  ----------------------------------------------------------------
+
+def bulk_action(model):
+  # ids=1&ids=2&action=delete|deactivate as a form post or {"ids": [...], "action": ...} as JSON
+  # with an X-CSRFToken header (see /csrf-token); one set-based statement, shows of deleted rows go with them via ON DELETE CASCADE
+  payload = request.get_json(silent=True)
+  if payload is not None:
+    ids, action = payload.get('ids', []), payload.get('action', 'delete')
+  else:
+    ids, action = request.form.getlist('ids'), request.form.get('action', 'delete')
+
+  try:
+    ids = sorted({int(id) for id in ids})
+  except (TypeError, ValueError):
+    abort(400)
+  if not ids or action not in ('delete', 'deactivate'):
+    abort(400)
+
+  if action == 'delete':
+    statement = delete(model).where(model.id.in_(ids))
+  else:
+    statement = update(model).where(model.id.in_(ids)).values(active=False)
+
+  try:
+    result = db.session.execute(statement, execution_options={'synchronize_session': False, 'target_ids': ids})
+    db.session.commit()
+    affected = result.rowcount
+  except SQLAlchemyError as e:
+    db.session.rollback()
+    app.logger.error('Bulk %s of %s failed: %s', action, model.__tablename__, e)
+    return jsonify({"error": f"{model.__tablename__} could not be updated."}), 500
+  finally:
+    db.session.close()
+
+  return jsonify({"action": action, "requested": len(ids), "affected": affected})
+
+
+@app.route('/venues/bulk', methods=['POST'])
+def bulk_venues():
+  return bulk_action(Venue)
+
+
+@app.route('/artists/bulk', methods=['POST'])
+def bulk_artists():
+  return bulk_action(Artist)
+
+
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/search/autocomplete')
+def autocomplete():
+  # ?q=mus[&type=venue|artist][&limit=10], answered from the in-process
+  # prefix index in typeahead.py, the database is not queried
+  kind = request.args.get('type')
+  if kind not in (None, 'venue', 'artist'):
+    abort(400)
+  limit = max(1, min(request.args.get('limit', 10, type=int), 25))
+  return jsonify([{
+    "type": kind,
+    "id": id,
+    "name": name,
+    "url": f'/{kind}s/{id}',
+  } for kind, id, name in suggest(request.args.get('q', ''), kind, limit)])
+
+
+#  Matches
+#  ----------------------------------------------------------------
+
+def ranked_matches(entity, other):
+  # venues seeking talent for an artist, or artists seeking a venue for a
+  # venue, ranked by genre overlap and location (see matching.py)
+  limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+  ranked = matches_for(entity, limit)
+  names = dict(db.session.query(other.id, other.name).filter(other.id.in_([id for _, id in ranked])).all())
+  kind = other.__tablename__.lower()
+  return jsonify([{
+    "id": id,
+    "name": names.get(id),
+    "score": round(score, 3),
+    "url": f'/{kind}s/{id}',
+  } for score, id in ranked])
+
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  artist = Artist.query.get_or_404(artist_id)
+  return ranked_matches(artist, Venue)
+
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  venue = Venue.query.get_or_404(venue_id)
+  return ranked_matches(venue, Artist)
+
+
+#  Exports
+#  ----------------------------------------------------------------
+
+@app.route('/export/<any(venues, artists, shows):kind>.<any(csv, jsonl):format>')
+@compression(gzip=1, br=1) # large streams, favour CPU over ratio
+def export_data(kind, format):
+  # full or incremental (?since=) dump streamed from a server-side cursor,
+  # ?gzip=1 for a compressed download; X-Export-Until is the next since (a
+  # full dump has every row, incremental ones stop at X-Export-Until)
+  try:
+    since = dateutil.parser.parse(request.args['since']) if request.args.get('since') else None
+  except (ValueError, OverflowError):
+    abort(400)
+  until = export_until()
+  compress = request.args.get('gzip') in ('1', 'true')
+
+  response = Response(stream_with_context(generate_export(kind, format, since, until, compress)),
+                      mimetype='application/gzip' if compress else FORMATS[format])
+  response.headers['Content-Disposition'] = f'attachment; filename={kind}.{format}' + ('.gz' if compress else '')
+  response.headers['X-Export-Until'] = until.isoformat()
+  return response
+
+
+#  Calendar feeds
+#  ----------------------------------------------------------------
+
+def calendar_feed(model, id):
+  # upcoming shows as iCalendar, cached per venue/artist in ical.py and
+  # answered with 304 while the client's ETag still matches
+  found = feed(model, id, request.url_root)
+  if found is None:
+    abort(404)
+  etag, body = found
+  response = Response(body, mimetype='text/calendar')
+  response.set_etag(etag)
+  response.cache_control.public = True
+  response.cache_control.max_age = feeds.ttl
+  return response.make_conditional(request)
+
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+def venue_calendar(venue_id):
+  return calendar_feed(Venue, venue_id)
+
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+def artist_calendar(artist_id):
+  return calendar_feed(Artist, artist_id)
+
+
+#  Thumbnails
+#  ----------------------------------------------------------------
+
+@app.route('/images/<token>/<int:width>')
+def image_thumbnail(token, width):
+  # a resized copy of an image_link from the disk cache in images.py; when
+  # the origin cannot be reached (or Pillow is missing) the browser is sent
+  # to the original image instead
+  image_link = thumbnails.source(token)
+  if image_link is None or width not in WIDTHS:
+    abort(404)
+  if not thumbnails.enabled:
+    return redirect(image_link)
+  try:
+    found = thumbnails.get(image_link, width)
+  except Exception:
+    app.logger.warning('thumbnail of %s failed', image_link, exc_info=True)
+    return redirect(image_link)
+  if found is None: # failed a moment ago, not retried yet
+    return redirect(image_link)
+  path, name, mimetype = found
+  response = send_file(path, mimetype=mimetype, etag=name, max_age=MAX_AGE, conditional=True)
+  # the URL changes whenever the image_link does
+  response.cache_control.immutable = True
+  return response
+
+
 
 #  Artists
 #  ----------------------------------------------------------------
@@ -268,33 +577,46 @@ def delete_venue(venue_id):
 def artists():
   # TODO: replace with real data returned from querying the database >> done!
 
-  # Query all artists from the database
-  artist_query = Artist.query.all()
+  # optional ?genre=Jazz&genre=Folk filter, an artist must carry every selected genre
+  selected_genres = request.args.getlist('genre')
+  criteria = [Artist.active]
+  if selected_genres:
+    criteria.append(genre_filter(Artist, selected_genres))
+
+  # the unfiltered list comes from the snapshot shared by all workers (see snapshot.py)
+  shared = None if selected_genres else snapshot.current()
+  if shared:
+    artist_rows = shared.artists()
+  else:
+    artist_rows = db.session.query(Artist.id, Artist.name).filter(*criteria).order_by(Artist.id).all()
 
   # Create a list of dictionaries with id and name for each artist
-  data = [{"id": artist.id, "name": artist.name} for artist in artist_query]
+  data = [{"id": id, "name": name} for id, name in artist_rows]
 
-  return render_template('pages/artists.html', artists=data)
+  return render_template('pages/artists.html', artists=data,
+                         facets=genre_facets(Artist, *criteria), selected_genres=selected_genres)
 
 
 @app.route('/artists/search', methods=['POST'])
+@admission.limited
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
+  # (single characters are now below SEARCH_MIN_LENGTH, see search_term_too_short)
   # search for "band" should return "The Wild Sax Band".
   # get search term from form
-  search_term = request.form.get('search_term', '')
+  search_term = request.form.get('search_term', '').strip()
   
-  # query the database using ilike for case-insensitive partial string match
-  artist_query = Artist.query.filter(Artist.name.ilike(f'%{search_term}%'))
+  selected_genres = request.values.getlist('genre')
+  if search_term_too_short(search_term):
+    return render_template('pages/search_artists.html', results={"count": 0, "data": []},
+                           search_term=search_term, facets=[], selected_genres=selected_genres)
 
-  # format the data
-  response={
-    "count": artist_query.count(),
-    "data": [{"id": artist.id, "name": artist.name} for artist in artist_query]
-  }
+  # case-insensitive partial match on the name, cached per normalized term
+  response = search_by_name(Artist, normalize(search_term), selected_genres)
 
-  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                         facets=response["facets"], selected_genres=selected_genres)
 
 
 @app.route('/artists/<int:artist_id>')
@@ -307,27 +629,19 @@ def show_artist(artist_id):
     if not artist:
         return render_template('errors/404.html'), 404
 
-    # get current time
-    now = datetime.now()
-
-    # get all shows for this artist and separate them into past and upcoming shows
-    shows = Show.query.filter_by(artist_id=artist_id).all()
-    past_shows = []
-    upcoming_shows = []
-    for show in shows:
-        venue = Venue.query.get(show.venue_id)
-        show_info = {
+    # get past shows (hot table plus ShowArchive) and upcoming shows (hot table only)
+    def show_info(show):
+        return {
+            "id": show.id,
+            "version": show.venue_version, # tile cache key, see show_artist.html
             "venue_id": show.venue_id,
-            "venue_name": venue.name,
-            "venue_image_link": venue.image_link,
+            "venue_name": show.venue_name,
+            "venue_image_link": show.venue_image_link,
             "start_time": str(show.start_time)
         }
 
-        # print(f"Show start time: {show.start_time}, Current time: {now}")
-        if show.start_time > now:
-            upcoming_shows.append(show_info)
-        else:
-            past_shows.append(show_info)
+    past_shows_data = [show_info(show) for show in past_shows(artist_id=artist_id)]
+    upcoming_shows_data = [show_info(show) for show in upcoming_shows(artist_id=artist_id)]
 
     # create the data dict
     data = {
@@ -342,10 +656,10 @@ def show_artist(artist_id):
         "seeking_venue": artist.seeking_venue,
         "seeking_description": artist.seeking_description,
         "image_link": artist.image_link,
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
+        "past_shows": past_shows_data,
+        "upcoming_shows": upcoming_shows_data,
+        "past_shows_count": len(past_shows_data),
+        "upcoming_shows_count": len(upcoming_shows_data)
     }
 
     return render_template('pages/show_artist.html', artist=data)
@@ -379,46 +693,44 @@ def edit_artist(artist_id):
 def edit_artist_submission(artist_id):
     # TODO: take values from the form submitted, and update existing
     # artist record with ID <artist_id> using the new attributes
+    # single optimistic-locked UPDATE, see updates.py
+    form = ArtistForm(request.form)
+    if not form.validate():  # Validation
+        message = []
+        for field, errors in form.errors.items():
+            for error in errors:
+                message.append(f"{field}: {error}")
+        flash('Errors: ' + ' '.join(message))
+        return redirect(url_for('edit_artist', artist_id=artist_id))
+
+    # Logging the fields and their values (sampled per endpoint, see log_config.py)
+    app.logger.info("Artist %s edit fields: %s", artist_id, request.form.to_dict())
+
     try:
-        artist = Artist.query.get(artist_id)
-        if artist:
-            form = ArtistForm(request.form)
-            if form.validate():  # Validation
-                # Logging the fields and their values
-                for field in request.form:
-                    app.logger.info(f"Field {field}: {request.form[field]}")
-
-                artist.name = form.name.data
-                artist.city = form.city.data
-                artist.genres = form.genres.data
-                artist.state = form.state.data
-                artist.phone = form.phone.data
-                artist.website = form.website_link.data
-                artist.facebook_link = form.facebook_link.data
-                artist.seeking_venue = form.seeking_venue.data
-                artist.seeking_description = form.seeking_description.data
-                artist.image_link = form.image_link.data
-                db.session.commit()
-                flash('Artist ' + artist.name + ' was successfully updated!')
-                return redirect(url_for('show_artist', artist_id=artist_id))
-            else:
-                message = []
-                for field, errors in form.errors.items():
-                    for error in errors:
-                        message.append(f"{field}: {error}")
-                flash('Errors: ' + ' '.join(message))
-                return redirect(url_for('edit_artist', artist_id=artist_id))
-        else:
-            abort(404)  # Artist not found
+        changes = {column: form.data[field] for field, column in ARTIST_FIELDS.items()}
+        status, _ = patch_row(Artist, artist_id, request.form.get('version', type=int), changes)
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
         print(e)
         flash('An error occurred. Artist could not be updated.')
+        return redirect(url_for('edit_artist', artist_id=artist_id))
     finally:
         db.session.close()
 
+    if status == 'missing':
+        abort(404)  # Artist not found
+    if status == 'stale':
+        flash('Artist ' + form.name.data + ' was changed by someone else while you were editing. Please review and save again.')
+        return redirect(url_for('edit_artist', artist_id=artist_id))
+    flash('Artist ' + form.name.data + ' was successfully updated!')
+    return redirect(url_for('show_artist', artist_id=artist_id))
 
 
+@app.route('/artists/<int:artist_id>', methods=['PATCH'])
+def patch_artist(artist_id):
+    return patch_entity(Artist, ArtistForm, ARTIST_FIELDS, artist_id)
+
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
@@ -437,6 +749,8 @@ def edit_venue(venue_id):
     form.seeking_talent.data = venue.seeking_talent
     form.seeking_description.data = venue.seeking_description
     form.image_link.data = venue.image_link
+    form.latitude.data = venue.latitude
+    form.longitude.data = venue.longitude
     # TODO: populate form with values from venue with ID <venue_id> >> done!
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
@@ -446,41 +760,92 @@ def edit_venue(venue_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
+    # single optimistic-locked UPDATE, see updates.py
+    form = VenueForm(request.form)
+    if not form.validate():
+        message = []
+        for field, err in form.errors.items():
+            message.append(field + ' ' + '|'.join(err))
+        flash('Errors ' + str(message))
+        return redirect(url_for('edit_venue', venue_id=venue_id))
+
     try:
-        form = VenueForm(request.form)
-        if form.validate():
-            venue = Venue.query.get(venue_id)
-            if venue:
-                venue.name = form.name.data
-                venue.genres = form.genres.data
-                venue.address = form.address.data
-                venue.city = form.city.data
-                venue.state = form.state.data
-                venue.phone = form.phone.data
-                venue.website = form.website_link.data
-                venue.facebook_link = form.facebook_link.data
-                venue.seeking_talent = form.seeking_talent.data
-                venue.seeking_description = form.seeking_description.data
-                venue.image_link = form.image_link.data
-
-                db.session.commit()
-                flash('Venue ' + venue.name + ' was successfully updated!')
-                return redirect(url_for('show_venue', venue_id=venue_id))
-            else:
-                abort(404)  # Venue not found
-        else:
-            message = []
-            for field, err in form.errors.items():
-                message.append(field + ' ' + '|'.join(err))
-            flash('Errors ' + str(message))
-            return redirect(url_for('edit_venue', venue_id=venue_id))
+        changes = {column: form.data[field] for field, column in VENUE_FIELDS.items()}
+        status, _ = patch_row(Venue, venue_id, request.form.get('version', type=int), changes)
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
         print(e)
         flash('An error occurred. Venue could not be updated.')
+        return redirect(url_for('edit_venue', venue_id=venue_id))
     finally:
         db.session.close()
 
+    if status == 'missing':
+        abort(404)  # Venue not found
+    if status == 'stale':
+        flash('Venue ' + form.name.data + ' was changed by someone else while you were editing. Please review and save again.')
+        return redirect(url_for('edit_venue', venue_id=venue_id))
+    flash('Venue ' + form.name.data + ' was successfully updated!')
+    return redirect(url_for('show_venue', venue_id=venue_id))
+
+
+@app.route('/venues/<int:venue_id>', methods=['PATCH'])
+def patch_venue(venue_id):
+    return patch_entity(Venue, VenueForm, VENUE_FIELDS, venue_id)
+
+
+def patch_entity(model, form_class, fields, id):
+    # JSON body with only the changed fields plus "version" (or an If-Match
+    # header) and an X-CSRFToken header (see /csrf-token); 409 with the
+    # current version when someone else saved first
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400)
+    version = payload.pop('version', None)
+    if version is None:
+        version = request.headers.get('If-Match', '').strip('"') or None
+    if version is None:
+        return jsonify({"error": "version is required"}), 428
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        abort(400)
+
+    unknown = set(payload) - set(fields)
+    if unknown:
+        return jsonify({"error": "unknown fields", "fields": sorted(unknown)}), 400
+    errors = validate_changes(form_class, fields, payload)
+    if errors:
+        return jsonify({"error": "invalid fields", "fields": errors}), 400
+    if not payload:
+        return jsonify({"id": id, "version": version, "updated": []})
+
+    try:
+        status, current = patch_row(model, id, version, {fields[field]: value for field, value in payload.items()})
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except IntegrityError:
+        # a name another row already has
+        db.session.rollback()
+        return jsonify({"error": f"another {model.__tablename__.lower()} already has that name"}), 409
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error('PATCH %s %s failed: %s', model.__tablename__, id, e)
+        return jsonify({"error": f"{model.__tablename__} could not be updated."}), 500
+    finally:
+        db.session.close()
+
+    if status == 'missing':
+        abort(404)
+    if status == 'stale':
+        return jsonify({"error": "version conflict", "version": current}), 409
+    response = jsonify({"id": id, "version": current, "updated": sorted(payload)})
+    response.headers['ETag'] = f'"{current}"'
+    return response
+
 
 #  Create Artist
 #  ----------------------------------------------------------------
@@ -514,6 +879,8 @@ def create_artist_submission():
         else:
           setattr(artist, field, form.data.get(field))  
 
+      artist.location = Location.get_or_create(artist.city, artist.state)
+
       # adding the new artist to the session
       db.session.add(artist)
       
@@ -552,35 +919,73 @@ def create_artist_submission():
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data. >> done!
-  shows_query = Show.query.all()
+  # optional ?from=&to= range (to is exclusive), ?format=json for the API
+  try:
+    start, end = parse_range(request.args)
+  except (ValueError, OverflowError):
+    abort(400)
 
   data = []
-  for show in shows_query:
+  for show in shows_between(start, end):
     show_data = {
-      "venue_id": show.venue_id,
-      "venue_name": Venue.query.get(show.venue_id).name,
-      "artist_id": show.artist_id,
-      "artist_name": Artist.query.get(show.artist_id).name,
-      "artist_image_link": Artist.query.get(show.artist_id).image_link,
-      "start_time": str(show.start_time)  # convert to string as JSON does not support datetime object
+      "id": show[0],
+      "venue_id": show[2],
+      "venue_name": show[3],
+      "artist_id": show[4],
+      "artist_name": show[5],
+      "artist_image_link": show[6],
+      "start_time": str(show[1]),  # convert to string as JSON does not support datetime object
+      "version": (show[7], show[8])  # venue and artist versions, the tile cache key in shows.html
     }
     data.append(show_data)
 
+  if request.args.get('format') == 'json':
+    return jsonify({
+      "from": start.isoformat() if start else None,
+      "to": end.isoformat() if end else None,
+      "count": len(data),
+      "data": [{key: value for key, value in show.items() if key != 'version'} for show in data],
+    })
+
   return render_template('pages/shows.html', shows=data)
 
 
+@app.route('/shows/calendar')
+def shows_calendar():
+  # month grid with the number of shows per day, ?month=2035-04
+  try:
+    month = datetime.strptime(request.args['month'], '%Y-%m') if 'month' in request.args else datetime.now()
+  except ValueError:
+    abort(400)
+
+  weeks = month_calendar(month.year, month.month)
+
+  if request.args.get('format') == 'json':
+    return jsonify({
+      "month": month.strftime('%Y-%m'),
+      "days": {str(day): count for week in weeks for day, count in filter(None, week)},
+    })
+
+  previous_month = (month.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+  next_month = (month.replace(day=28) + timedelta(days=4)).strftime('%Y-%m')
+  return render_template('pages/calendar.html', month=month, weeks=weeks,
+                         previous_month=previous_month, next_month=next_month, one_day=timedelta(days=1))
+
+
 @app.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
 
-  artists = Artist.query.all()  # get all artists
-  artist_choices = [(a.id, a.name) for a in artists]  # create choice tuples
-  form.artist_id.choices = artist_choices  # set choices for artist_id
-
-  venues = Venue.query.all()  # get all venues
-  venue_choices = [(str(v.id), v.name) for v in venues]  # create choice tuples
-  form.venue_id.choices = venue_choices  # set choices for venue_id
+  # active artists and venues from the shared snapshot when there is one
+  shared = snapshot.current()
+  if shared:
+    artists, venues = shared.artists(), shared.venues()
+  else:
+    artists = db.session.query(Artist.id, Artist.name).filter(Artist.active).all()  # get all active artists
+    venues = db.session.query(Venue.id, Venue.name).filter(Venue.active).all()  # get all active venues
+  form.artist_id.choices = [(id, name) for id, name in artists]  # set choices for artist_id
+  form.venue_id.choices = [(str(id), name) for id, name in venues]  # set choices for venue_id
   
   return render_template('forms/new_show.html', form=form)
 
@@ -592,11 +997,11 @@ def create_show_submission():
   # creating a new ShowForm instance from the form data
   form = ShowForm(request.form, meta={'csrf': False})
 
-  artists = Artist.query.all()  # get all artists
+  artists = Artist.query.filter(Artist.active).all()  # get all active artists
   artist_choices = [(str(a.id), a.name) for a in artists]  # create choice tuples
   form.artist_id.choices = artist_choices  # set choices for artist_id
 
-  venues = Venue.query.all()  # get all venues
+  venues = Venue.query.filter(Venue.active).all()  # get all active venues
   venue_choices = [(str(v.id), v.name) for v in venues]  # create choice tuples
   form.venue_id.choices = venue_choices  # set choices for venue_id
 
@@ -608,6 +1013,18 @@ def create_show_submission():
       # populate show attributes with form data
       for field in form.data:
         setattr(show, field, form.data.get(field))  
+      show.artist_id = int(show.artist_id)
+      if show.end_time is None:
+        show.end_time = show.start_time + SHOW_DURATION
+      if show.end_time <= show.start_time:
+        flash('A show has to end after it starts.')
+        return redirect(url_for('create_shows'))
+
+      # refuse double bookings; PostgreSQL also enforces this with exclusion constraints
+      conflict = None if is_postgres() else find_conflict(show.venue_id, show.artist_id, show.start_time, show.end_time)
+      if conflict is not None:
+        flash('The ' + conflict[0] + ' is already booked at that time. Show could not be listed.')
+        return redirect(url_for('create_shows'))
 
       # adding the new show to the session
       db.session.add(show)
@@ -622,6 +1039,10 @@ def create_show_submission():
       
       # rollback the session in case of error
       db.session.rollback()
+
+      if isinstance(e, IntegrityError) and getattr(e.orig, 'pgcode', None) == '23P01':  # exclusion_violation
+        flash('The venue or artist is already booked at that time. Show could not be listed.')
+        return redirect(url_for('create_shows'))
       
       # TODO: on unsuccessful db insert, flash an error instead. >> done!
       # e.g., flash('An error occurred. Show could not be listed.')
@@ -651,15 +1072,85 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    # queued, rotating JSON log; see log_config.py
+    configure_logging(app)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('archive-shows')
+@click.option('--days', default=30, help='Archive shows that started more than this many days ago.')
+@click.option('--batch-size', default=1000, help='Rows moved per transaction.')
+def archive_shows_command(days, batch_size):
+    # flask archive-shows, run from cron to keep the Show table small
+    moved = archive_past_shows(datetime.now() - timedelta(days=days), batch_size=batch_size)
+    click.echo(f'Archived {moved} shows.')
+
+@app.cli.command('geocode-venues')
+def geocode_venues_command():
+    # flask geocode-venues, after the coordinates migration or a bulk import;
+    # venues in cities missing from GEOCODE_TABLE need coordinates by hand
+    located = geocode_venues()
+    click.echo(f'Located {located} venues.')
+
+@app.cli.command('refresh-directory')
+def refresh_directory_command():
+    # flask refresh-directory, for cron or right after a bulk import
+    refresh_directory()
+    click.echo('Venue directory refreshed.')
+
+
+@app.cli.command('import-shows')
+@click.argument('csv_file', type=click.File())
+def import_shows_command(csv_file):
+    # flask import-shows shows.csv, columns venue_id,artist_id,start_time[,end_time]
+    rows = [{
+        "venue_id": int(row['venue_id']),
+        "artist_id": int(row['artist_id']),
+        "start_time": dateutil.parser.parse(row['start_time']),
+        "end_time": dateutil.parser.parse(row['end_time']) if row.get('end_time') else None,
+    } for row in csv.DictReader(csv_file)]
+
+    accepted, rejected = import_shows(rows)
+    db.session.commit()
+    for row, (kind, show_id) in rejected:
+        click.echo(f"Skipped {row['start_time']} venue {row['venue_id']} artist {row['artist_id']}: {kind} already booked")
+    click.echo(f'Imported {len(accepted)} shows, skipped {len(rejected)}.')
+
+
+@app.cli.command('worker')
+@click.option('--batch-size', default=100, help='Jobs claimed per round trip.')
+@click.option('--poll-interval', default=1.0, help='Seconds to wait when the queue is empty.')
+@click.option('--once', is_flag=True, help='Exit once the queue is drained instead of polling.')
+def worker_command(batch_size, poll_interval, once):
+    # flask worker, runs the jobs request handlers enqueue (see jobs.py)
+    processed = work(batch_size=batch_size, poll_interval=poll_interval, once=once)
+    click.echo(f'Processed {processed} jobs.')
+
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(KINDS))
+@click.option('--format', 'format', type=click.Choice(list(FORMATS)), default='csv')
+@click.option('--since', help='Only rows changed after this time, e.g. the last run\'s "until".')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', type=click.File('wb'), default='-')
+def export_command(kind, format, since, compress, output):
+    # flask export shows --format jsonl --since 2024-05-01T00:00 -o shows.jsonl
+    until = export_until()
+    since = dateutil.parser.parse(since) if since else None
+    for chunk in generate_export(kind, format, since, until, compress):
+        output.write(chunk)
+    click.echo(f'Exported changes up to {until.isoformat()}, pass it as --since next time.', err=True)
+
+
+@app.cli.command('profile-token')
+def profile_token_command():
+    # flask profile-token, send it as X-Profile: <token> or ?_profile=<token>
+    # to profile that request (needs PROFILE_DIR, see profiling.py)
+    click.echo(profiler.make_token())
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,86 @@
+"""Chunked backfills: dry-run estimate vs. rows actually updated, and timing.
+
+    python benchmarks/bench_backfill.py [--rows 2000000] [--missing 0.3] [--url postgresql://...]
+
+Generates a Show-shaped table (in a temporary SQLite file unless --url points
+elsewhere; the table is dropped afterwards) where a --missing fraction of rows
+lack end_time, asks plan_backfill() what a backfill of those rows would touch,
+then runs backfill_rows() and compares. On PostgreSQL the estimate comes from
+the planner after ANALYZE, elsewhere it is an exact count.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from online_migrations import backfill_rows, plan_backfill
+
+TABLE = 'bench_backfill_show'
+
+
+def generate(count, missing, seed):
+    rng = random.Random(seed)
+    origin = datetime(2030, 1, 1)
+    for id in range(1, count + 1):
+        start = origin + timedelta(hours=rng.randrange(24 * 365 * 5))
+        yield {'id': id, 'start_time': start,
+               'end_time': None if rng.random() < missing else start + timedelta(hours=3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--missing', type=float, default=0.3)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--url')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'backfill.db')
+    engine = sa.create_engine(url)
+    table = sa.Table(TABLE, sa.MetaData(),
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('start_time', sa.DateTime, nullable=False),
+                     sa.Column('end_time', sa.DateTime))
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    try:
+        started = time.perf_counter()
+        rows = generate(args.rows, args.missing, seed=1)
+        with engine.begin() as connection:
+            while batch := [row for _, row in zip(range(10000), rows)]:
+                connection.execute(table.insert(), batch)
+            if engine.dialect.name == 'postgresql':
+                connection.exec_driver_sql(f'ANALYZE "{TABLE}"')
+        print(f"generated {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        if engine.dialect.name == 'postgresql':
+            assignments = "end_time = start_time + interval '3 hours'"
+        else:
+            assignments = "end_time = datetime(start_time, '+3 hours')"
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            estimate, statements = plan_backfill(connection, TABLE, 'end_time IS NULL', args.batch_size)
+            actual = connection.exec_driver_sql(f'SELECT count(*) FROM "{TABLE}" WHERE end_time IS NULL').scalar()
+            print(f"dry run: about {estimate} rows in {statements} statements; {actual} rows actually match"
+                  f" ({100 * (estimate - actual) / max(actual, 1):+.1f}%)")
+
+            started = time.perf_counter()
+            updated = backfill_rows(connection, TABLE, assignments, 'end_time IS NULL', args.batch_size, pause=0)
+            elapsed = time.perf_counter() - started
+            print(f"backfill: {updated} rows in {elapsed:.1f}s ({updated / max(elapsed, 1e-9):.0f} rows/s)")
+            left = connection.exec_driver_sql(f'SELECT count(*) FROM "{TABLE}" WHERE end_time IS NULL').scalar()
+            print(f"rows left to backfill: {left}")
+    finally:
+        table.drop(engine)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Double-booking checks: per-venue/artist interval trees vs. scanning every show.
+
+    python benchmarks/bench_booking.py [--shows 100000] [--imports 5000]
+
+Builds a BookingIndex over --shows existing bookings, then checks --imports
+new bookings the way booking.import_shows does.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from booking import BookingIndex
+
+
+def generate(count, venues, artists, seed):
+    rng = random.Random(seed)
+    origin = datetime(2030, 1, 1)
+    for n in range(count):
+        start = origin + timedelta(hours=rng.randrange(24 * 365 * 5))
+        yield n, rng.randrange(venues), rng.randrange(artists), start, start + timedelta(hours=3)
+
+
+def naive_conflict(shows, venue_id, artist_id, start, end):
+    for _, show_venue, show_artist, show_start, show_end in shows:
+        if (show_venue == venue_id or show_artist == artist_id) and show_start < end and start < show_end:
+            return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shows', type=int, default=100000)
+    parser.add_argument('--imports', type=int, default=5000)
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=10000)
+    args = parser.parse_args()
+
+    existing = list(generate(args.shows, args.venues, args.artists, seed=1))
+    incoming = list(generate(args.imports, args.venues, args.artists, seed=2))
+
+    started = time.perf_counter()
+    index = BookingIndex()
+    for show in existing:
+        index.add(*show)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    tree_conflicts = 0
+    for show_id, venue_id, artist_id, start, end in incoming:
+        if index.conflict(venue_id, artist_id, start, end) is not None:
+            tree_conflicts += 1
+        else:
+            index.add(-show_id - 1, venue_id, artist_id, start, end)
+    tree = time.perf_counter() - started
+
+    # the naive scan is O(shows) per check, time a sample and extrapolate
+    sample = incoming[:max(1, min(200, args.imports))]
+    started = time.perf_counter()
+    for _, venue_id, artist_id, start, end in sample:
+        naive_conflict(existing, venue_id, artist_id, start, end)
+    naive = (time.perf_counter() - started) / len(sample) * args.imports
+
+    print(f"index build for {args.shows} shows: {build * 1000:.1f} ms")
+    print(f"interval tree, {args.imports} imports: {tree * 1000:.1f} ms ({tree_conflicts} conflicts)")
+    print(f"full scan,     {args.imports} imports: {naive * 1000:.1f} ms (extrapolated from {len(sample)})")
+
+
+if __name__ == '__main__':
+    main()
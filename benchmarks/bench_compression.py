@@ -0,0 +1,58 @@
+"""Response compression: bytes saved vs. CPU time per page and level.
+
+    python benchmarks/bench_compression.py [--pages /,/venues,/artists,/shows] [--rounds 20]
+
+Renders each page through the app's test client (the database from config.py)
+without compression, then compresses the body with gzip and, when the brotli
+package is installed, brotli at several levels, the same way compression.py
+does. Prints the compressed size, the share of bytes saved and the median CPU
+time per response, so a level can be picked per route.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from compression import brotli, compress
+
+DEFAULT_PAGES = '/,/venues,/artists,/shows,/venues/1,/artists/4,/export/shows.csv'
+LEVELS = [('gzip', 1), ('gzip', 6), ('gzip', 9)] + ([('br', 1), ('br', 4), ('br', 11)] if brotli else [])
+
+
+def timed(rounds, fn):
+    # median seconds of `rounds` calls and the last result
+    times = []
+    for _ in range(rounds):
+        started = time.process_time()
+        result = fn()
+        times.append(time.process_time() - started)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', default=DEFAULT_PAGES)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    print(f"{'page':<22} {'raw KB':>8} {'encoding':>9} {'KB':>8} {'saved':>7} {'ms':>8} {'MB/s':>8}")
+    for page in args.pages.split(','):
+        response = client.get(page, headers={'Accept-Encoding': 'identity'})
+        if response.status_code != 200:
+            print(f"{page:<22} HTTP {response.status_code}, skipped")
+            continue
+        body = response.get_data()
+        for encoding, level in LEVELS:
+            seconds, compressed = timed(args.rounds, lambda: compress(encoding, level, body))
+            print(f"{page:<22} {len(body) / 1024:>8.1f} {f'{encoding}:{level}':>9} {len(compressed) / 1024:>8.1f}"
+                  f" {100 * (1 - len(compressed) / len(body)):>6.1f}% {seconds * 1000:>8.3f}"
+                  f" {len(body) / max(seconds, 1e-9) / 1e6:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Request latency with a slow log disk: synchronous FileHandler vs queued logging.
+
+    python benchmarks/bench_logging.py [--requests 200] [--disk-delay-ms 5]
+
+Each request logs the same ten form fields the edit handlers used to log. The
+disk is simulated by sleeping inside the handler's emit().
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from log_config import configure_logging
+
+
+FIELDS = {
+    'name': 'The Wild Sax Band', 'city': 'San Francisco', 'state': 'CA',
+    'phone': '(432) 325-5432', 'genres': 'Jazz', 'image_link': 'https://example.com/a.jpg',
+    'facebook_link': 'https://www.facebook.com/x', 'website_link': '',
+    'seeking_venue': 'y', 'seeking_description': 'Looking for gigs',
+}
+
+
+def slow(handler, delay):
+    emit = handler.emit
+
+    def slow_emit(record):
+        time.sleep(delay)
+        emit(record)
+    handler.emit = slow_emit
+
+
+def make_app(mode, log_file, delay):
+    app = Flask(__name__)
+    app.config['LOG_FILE'] = log_file
+    app.config['LOG_SAMPLE_RATES'] = {}
+
+    if mode == 'sync':
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+        slow(handler, delay)
+        app.logger.setLevel(logging.INFO)
+        app.logger.addHandler(handler)
+    else:
+        listener = configure_logging(app)
+        for handler in listener.handlers:
+            slow(handler, delay)
+
+    @app.route('/edit', methods=['POST'])
+    def edit():
+        for field, value in FIELDS.items():
+            app.logger.info(f"Field {field}: {value}")
+        return 'ok'
+
+    return app
+
+
+def run(mode, requests, delay):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(mode, os.path.join(tmp, 'error.log'), delay)
+        client = app.test_client()
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            client.post('/edit')
+            timings.append((time.perf_counter() - start) * 1000)
+        if 'log_listener' in app.extensions:
+            app.extensions['log_listener'].stop()
+    timings.sort()
+    return {
+        'mean': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p99': timings[int(len(timings) * 0.99) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--disk-delay-ms', type=float, nargs='+', default=[0, 1, 5, 20])
+    args = parser.parse_args()
+
+    print(f"{'disk delay':>10} {'mode':>6} {'mean ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for delay_ms in args.disk_delay_ms:
+        for mode in ('sync', 'queued'):
+            result = run(mode, args.requests, delay_ms / 1000.0)
+            print(f"{delay_ms:>10} {mode:>6} {result['mean']:>9.3f} {result['p50']:>8.3f} {result['p99']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
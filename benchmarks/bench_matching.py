@@ -0,0 +1,99 @@
+"""Genre matching: bitset ranking over every candidate vs. comparing genre sets.
+
+    python benchmarks/bench_matching.py [--artists 100000] [--venues 10000] [--queries 200]
+
+Fills a MatchIndex with seeking artists and venues (in memory, no database),
+then ranks venues for random artists and artists for random venues, and times
+single-row updates the way the mapper events apply them.
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matching import MatchIndex, CITY_BONUS, STATE_BONUS
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+          'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+          'Rock n Roll', 'Soul', 'Swing', 'Other']
+
+
+def generate(count, locations, seed):
+    rng = random.Random(seed)
+    for id in range(count):
+        location_id = rng.randrange(locations)
+        yield id, rng.sample(GENRES, rng.randint(1, 5)), location_id, f'S{location_id % 50}'
+
+
+def naive_rank(rows, genres, location_id, state, limit=10):
+    # the same score computed from Python sets, as a per-row loader would
+    wanted = set(genres)
+    scored = []
+    for id, other, other_location, other_state in rows:
+        other = set(other)
+        shared = len(wanted & other)
+        if not shared:
+            continue
+        score = shared / len(wanted | other)
+        if other_location == location_id:
+            score += CITY_BONUS
+        elif other_state == state:
+            score += STATE_BONUS
+        scored.append((score, id))
+    return heapq.nlargest(limit, scored)
+
+
+def timed(queries, fn):
+    started = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--artists', type=int, default=100000)
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--locations', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    artists = list(generate(args.artists, args.locations, seed=1))
+    venues = list(generate(args.venues, args.locations, seed=2))
+
+    started = time.perf_counter()
+    index = MatchIndex()
+    for id, genres, location_id, state in artists:
+        index.set('Artist', id, genres, location_id, state, True)
+    for id, genres, location_id, state in venues:
+        index.set('Venue', id, genres, location_id, state, True)
+    print(f"indexed {args.artists} artists and {args.venues} venues in {time.perf_counter() - started:.2f}s")
+
+    rng = random.Random(3)
+    artist_queries = rng.sample(artists, min(args.queries, len(artists)))
+    venue_queries = rng.sample(venues, min(args.queries, len(venues)))
+
+    results = [
+        ('venues for an artist',
+         timed(artist_queries, lambda row: index.rank('Venue', *row[1:])),
+         timed(artist_queries, lambda row: naive_rank(venues, *row[1:]))),
+        ('artists for a venue',
+         timed(venue_queries, lambda row: index.rank('Artist', *row[1:])),
+         timed(venue_queries, lambda row: naive_rank(artists, *row[1:]))),
+    ]
+    print(f"{'query':>22} {'bitset ms':>10} {'sets ms':>9}")
+    for name, bitset, naive in results:
+        print(f"{name:>22} {bitset:>10.2f} {naive:>9.2f}")
+
+    updates = list(generate(args.queries, args.locations, seed=4))
+    update = timed(updates, lambda row: index.set('Artist', rng.randrange(args.artists), *row[1:], True))
+    remove = timed(updates, lambda row: index.remove('Artist', rng.randrange(args.artists)))
+    print(f"single-row update {update * 1000:.1f} us, removal {remove * 1000:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Nearby venues: KD-tree and geohash grid vs. measuring every venue.
+
+    python benchmarks/bench_nearby.py [--venues 100000] [--queries 200] [--radius 25] [-k 20]
+
+Scatters venues around the cities in us_cities.csv (in memory, no database),
+then answers radius and k-nearest queries from random points three ways: a
+scan computing every distance, the KDTree used on SQLite and the geohash grid
+used on PostgreSQL, with the B-tree prefix lookups simulated by bisecting a
+sorted list of geohashes. Every answer is checked against the scan.
+"""
+import argparse
+import bisect
+import csv
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import (KNN_START_PRECISION, KDTree, cells, covered_km, distance_km, encode, precision_for)
+
+CITIES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'us_cities.csv')
+
+
+def generate(count, seed):
+    # (id, latitude, longitude), most venues within ~30 km of a city
+    with open(CITIES, newline='') as file:
+        cities = [(float(row['latitude']), float(row['longitude'])) for row in csv.DictReader(file)]
+    rng = random.Random(seed)
+    for id in range(count):
+        latitude, longitude = rng.choice(cities)
+        yield id, latitude + rng.gauss(0, 0.2), longitude + rng.gauss(0, 0.25)
+
+
+class Grid:
+    # the geohash column and its index, as a sorted list
+    def __init__(self, points):
+        self.rows = sorted((encode(latitude, longitude), id, latitude, longitude) for id, latitude, longitude in points)
+        self.keys = [row[0] for row in self.rows]
+
+    def scan(self, prefix):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '{') # '{' sorts after every base32 character
+        return self.rows[start:end]
+
+    def nearby(self, latitude, longitude, radius_km=None, k=None):
+        # geo._grid_nearby() with the SQL swapped for scan(); also returns
+        # the number of candidate rows read
+        precision = precision_for(latitude, radius_km) if radius_km else KNN_START_PRECISION
+        read = 0
+        while True:
+            if precision:
+                rows = [row for cell in cells(latitude, longitude, precision) for row in self.scan(cell)]
+                covered = covered_km(latitude, precision)
+            else:
+                rows, covered = self.rows, math.inf
+            read += len(rows)
+            reach = min(covered, radius_km or math.inf)
+            found = sorted((distance, id) for distance, id in
+                           ((distance_km(latitude, longitude, row[2], row[3]), row[1]) for row in rows) if distance <= reach)
+            if not precision or (radius_km and covered >= radius_km) or (k and len(found) >= k):
+                return (found[:k] if k else found), read
+            precision = precision - 1 or None
+
+
+def scan(points, latitude, longitude, radius_km=None, k=None):
+    found = sorted((distance_km(latitude, longitude, row_latitude, row_longitude), id)
+                   for id, row_latitude, row_longitude in points)
+    if radius_km is not None:
+        found = [row for row in found if row[0] <= radius_km]
+    return found[:k] if k else found
+
+
+def same(expected, found):
+    # the same distances, and the same ids apart from ties at the cut-off
+    if len(expected) != len(found) or any(abs(a[0] - b[0]) > 1e-6 for a, b in zip(expected, found)):
+        return False
+    cutoff = expected[-1][0] - 1e-6 if expected else 0
+    return {id for distance, id in expected if distance < cutoff} <= {id for _, id in found}
+
+
+def timed(queries, fn):
+    # median milliseconds per query and the results
+    times, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(fn(*query))
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--venues', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=25)
+    parser.add_argument('-k', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    points = list(generate(args.venues, args.seed))
+    rng = random.Random(args.seed + 1)
+    queries = [(latitude + rng.gauss(0, 0.3), longitude + rng.gauss(0, 0.3))
+               for _, latitude, longitude in rng.sample(points, args.queries)]
+
+    started = time.perf_counter()
+    tree = KDTree(points)
+    print(f'KD-tree over {args.venues} venues built in {time.perf_counter() - started:.2f}s')
+    started = time.perf_counter()
+    grid = Grid(points)
+    print(f'geohash column computed and sorted in {time.perf_counter() - started:.2f}s')
+
+    cases = [
+        (f'within {args.radius:g} km', dict(radius_km=args.radius),
+         lambda lat, lon: tree.within(lat, lon, args.radius)),
+        (f'{args.k} nearest', dict(k=args.k),
+         lambda lat, lon: tree.nearest(lat, lon, args.k)),
+    ]
+    print(f"{'query':<16} {'method':<8} {'ms':>9} {'rows read':>10} {'results':>8}  correct")
+    for label, options, tree_query in cases:
+        scan_ms, expected = timed(queries[:max(1, len(queries) // 10)], lambda lat, lon: scan(points, lat, lon, **options))
+        print(f"{label:<16} {'scan':<8} {scan_ms:>9.3f} {len(points):>10} {statistics.mean(map(len, expected)):>8.1f}")
+
+        tree_ms, found = timed(queries, tree_query)
+        found = [sorted(result) for result in found]
+        correct = all(same(a, b) for a, b in zip(expected, found))
+        print(f"{label:<16} {'kd-tree':<8} {tree_ms:>9.3f} {'':>10} {statistics.mean(map(len, found)):>8.1f}  {correct}")
+
+        grid_ms, results = timed(queries, lambda lat, lon: grid.nearby(lat, lon, **options))
+        correct = all(same(a, b) for a, (b, _) in zip(expected, results))
+        print(f"{label:<16} {'grid':<8} {grid_ms:>9.3f} {statistics.mean(read for _, read in results):>10.0f}"
+              f" {statistics.mean(len(b) for b, _ in results):>8.1f}  {correct}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Date-range and calendar queries over a large Show table, with and without ix_Show_start_time.
+
+    python benchmarks/bench_show_range.py [--rows 2000000] [--url sqlite:///shows_bench.db]
+
+Pass a PostgreSQL --url to measure the BRIN index; SQLite builds a B-tree.
+Rows are generated in start_time order, the way shows are appended in production.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, Venue, Artist, Show
+from show_calendar import shows_between, month_calendar
+
+
+def populate(rows, batch=50000):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Venue.__table__.insert(), [{"id": i, "name": f"Venue {i}"} for i in range(1, 101)])
+    db.session.execute(Artist.__table__.insert(), [{"id": i, "name": f"Artist {i}"} for i in range(1, 1001)])
+
+    start = datetime(2015, 1, 1)
+    step = timedelta(days=20 * 365) / rows
+    for offset in range(0, rows, batch):
+        db.session.execute(Show.__table__.insert(), [{
+            "start_time": start + step * n,
+            "venue_id": n % 100 + 1,
+            "artist_id": n % 1000 + 1,
+        } for n in range(offset, min(offset + batch, rows))])
+    db.session.commit()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('ANALYZE "Show"'))
+        db.session.commit()
+
+
+def timed(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def measure():
+    week = (datetime(2030, 6, 1), datetime(2030, 6, 8))
+    return {
+        'week of shows': timed(lambda: shows_between(*week)),
+        'month calendar': timed(lambda: month_calendar(2030, 6)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--url', default='sqlite:///shows_bench.db')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.url
+    db.init_app(app)
+
+    with app.app_context():
+        started = time.perf_counter()
+        populate(args.rows)
+        print(f"generated {args.rows} shows in {time.perf_counter() - started:.1f}s on {db.engine.dialect.name}")
+
+        with_index = measure()
+        db.session.execute(text('DROP INDEX "ix_Show_start_time"'))
+        db.session.commit()
+        without_index = measure()
+
+        print(f"{'query':>16} {'indexed ms':>11} {'seq scan ms':>12}")
+        for name in with_index:
+            print(f"{name:>16} {with_index[name]:>11.2f} {without_index[name]:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""Mixed read/write load test against the app under a multi-worker WSGI server.
+
+    python benchmarks/loadtest.py --database-url URL [--workers 4] [--concurrency 16] [--duration 30]
+                                  [--mix venues=10,venue=15,create_show=2,...]
+                                  [--min-rps 50] [--max-error-rate 0.01] [--max-p99 1000]
+
+Starts gunicorn (or pre-forked Werkzeug workers when gunicorn is not installed)
+on a free local port against --database-url, or targets a running deployment
+with --url. Writes create real shows and edit venues/artists, so the database
+must be a disposable, migrated and seeded one; against --url, give the write
+endpoints a weight of 0 unless that deployment is disposable too.
+Every virtual user sends its own X-Forwarded-For address, so the per-client
+search rate limits apply per user. The started server trusts that header
+(PROXY_FIX_X_FOR) and, as virtual users do not pause between requests, runs
+with --search-rate / --search-burst instead of the configured limits.
+Prints throughput, error rate and a latency histogram per endpoint, and exits
+non-zero when a --min-rps / --max-error-rate / --max-p99 gate is missed.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# upper bounds in ms; the last bucket takes everything slower
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+DEFAULT_MIX = 'home=5,venues=10,artists=10,shows=10,search_venues=8,search_artists=8,' \
+              'venue=15,artist=15,create_show=3,edit_venue=2,edit_artist=2'
+
+SEARCH_TERMS = ('a', 'the', 'music', 'hop', 'guns', 'jazz', 'park', 'x')
+
+
+#----------------------------------------------------------------------------#
+# Server.
+#----------------------------------------------------------------------------#
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, port, database_url, search_rate, search_burst):
+    if shutil.which('gunicorn'):
+        command = ['gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+                   '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--serve', str(port), '--workers', str(workers)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (ROOT, os.environ.get('PYTHONPATH')))))
+    env.pop('FLASK_DEBUG', None)
+    # read by app.config.from_prefixed_env()
+    env.update(FLASK_SQLALCHEMY_DATABASE_URI=database_url, FLASK_PROXY_FIX_X_FOR='1',
+               FLASK_SEARCH_RATE=str(search_rate), FLASK_SEARCH_BURST=str(search_burst))
+    return subprocess.Popen(command, cwd=os.getcwd(), env=env, stderr=subprocess.DEVNULL)
+
+
+def serve(port, workers):
+    # stand-in for gunicorn: pre-forked single-threaded Werkzeug servers taking
+    # turns on one listening socket. Each worker imports the app after the
+    # fork, so per-process state (connection pool, caches, threads) is its own.
+    from werkzeug.serving import make_server
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(128)
+    if not hasattr(os, 'fork'):
+        from app import app
+        make_server('127.0.0.1', port, app, threaded=True, fd=listener.fileno()).serve_forever()
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            from app import app
+            make_server('127.0.0.1', port, app, fd=listener.fileno()).serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(*args):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    os.wait()
+    stop()
+
+
+def wait_ready(base_url, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            sys.exit(f'server exited with status {server.returncode}')
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=2).read()
+            return
+        except OSError:  # refused, reset or still importing
+            time.sleep(0.2)
+    sys.exit(f'{base_url} did not come up within {timeout}s')
+
+
+#----------------------------------------------------------------------------#
+# Virtual users.
+#----------------------------------------------------------------------------#
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # time the write itself, not the page it redirects to
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    # one cookie jar (session + CSRF token) and client address per virtual user
+    def __init__(self, base_url, address=None):
+        self.base_url = base_url
+        self.address = address
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+        self.csrf_token = None
+        self.versions = {}
+
+    def request(self, method, path, form=None, json_body=None, headers=None):
+        # (status, body); redirects come back as their 3xx status
+        headers = dict(headers or {})
+        if self.address:
+            headers['X-Forwarded-For'] = self.address
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(form, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def token(self):
+        if self.csrf_token is None:
+            _, body = self.request('GET', '/shows/create')
+            match = re.search(rb'name="csrf_token"[^>]*value="([^"]+)"', body)
+            self.csrf_token = match.group(1).decode() if match else ''
+        return self.csrf_token
+
+
+def discover_ids(client, path):
+    _, body = client.request('GET', path)
+    ids = sorted({int(id) for id in re.findall(rb'href="%s/(\d+)"' % path.encode(), body)})
+    if not ids:
+        sys.exit(f'no ids found on {path}, is the database empty?')
+    return ids
+
+
+def build_scenarios(venue_ids, artist_ids):
+    # name -> fn(client) returning the HTTP status; 409 (lost an edit race) and
+    # shed searches (429/503) are reported separately, not as errors
+    def search(path):
+        return lambda c: c.request('POST', path, form={'search_term': random.choice(SEARCH_TERMS),
+                                                       'csrf_token': c.token()})[0]
+
+    def create_show(c):
+        # far in the future and spread out, double bookings are rare but handled
+        start = datetime(2100, 1, 1) + timedelta(minutes=random.randrange(0, 50 * 365 * 24 * 60, 15))
+        return c.request('POST', '/shows/create', form={
+            'artist_id': random.choice(artist_ids),
+            'venue_id': random.choice(venue_ids),
+            'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+            'csrf_token': c.token(),
+        })[0]
+
+    def edit(kind, ids):
+        def run(c):
+            id = random.choice(ids)
+            path = f'/{kind}/{id}'
+            version = c.versions.get(path, 1)
+            status, body = c.request('PATCH', path, headers={'X-CSRFToken': c.token()}, json_body={
+                'seeking_description': f'load test {random.random():.6f}', 'version': version})
+            if status in (200, 409):
+                c.versions[path] = json.loads(body)['version']
+            return status
+        return run
+
+    return {
+        'home': lambda c: c.request('GET', '/')[0],
+        'venues': lambda c: c.request('GET', '/venues')[0],
+        'artists': lambda c: c.request('GET', '/artists')[0],
+        'shows': lambda c: c.request('GET', '/shows')[0],
+        'search_venues': search('/venues/search'),
+        'search_artists': search('/artists/search'),
+        'venue': lambda c: c.request('GET', f'/venues/{random.choice(venue_ids)}')[0],
+        'artist': lambda c: c.request('GET', f'/artists/{random.choice(artist_ids)}')[0],
+        'create_show': create_show,
+        'edit_venue': edit('venues', venue_ids),
+        'edit_artist': edit('artists', artist_ids),
+    }
+
+
+def parse_mix(spec, scenarios):
+    mix = {}
+    for part in filter(None, spec.split(',')):
+        name, _, weight = part.partition('=')
+        if name not in scenarios:
+            sys.exit(f'unknown endpoint {name!r}, choose from {", ".join(scenarios)}')
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        sys.exit('the mix needs at least one endpoint with a positive weight')
+    return mix
+
+
+#----------------------------------------------------------------------------#
+# Measurements.
+#----------------------------------------------------------------------------#
+
+class Stats:
+    def __init__(self):
+        self.latencies = []  # ms
+        self.statuses = {}
+        self.errors = 0
+        self.conflicts = 0
+        self.shed = 0  # 429/503 from search admission control, see admission.py
+
+    def record(self, ms, status):
+        self.latencies.append(ms)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 409:
+            self.conflicts += 1
+        elif status in (429, 503):
+            self.shed += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.errors += other.errors
+        self.conflicts += other.conflicts
+        self.shed += other.shed
+
+    def percentile(self, p):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+    def histogram(self):
+        counts = [0] * len(BUCKETS)
+        for ms in self.latencies:
+            counts[next(i for i, bound in enumerate(BUCKETS) if ms <= bound)] += 1
+        return counts
+
+
+def client_address(number):
+    # distinct per virtual user, from the 198.18.0.0/15 benchmarking range
+    high, low = divmod(number + 1, 256)
+    return f'198.18.{high}.{low}'
+
+
+def virtual_user(base_url, address, scenarios, mix, warmup_until, stop_at, results):
+    client = Client(base_url, address)
+    names, weights = list(mix), list(mix.values())
+    stats = {}
+    while True:
+        now = time.monotonic()
+        if now >= stop_at:
+            break
+        name = random.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            status = scenarios[name](client)
+        except (OSError, ValueError):
+            status = None  # refused, reset, timed out or unparseable
+        elapsed = (time.perf_counter() - started) * 1000
+        if now >= warmup_until:
+            stats.setdefault(name, Stats()).record(elapsed, status)
+    results.append(stats)
+
+
+def report(per_endpoint, seconds):
+    total = Stats()
+    for stats in per_endpoint.values():
+        total.merge(stats)
+
+    print(f"{'endpoint':>15} {'reqs':>7} {'req/s':>8} {'err %':>6} {'409':>5} {'shed':>5} "
+          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in sorted(per_endpoint.items()) + [('total', total)]:
+        count = len(stats.latencies)
+        print(f"{name:>15} {count:>7} {count / seconds:>8.1f} {100 * stats.errors / max(count, 1):>6.2f} "
+              f"{stats.conflicts:>5} {stats.shed:>5} {stats.percentile(50):>8.1f} {stats.percentile(90):>8.1f} "
+              f"{stats.percentile(99):>8.1f} {max(stats.latencies, default=0):>8.1f}")
+
+    print()
+    labels = [f'<={bound:g}' if bound != float('inf') else f'>{BUCKETS[-2]:g}' for bound in BUCKETS]
+    print(f"{'latency ms':>15} " + ' '.join(f'{label:>7}' for label in labels))
+    for name, stats in sorted(per_endpoint.items()) + [('total', total)]:
+        print(f'{name:>15} ' + ' '.join(f'{count:>7}' for count in stats.histogram()))
+
+    unexpected = {status: count for status, count in total.statuses.items()
+                  if status is None or (status >= 400 and status not in (409, 429, 503))}
+    if unexpected:
+        print('\nerror statuses: ' + ', '.join(f'{status or "no response"}: {count}'
+                                               for status, count in sorted(unexpected.items(), key=str)))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='test a running deployment instead of starting a server')
+    parser.add_argument('--database-url', help='disposable database for the started server (required without --url)')
+    parser.add_argument('--workers', type=int, default=4, help='WSGI worker processes to start')
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before that')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='endpoint=weight,...')
+    parser.add_argument('--search-rate', type=float, default=50,
+                        help='SEARCH_RATE of the started server, per virtual user and endpoint')
+    parser.add_argument('--search-burst', type=int, default=100, help='SEARCH_BURST of the started server')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--min-rps', type=float, help='fail below this total throughput')
+    parser.add_argument('--max-error-rate', type=float, help='fail above this fraction of errors, e.g. 0.01')
+    parser.add_argument('--max-p99', type=float, help='fail above this overall p99 latency in ms')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        sys.path.insert(0, ROOT)
+        return serve(args.serve, args.workers)
+    if not args.url and not args.database_url:
+        parser.error('--database-url is required: the test writes, so it never runs against config.py\'s database')
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = None
+    base_url = args.url.rstrip('/') if args.url else None
+    if base_url is None:
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        server = start_server(args.workers, port, args.database_url, args.search_rate, args.search_burst)
+    try:
+        wait_ready(base_url, server)
+        probe = Client(base_url)
+        scenarios = build_scenarios(discover_ids(probe, '/venues'), discover_ids(probe, '/artists'))
+        mix = parse_mix(args.mix, scenarios)
+
+        print(f"{args.concurrency} virtual users for {args.duration:g}s against {base_url}"
+              + (f" ({args.workers} workers)" if server else ''))
+        results = []
+        started = time.monotonic()
+        warmup_until = started + args.warmup
+        stop_at = warmup_until + args.duration
+        threads = [threading.Thread(target=virtual_user,
+                                    args=(base_url, client_address(number), scenarios, mix, warmup_until, stop_at, results))
+                   for number in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    per_endpoint = {}
+    for stats in results:
+        for name, endpoint_stats in stats.items():
+            per_endpoint.setdefault(name, Stats()).merge(endpoint_stats)
+    total = report(per_endpoint, args.duration)
+
+    count = len(total.latencies)
+    failures = []
+    if args.min_rps is not None and count / args.duration < args.min_rps:
+        failures.append(f'throughput {count / args.duration:.1f} req/s is below {args.min_rps:g}')
+    if args.max_error_rate is not None and total.errors / max(count, 1) > args.max_error_rate:
+        failures.append(f'error rate {total.errors / max(count, 1):.2%} is above {args.max_error_rate:.2%}')
+    if args.max_p99 is not None and total.percentile(99) > args.max_p99:
+        failures.append(f'p99 {total.percentile(99):.1f} ms is above {args.max_p99:g} ms')
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import random
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, written_table, Show, Venue, Artist, SHOW_DURATION
+
+
+#----------------------------------------------------------------------------#
+# Interval tree.
+#----------------------------------------------------------------------------#
+
+# A treap keyed on start time where every node also carries the largest end
+# time of its subtree, so overlap queries can skip whole subtrees: insert,
+# remove and "does anything overlap [start, end)" are O(log n) expected.
+
+class _Node:
+    __slots__ = ('start', 'end', 'key', 'priority', 'max_end', 'left', 'right')
+
+    def __init__(self, start, end, key):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.priority = random.random()
+        self.max_end = end
+        self.left = None
+        self.right = None
+
+    def update(self):
+        self.max_end = self.end
+        if self.left is not None and self.left.max_end > self.max_end:
+            self.max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > self.max_end:
+            self.max_end = self.right.max_end
+
+
+class IntervalTree:
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, start, end, key=None):
+        # `key` identifies the interval for remove() and is returned by overlap()
+        self.root = self._insert(self.root, _Node(start, end, key))
+        self.size += 1
+
+    def remove(self, start, key=None):
+        self.root, removed = self._remove(self.root, start, key)
+        if removed:
+            self.size -= 1
+        return removed
+
+    def overlap(self, start, end):
+        # (start, end, key) of one interval overlapping [start, end), or None
+        node = self.root
+        while node is not None:
+            if node.start < end and start < node.end:
+                return node.start, node.end, node.key
+            if node.left is not None and node.left.max_end > start:
+                node = node.left
+            elif node.start < end:
+                node = node.right
+            else:
+                return None
+        return None
+
+    def _insert(self, node, new):
+        if node is None:
+            return new
+        if (new.start, id(new)) < (node.start, id(node)):
+            node.left = self._insert(node.left, new)
+            if node.left.priority > node.priority:
+                node = self._rotate_right(node)
+        else:
+            node.right = self._insert(node.right, new)
+            if node.right.priority > node.priority:
+                node = self._rotate_left(node)
+        node.update()
+        return node
+
+    def _remove(self, node, start, key):
+        if node is None:
+            return None, False
+        if node.start == start and node.key == key:
+            return self._merge(node.left, node.right), True
+        removed = False
+        if start <= node.start:
+            node.left, removed = self._remove(node.left, start, key)
+        if not removed and start >= node.start:
+            node.right, removed = self._remove(node.right, start, key)
+        node.update()
+        return node, removed
+
+    def _merge(self, left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            left.update()
+            return left
+        right.left = self._merge(left, right.left)
+        right.update()
+        return right
+
+    @staticmethod
+    def _rotate_right(node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        node.update()
+        pivot.update()
+        return pivot
+
+    @staticmethod
+    def _rotate_left(node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        node.update()
+        pivot.update()
+        return pivot
+
+
+#----------------------------------------------------------------------------#
+# Booking index.
+#----------------------------------------------------------------------------#
+
+class BookingIndex:
+    # one interval tree per venue and per artist
+    def __init__(self):
+        self.trees = {}
+
+    def _tree(self, kind, id):
+        tree = self.trees.get((kind, id))
+        if tree is None:
+            tree = self.trees[(kind, id)] = IntervalTree()
+        return tree
+
+    def add(self, show_id, venue_id, artist_id, start, end):
+        self._tree('venue', venue_id).insert(start, end, show_id)
+        self._tree('artist', artist_id).insert(start, end, show_id)
+
+    def remove(self, show_id, venue_id, artist_id, start):
+        for kind, id in (('venue', venue_id), ('artist', artist_id)):
+            tree = self.trees.get((kind, id))
+            if tree is not None:
+                tree.remove(start, show_id)
+
+    def conflict(self, venue_id, artist_id, start, end):
+        # ('venue' | 'artist', show_id) of a clashing booking, or None
+        for kind, id in (('venue', venue_id), ('artist', artist_id)):
+            tree = self.trees.get((kind, id))
+            hit = tree.overlap(start, end) if tree is not None else None
+            if hit is not None:
+                return kind, hit[2]
+        return None
+
+    @classmethod
+    def load(cls, start=None):
+        # index every show (optionally only those ending after `start`)
+        index = cls()
+        query = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time)
+        if start is not None:
+            query = query.filter(Show.end_time > start)
+        for show_id, venue_id, artist_id, show_start, show_end in query:
+            index.add(show_id, venue_id, artist_id, show_start, show_end)
+        return index
+
+
+_index = None
+
+
+def booking_index():
+    # process-wide index for dialects without an exclusion constraint
+    global _index
+    if _index is None:
+        _index = BookingIndex.load()
+    return _index
+
+
+def find_conflict(venue_id, artist_id, start, end):
+    # PostgreSQL enforces this with the Show exclusion constraints, callers
+    # there only need to handle the IntegrityError on insert
+    return booking_index().conflict(venue_id, artist_id, start, end)
+
+
+def import_shows(rows):
+    # bulk import of dicts with venue_id, artist_id, start_time and optional
+    # end_time; checks each row against existing shows and the rows accepted
+    # before it, returns (accepted Show objects, [(row, conflict)])
+    rows = list(rows)
+    if not rows:
+        return [], []
+    index = BookingIndex.load(start=min(row['start_time'] for row in rows))
+    accepted, rejected = [], []
+    for row in rows:
+        end = row.get('end_time') or row['start_time'] + SHOW_DURATION
+        conflict = index.conflict(row['venue_id'], row['artist_id'], row['start_time'], end)
+        if conflict is not None:
+            rejected.append((row, conflict))
+            continue
+        show = Show(venue_id=row['venue_id'], artist_id=row['artist_id'],
+                    start_time=row['start_time'], end_time=end)
+        accepted.append(show)
+        index.add(id(show), show.venue_id, show.artist_id, show.start_time, end)
+    db.session.add_all(accepted)
+    return accepted, rejected
+
+
+#----------------------------------------------------------------------------#
+# Keeping the process-wide index current.
+#----------------------------------------------------------------------------#
+
+def _after_insert(mapper, connection, target):
+    if _index is not None:
+        _index.add(target.id, target.venue_id, target.artist_id, target.start_time, target.end_time)
+
+
+def _after_delete(mapper, connection, target):
+    if _index is not None:
+        _index.remove(target.id, target.venue_id, target.artist_id, target.start_time)
+
+
+def _after_update(mapper, connection, target):
+    # the old interval is not at hand here, rebuild lazily
+    global _index
+    _index = None
+
+
+event.listen(Show, 'after_insert', _after_insert)
+event.listen(Show, 'after_update', _after_update)
+event.listen(Show, 'after_delete', _after_delete)
+
+
+@event.listens_for(Session, 'after_rollback')
+@event.listens_for(Venue, 'after_delete')
+@event.listens_for(Artist, 'after_delete')
+def _drop_index(*args):
+    # rollbacks and ON DELETE CASCADE remove shows without Show mapper
+    # events, rebuild lazily
+    global _index
+    _index = None
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _drop_index_on_bulk(orm_execute_state):
+    # so do set-based statements: bulk deletes of venues or artists cascade,
+    # the archive job deletes moved shows
+    if written_table(orm_execute_state) in ('Show', 'Venue', 'Artist'):
+        _drop_index()
@@ -0,0 +1,131 @@
+import itertools
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+
+#----------------------------------------------------------------------------#
+# Encoders.
+#----------------------------------------------------------------------------#
+
+class Encoder:
+    # incremental gzip or brotli; flush() hands out everything compressed so
+    # far, so a streamed response keeps streaming
+    def __init__(self, encoding, level):
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=level)
+            self.compress = self.compressor.process
+            self.flush = self.compressor.flush
+            self.finish = self.compressor.finish
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress = self.compressor.compress
+            self.flush = lambda: self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.compressor.flush
+
+
+def compress(encoding, level, data):
+    encoder = Encoder(encoding, level)
+    return encoder.compress(data) + encoder.finish()
+
+
+def _stream(encoder, chunks):
+    for chunk in chunks:
+        compressed = encoder.compress(chunk) + encoder.flush()
+        if compressed:
+            yield compressed
+    yield encoder.finish()
+
+
+def compression(gzip=None, br=None, enabled=True):
+    # per-route levels, under @app.route:
+    #   @compression(gzip=1, br=1)  big streamed exports, favour CPU
+    #   @compression(enabled=False)
+    def decorate(view):
+        view.compression = {'gzip': gzip, 'br': br} if enabled else None
+        return view
+    return decorate
+
+
+#----------------------------------------------------------------------------#
+# Response hook.
+#----------------------------------------------------------------------------#
+
+class ResponseCompressor:
+    # compresses text responses with the best of br (when the brotli package
+    # is installed) and gzip the client accepts. Bodies under
+    # COMPRESS_MIN_SIZE bytes, types outside COMPRESS_MIMETYPES and responses
+    # that already carry a Content-Encoding are left alone, and so are files
+    # sent with send_file() (static assets, thumbnails). Streamed responses are
+    # compressed chunk by chunk. COMPRESS_ENABLED = False switches it off.
+    def __init__(self):
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.levels = {'gzip': app.config.get('COMPRESS_LEVEL_GZIP', 6), 'br': app.config.get('COMPRESS_LEVEL_BR', 4)}
+        self.mimetypes = set(app.config.get('COMPRESS_MIMETYPES', (
+            'text/html', 'text/css', 'text/plain', 'text/csv', 'text/calendar', 'text/javascript',
+            'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml')))
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        app.after_request(self.compress)
+
+    def compressible(self, response):
+        return (response.mimetype in self.mimetypes
+                and 200 <= response.status_code < 300 and response.status_code != 204
+                and not response.direct_passthrough
+                and 'Content-Encoding' not in response.headers
+                and 'no-transform' not in response.headers.get('Cache-Control', ''))
+
+    def compress(self, response):
+        if not self.compressible(response):
+            return response
+        # caches must key on Accept-Encoding, whichever variant this is
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+
+        view = self.app.view_functions.get(request.endpoint)
+        levels = getattr(view, 'compression', {})
+        if levels is None:
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        level = levels.get(encoding) or self.levels[encoding]
+
+        if response.is_streamed:
+            # read ahead until the stream proves big enough to be worth it
+            head, size, chunks = [], 0, response.iter_encoded()
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                response.set_data(b''.join(head))
+                return response
+            response.response = _stream(Encoder(encoding, level), itertools.chain(head, chunks))
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(encoding, level, data))
+        response.headers['Content-Encoding'] = encoding
+        # the compressed bytes differ, but If-None-Match still compares weakly
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compressor = ResponseCompressor()
@@ -1,4 +1,6 @@
-from app import app, db, Venue, Artist, Show
+from app import app, db, Venue, Artist, Show, Location
+from models import ShowArchive, Job
+from venue_directory import create_directory, drop_directory, refresh_directory
 from datetime import datetime
 
 with app.app_context():
@@ -6,16 +8,27 @@ with app.app_context():
     artist_meta = Artist.__table__
     venue_meta = Venue.__table__
     show_meta = Show.__table__
+    show_archive_meta = ShowArchive.__table__
+    location_meta = Location.__table__
+    job_meta = Job.__table__
 
     # Explicitly drop each table in correct order
+    with db.engine.begin() as connection:
+        drop_directory(connection)
+    job_meta.drop(db.engine, checkfirst=True)
+    show_archive_meta.drop(db.engine, checkfirst=True)
     show_meta.drop(db.engine, checkfirst=True)
     artist_meta.drop(db.engine, checkfirst=True)
     venue_meta.drop(db.engine, checkfirst=True)
+    location_meta.drop(db.engine, checkfirst=True)
 
     # Explicitly create each table
+    location_meta.create(db.engine, checkfirst=True)
     artist_meta.create(db.engine, checkfirst=True)
     venue_meta.create(db.engine, checkfirst=True)
     show_meta.create(db.engine, checkfirst=True)
+    show_archive_meta.create(db.engine, checkfirst=True)
+    job_meta.create(db.engine, checkfirst=True)
 
     # Add venues
     venue1 = Venue(
@@ -103,6 +116,9 @@ with app.app_context():
     db.session.add(artist2)
     db.session.add(artist3)
 
+    # Link venues and artists to their normalized city/state
+    for entity in (venue1, venue2, venue3, artist1, artist2, artist3):
+        entity.location = Location.get_or_create(entity.city, entity.state)
 
     # Add shows
     show1 = Show(venue_id=1, artist_id=4, start_time=datetime.strptime('2019-05-21T21:30:00.000Z', '%Y-%m-%dT%H:%M:%S.%fZ'))
@@ -120,3 +136,8 @@ with app.app_context():
 
     # Commit the transaction to save changes to the database
     db.session.commit()
+
+    # Precompute the venue directory served by /venues
+    with db.engine.begin() as connection:
+        create_directory(connection)
+    refresh_directory()
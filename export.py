@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import literal, select, union_all
+
+from models import db, Venue, Artist, Show, ShowArchive
+
+
+#----------------------------------------------------------------------------#
+# Streaming exports.
+#----------------------------------------------------------------------------#
+
+# Rows come from a server-side cursor (yield_per, which implies stream_results
+# on PostgreSQL) and leave as ~64 KB chunks of CSV or JSON lines, optionally
+# gzipped, so memory stays flat whatever the table size. `since`/`until`
+# select rows by updated_at for incremental exports: pass the previous
+# export's `until` as the next `since`. `until` trails the clock by COMMIT_LAG
+# so rows stamped by a transaction that commits after the export started are
+# not skipped. It only bounds incremental exports: a full export has every
+# row, and the next incremental one repeats those changed in the last
+# COMMIT_LAG (consumers upsert by id). Deletions are not exported.
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+COMMIT_LAG = timedelta(minutes=1)
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+_columns = {
+    'venues': ('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'website', 'facebook_link',
+               'image_link', 'seeking_talent', 'seeking_description', 'active', 'updated_at'),
+    'artists': ('id', 'name', 'city', 'state', 'phone', 'genres', 'website', 'facebook_link',
+                'image_link', 'seeking_venue', 'seeking_description', 'active', 'updated_at'),
+    'shows': ('id', 'start_time', 'end_time', 'venue_id', 'artist_id', 'archived', 'updated_at'),
+}
+KINDS = tuple(_columns)
+
+
+def export_until():
+    return datetime.now() - COMMIT_LAG
+
+
+def export_select(kind, since=None, until=None):
+    if since is None:
+        until = None # full export, see above
+    if kind == 'shows':
+        hot = Show.__table__
+        statement = select(hot.c.id, hot.c.start_time, hot.c.end_time, hot.c.venue_id, hot.c.artist_id,
+                           literal(False).label('archived'), hot.c.updated_at)
+        if since is not None:
+            statement = statement.where(hot.c.updated_at > since)
+        if until is not None:
+            statement = statement.where(hot.c.updated_at <= until)
+        if since is not None:
+            # archived shows were exported while they were still in Show
+            return statement.order_by(hot.c.id)
+        archive = ShowArchive.__table__
+        return union_all(statement, select(
+            archive.c.id, archive.c.start_time, archive.c.end_time, archive.c.venue_id,
+            archive.c.artist_id, literal(True).label('archived'), archive.c.updated_at))
+
+    model = Venue if kind == 'venues' else Artist
+    statement = select(*(getattr(model, name) for name in _columns[kind])).order_by(model.id)
+    if since is not None:
+        statement = statement.where(model.updated_at > since)
+    if until is not None:
+        statement = statement.where(model.updated_at <= until)
+    return statement
+
+
+def export_rows(kind, since=None, until=None):
+    result = db.session.execute(export_select(kind, since, until).execution_options(yield_per=BATCH_SIZE))
+    for partition in result.partitions():
+        yield from partition
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ';'.join(value)
+    return value
+
+
+def _encode(kind, format, rows):
+    # str chunks of about CHUNK_SIZE
+    columns = _columns[kind]
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = lambda row: writer.writerow([_csv_value(value) for value in row])
+    else:
+        write = lambda row: buffer.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+    for row in rows:
+        write(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def generate_export(kind, format='csv', since=None, until=None, compress=False):
+    # bytes chunks of the whole export
+    chunks = (chunk.encode() for chunk in _encode(kind, format, export_rows(kind, since, until)))
+    if not compress:
+        yield from chunks
+        return
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = gzip.compress(chunk)
+        if compressed:
+            yield compressed
+    yield gzip.flush()
@@ -1,3 +1,5 @@
+import os
+
 from fabric.api import local, settings, abort
 from fabric.contrib.console import confirm
 
@@ -7,12 +9,35 @@ from fabric.contrib.console import confirm
 def test():
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest -q tests", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def _loadtest(database_url, duration=30, concurrency=16, workers=4, min_rps=50, max_error_rate=0.01,
+              max_p99=1000):
+    with settings(warn_only=True):
+        return local(
+            "python benchmarks/loadtest.py --database-url '{}' --duration {} --concurrency {} --workers {} "
+            "--min-rps {} --max-error-rate {} --max-p99 {}".format(
+                database_url, duration, concurrency, workers, min_rps, max_error_rate, max_p99)
+        )
+
+
+def loadtest(database_url=None, duration=30, concurrency=16, workers=4, min_rps=50, max_error_rate=0.01,
+             max_p99=1000):
+    # mixed read/write load against a local multi-worker server, see
+    # benchmarks/loadtest.py. It creates shows and edits venues/artists, so
+    # it only runs against a disposable (migrated, seeded) database:
+    #   fab loadtest:database_url=postgresql://localhost:5432/fyyur_load
+    if not database_url:
+        abort("loadtest writes to the database; pass a disposable one with database_url=...")
+    result = _loadtest(database_url, duration, concurrency, workers, min_rps, max_error_rate, max_p99)
+    if result.failed and not confirm("Load test failed. Continue?"):
+        abort("Aborted at user request.")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -40,13 +65,18 @@ def heroku():
 
 def heroku_test():
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python -m pytest -q tests"
     )
 
 
 def deploy():
     pull()
     test()
+    # with LOADTEST_DATABASE_URL set (a disposable database, see loadtest)
+    # nothing is deployed unless the load test meets its gates
+    database_url = os.environ.get('LOADTEST_DATABASE_URL')
+    if database_url and _loadtest(database_url).failed:
+        abort("Load test failed, not deploying.")
     commit()
     heroku()
     heroku_test()
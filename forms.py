@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import FlaskForm #Change Form to FlaskForm bc of CSRF support
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, FloatField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 import re
 from wtforms import ValidationError
 
@@ -34,6 +34,11 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # optional, shows without an end time are booked for three hours
+    end_time = DateTimeField(
+        'end_time',
+        validators=[Optional()]
+    )
 
 class VenueForm(FlaskForm):
     name = StringField(
@@ -145,6 +150,14 @@ class VenueForm(FlaskForm):
         'seeking_description'
     )
 
+    # left blank, the city's coordinates from the geocoding table (see geo.py)
+    latitude = FloatField(
+        'latitude', validators=[Optional(), NumberRange(-90, 90)]
+    )
+    longitude = FloatField(
+        'longitude', validators=[Optional(), NumberRange(-180, 180)]
+    )
+
 
 
 class ArtistForm(FlaskForm):
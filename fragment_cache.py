@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+#----------------------------------------------------------------------------#
+# Template fragment cache.
+#----------------------------------------------------------------------------#
+
+# {% cache show.id, show.version %} ... {% endcache %} renders its body once
+# per distinct key and reuses the markup afterwards. The key is the tag's
+# template and line plus the given values, so it has to name everything the
+# body shows: an id and the version columns of the rows it displays, which
+# every update bumps. Entries are never invalidated, only pushed out of a
+# bounded LRU (FRAGMENT_CACHE_SIZE) once newer versions stop using them.
+
+class LRUCache:
+    def __init__(self, size=10000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        location = nodes.Const(f'{parser.name}:{lineno}')
+        return nodes.CallBlock(self.call_method('_render', [location, nodes.List(keys)]), [], [], body) \
+            .set_lineno(lineno)
+
+    def _render(self, location, keys, caller):
+        fragments = self.environment.fragment_cache
+        if fragments is None or not fragments.enabled:
+            return caller()
+        key = (location, *keys)
+        markup = fragments.cache.get(key)
+        if markup is None:
+            markup = caller()
+            fragments.cache.set(key, markup)
+        return markup
+
+
+class FragmentCache:
+    def __init__(self):
+        self.cache = LRUCache()
+        self.enabled = True
+
+    def init_app(self, app):
+        self.cache.size = app.config.get('FRAGMENT_CACHE_SIZE', 10000)
+        self.enabled = app.config.get('FRAGMENT_CACHE_ENABLED', True)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+
+fragments = FragmentCache()
@@ -0,0 +1,119 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, is_postgres, written_table, Venue, Artist
+
+
+#----------------------------------------------------------------------------#
+# Genre filters and facet counts.
+#----------------------------------------------------------------------------#
+
+# PostgreSQL answers both from the GIN index on the genres array; other
+# dialects (SQLite in development) fall back to an in-process inverted index.
+
+def genre_filter(model, genres):
+    # clause matching rows that carry every genre in `genres`
+    if is_postgres():
+        return model.genres.contains(list(genres))
+    return model.id.in_(inverted_index(model).matching(genres))
+
+
+def genre_facets(model, *criteria):
+    # [(genre, count)] over the rows matching `criteria`, most common first
+    if is_postgres():
+        genres = db.session.query(func.unnest(model.genres).label('genre')).filter(*criteria).subquery()
+        rows = db.session.query(genres.c.genre, func.count()).group_by(genres.c.genre) \
+            .order_by(func.count().desc(), genres.c.genre).all()
+        return [(genre, count) for genre, count in rows]
+
+    index = inverted_index(model)
+    if not criteria:
+        return index.facets()
+    ids = {row.id for row in db.session.query(model.id).filter(*criteria)}
+    return index.facets(ids)
+
+
+#----------------------------------------------------------------------------#
+# Inverted index fallback.
+#----------------------------------------------------------------------------#
+
+class GenreIndex:
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.genres_by_id = {}
+
+    def add(self, id, genres):
+        self.remove(id)
+        genres = frozenset(genres or ())
+        self.genres_by_id[id] = genres
+        for genre in genres:
+            self.postings[genre].add(id)
+
+    def remove(self, id):
+        for genre in self.genres_by_id.pop(id, ()):
+            self.postings[genre].discard(id)
+            if not self.postings[genre]:
+                del self.postings[genre]
+
+    def matching(self, genres):
+        # intersect the smallest posting lists first
+        postings = sorted((self.postings.get(genre, set()) for genre in set(genres)), key=len)
+        if not postings:
+            return set(self.genres_by_id)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result &= ids
+        return result
+
+    def facets(self, ids=None):
+        if ids is None:
+            counts = Counter({genre: len(ids) for genre, ids in self.postings.items()})
+        else:
+            counts = Counter(genre for id in ids for genre in self.genres_by_id.get(id, ()))
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+_indexes = {}
+
+
+def inverted_index(model):
+    index = _indexes.get(model)
+    if index is None:
+        index = GenreIndex()
+        for id, genres in db.session.query(model.id, model.genres):
+            index.add(id, genres)
+        _indexes[model] = index
+    return index
+
+
+def _update_index(mapper, connection, target):
+    index = _indexes.get(type(target))
+    if index is not None:
+        index.add(target.id, target.genres)
+
+
+def _remove_from_index(mapper, connection, target):
+    index = _indexes.get(type(target))
+    if index is not None:
+        index.remove(target.id)
+
+
+for _model in (Venue, Artist):
+    event.listen(_model, 'after_insert', _update_index)
+    event.listen(_model, 'after_update', _update_index)
+    event.listen(_model, 'after_delete', _remove_from_index)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_indexes(*args):
+    # rolled-back flushes bypass the mapper events above, rebuild lazily
+    _indexes.clear()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _drop_indexes_on_bulk(orm_execute_state):
+    # so do set-based INSERT/UPDATE/DELETE (bulk endpoints, PATCH)
+    if written_table(orm_execute_state) in ('Venue', 'Artist'):
+        _indexes.clear()
@@ -0,0 +1,418 @@
+import csv
+import heapq
+import math
+import os
+import threading
+from operator import itemgetter
+
+from sqlalchemy import event, inspect, or_, update
+from sqlalchemy.orm import Session
+
+from models import db, is_postgres, after_set_based_write, Location, Venue
+
+
+#----------------------------------------------------------------------------#
+# Geohash grid.
+#----------------------------------------------------------------------------#
+
+# Venue.geohash holds GEOHASH_PRECISION characters of the venue's geohash, so
+# every cell a venue falls in is a prefix of it and one B-tree index answers
+# "venues in cell 9q8y" as geohash LIKE '9q8y%'. A nearby query reads the
+# cell around the point and its eight neighbours, at the finest precision
+# whose cells are still wider than the search radius, and measures the
+# exact distance of only those candidates.
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 9 # cells of about 5 x 5 m
+KNN_START_PRECISION = 5 # about 5 x 5 km, widened until the k nearest are certain
+_base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    latitudes, longitudes = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, count, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, value = (longitudes, longitude) if even else (latitudes, latitude)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits, bounds[0] = bits * 2 + 1, middle
+        else:
+            bits, bounds[1] = bits * 2, middle
+        even = not even
+        count += 1
+        if count == 5:
+            chars.append(_base32[bits])
+            bits = count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # (height, width) of a cell in degrees
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def cells(latitude, longitude, precision):
+    # the cell containing the point and its neighbours, fewer at the poles
+    height, width = cell_size(precision)
+    found = set()
+    for dy in (-height, 0, height):
+        if not -90 <= latitude + dy <= 90:
+            continue
+        for dx in (-width, 0, width):
+            found.add(encode(latitude + dy, (longitude + dx + 180) % 360 - 180, precision))
+    return sorted(found)
+
+
+def covered_km(latitude, precision):
+    # every point within this distance lies in cells(latitude, ..., precision):
+    # the 3 x 3 block reaches at least a whole cell beyond the point each way
+    height, width = cell_size(precision)
+    across = math.asin(min(1.0, math.cos(math.radians(latitude)) * math.sin(math.radians(min(width, 90)))))
+    return EARTH_RADIUS_KM * min(math.radians(height), across)
+
+
+def precision_for(latitude, radius_km):
+    # the finest precision whose 3 x 3 block covers the radius, None when not
+    # even the coarsest does
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if covered_km(latitude, precision) >= radius_km:
+            return precision
+    return None
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _grid_nearby(latitude, longitude, radius_km, k):
+    # [(distance, id)] from the geohash index
+    precision = precision_for(latitude, radius_km) if radius_km else KNN_START_PRECISION
+    while True:
+        query = db.session.query(Venue.id, Venue.latitude, Venue.longitude) \
+            .filter(Venue.active, Venue.geohash.isnot(None))
+        covered = math.inf
+        if precision:
+            query = query.filter(or_(*[Venue.geohash.like(f'{cell}%') for cell in cells(latitude, longitude, precision)]))
+            covered = covered_km(latitude, precision)
+        reach = min(covered, radius_km or math.inf)
+        found = []
+        for id, row_latitude, row_longitude in query:
+            distance = distance_km(latitude, longitude, row_latitude, row_longitude)
+            if distance <= reach:
+                found.append((distance, id))
+        found.sort()
+        # done once the block covers the radius or holds k venues nearer
+        # than anything outside it could be
+        if not precision or (radius_km and covered >= radius_km) or (k and len(found) >= k):
+            return found[:k] if k else found
+        precision = precision - 1 or None
+
+
+#----------------------------------------------------------------------------#
+# KD-tree fallback.
+#----------------------------------------------------------------------------#
+
+# SQLite cannot use the geohash index for LIKE (case_sensitive_like is off),
+# so it keeps the venues in a KD-tree in memory instead, like the genre index
+# in genres.py. Points are unit vectors, where the straight-line (chord)
+# distance grows with the great-circle distance, so there is no special case
+# for the date line or the poles.
+
+LEAF_SIZE = 16
+REBUILD_AFTER = 1000 # rows written since the tree was built, scanned linearly until then
+
+
+def _unit(latitude, longitude):
+    phi, lam = math.radians(latitude), math.radians(longitude)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+def _chord2(radius_km):
+    # squared chord length of a great-circle distance
+    return (2 * math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi) / 2)) ** 2
+
+
+def _km(chord2):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord2) / 2))
+
+
+class KDTree:
+    # static; inner nodes are (axis, split, left, right) tuples, leaves lists
+    # of up to LEAF_SIZE (x, y, z, id)
+    def __init__(self, points):
+        items = [(*_unit(latitude, longitude), id) for id, latitude, longitude in points]
+        self.size = len(items)
+        self.root = self._build(items) if items else None
+
+    def _build(self, items):
+        if len(items) <= LEAF_SIZE:
+            return items
+        # split the axis the points spread furthest along, at the median
+        axis = max(range(3), key=lambda axis: max(item[axis] for item in items) - min(item[axis] for item in items))
+        items.sort(key=itemgetter(axis))
+        middle = len(items) // 2
+        return axis, items[middle][axis], self._build(items[:middle]), self._build(items[middle:])
+
+    def within(self, latitude, longitude, radius_km, skip=()):
+        # [(distance, id)] of the points within radius_km, unordered
+        qx, qy, qz = query = _unit(latitude, longitude)
+        limit = _chord2(radius_km)
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            if node.__class__ is list:
+                for x, y, z, id in node:
+                    d = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if d <= limit and id not in skip:
+                        found.append((_km(d), id))
+                continue
+            axis, split, left, right = node
+            diff = query[axis] - split
+            stack.append(left if diff < 0 else right)
+            if diff * diff <= limit:
+                stack.append(right if diff < 0 else left)
+        return found
+
+    def nearest(self, latitude, longitude, k, radius_km=None, skip=()):
+        # [(distance, id)] of the k nearest points, optionally within radius_km
+        qx, qy, qz = query = _unit(latitude, longitude)
+        heap = [] # (-d, id), the farthest of the best k on top
+        bound = _chord2(radius_km) if radius_km is not None else math.inf
+
+        def visit(node):
+            nonlocal bound
+            if node.__class__ is list:
+                for x, y, z, id in node:
+                    d = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if d <= bound and id not in skip:
+                        if len(heap) < k:
+                            heapq.heappush(heap, (-d, id))
+                        else:
+                            heapq.heappushpop(heap, (-d, id))
+                        if len(heap) == k:
+                            bound = min(bound, -heap[0][0])
+                return
+            axis, split, left, right = node
+            diff = query[axis] - split
+            visit(left if diff < 0 else right)
+            if diff * diff <= bound:
+                visit(right if diff < 0 else left)
+
+        if self.root is not None and k > 0:
+            visit(self.root)
+        return sorted((_km(-d), id) for d, id in heap)
+
+
+class VenueLocator:
+    # the tree plus the venues written since it was built: id -> (latitude,
+    # longitude), or None once the venue left (deleted, deactivated or without
+    # coordinates). Those are skipped in the tree and scanned instead. The
+    # tree never changes; writers in other threads update `changed` under
+    # the lock and a query works on a copy of it.
+    def __init__(self, points):
+        self.tree = KDTree(points)
+        self.changed = {}
+        self.lock = threading.Lock()
+
+    def set(self, id, latitude, longitude):
+        with self.lock:
+            self.changed[id] = (latitude, longitude) if latitude is not None and longitude is not None else None
+
+    def remove(self, id):
+        with self.lock:
+            self.changed[id] = None
+
+    def stale(self):
+        return len(self.changed) > REBUILD_AFTER
+
+    def nearby(self, latitude, longitude, radius_km=None, k=None):
+        with self.lock:
+            changed = dict(self.changed)
+        if k:
+            found = self.tree.nearest(latitude, longitude, k, radius_km, skip=changed)
+        else:
+            found = self.tree.within(latitude, longitude, radius_km, skip=changed)
+        for id, point in changed.items():
+            if point is not None:
+                distance = distance_km(latitude, longitude, *point)
+                if radius_km is None or distance <= radius_km:
+                    found.append((distance, id))
+        found.sort()
+        return found[:k] if k else found
+
+
+_locator = None
+_locator_lock = threading.Lock() # one rebuild at a time
+
+
+def venue_locator():
+    # the handlers below read _locator once: another thread may drop or
+    # replace it at any time
+    global _locator
+    locator = _locator
+    if locator is None or locator.stale():
+        with _locator_lock:
+            locator = _locator
+            if locator is None or locator.stale():
+                locator = _locator = VenueLocator(
+                    db.session.query(Venue.id, Venue.latitude, Venue.longitude)
+                    .filter(Venue.active, Venue.latitude.isnot(None), Venue.longitude.isnot(None)))
+    return locator
+
+
+def _after_write(mapper, connection, target):
+    locator = _locator
+    if locator is not None:
+        if target.active:
+            locator.set(target.id, target.latitude, target.longitude)
+        else:
+            locator.remove(target.id)
+
+
+def _after_delete(mapper, connection, target):
+    locator = _locator
+    if locator is not None:
+        locator.remove(target.id)
+
+
+event.listen(Venue, 'after_insert', _after_write)
+event.listen(Venue, 'after_update', _after_write)
+event.listen(Venue, 'after_delete', _after_delete)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_locator(*args):
+    global _locator
+    _locator = None
+
+
+@after_set_based_write('Venue')
+def _reload_rows(session, table, ids, rows):
+    # PATCH, edit forms and bulk endpoints: follow just the targeted rows
+    locator = _locator
+    if locator is None:
+        return
+    if ids is None:
+        _drop_locator()
+        return
+    for id in ids:
+        row = rows.get(id)
+        if row is not None and row.active:
+            locator.set(id, row.latitude, row.longitude)
+        else:
+            locator.remove(id)
+
+
+#----------------------------------------------------------------------------#
+# Nearby venues.
+#----------------------------------------------------------------------------#
+
+def nearby_venues(latitude, longitude, radius_km=None, k=None):
+    # the k nearest active venues within radius_km (either may be None, not
+    # both), nearest first: [{"id", "name", "city", "state", "distance"}]
+    if radius_km is None and not k:
+        raise ValueError('a radius or a number of venues is required')
+    if is_postgres():
+        found = _grid_nearby(latitude, longitude, radius_km, k)
+    else:
+        found = venue_locator().nearby(latitude, longitude, radius_km, k)
+    rows = {row.id: row for row in db.session.query(Venue.id, Venue.name, Venue.city, Venue.state)
+            .filter(Venue.id.in_([id for _, id in found]))}
+    return [{"id": id, "name": rows[id].name, "city": rows[id].city, "state": rows[id].state,
+             "distance": distance} for distance, id in found if id in rows]
+
+
+#----------------------------------------------------------------------------#
+# Geocoding.
+#----------------------------------------------------------------------------#
+
+class Geocoder:
+    # offline city -> coordinates table: a CSV with city,state,latitude,longitude
+    # columns at GEOCODE_TABLE (us_cities.csv next to app.py by default, swap
+    # in a full gazetteer export for better coverage). Cities are matched the
+    # way Location matches them, so "san francisco " finds San Francisco.
+    def __init__(self):
+        self.path = None
+        self.table = None
+
+    def init_app(self, app):
+        self.path = app.config.get('GEOCODE_TABLE') or os.path.join(app.root_path, 'us_cities.csv')
+        self.table = None
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        with open(self.path, newline='', encoding='utf-8') as file:
+            return {Location.normalize(row['city'], row['state']): (float(row['latitude']), float(row['longitude']))
+                    for row in csv.DictReader(file)}
+
+    def lookup(self, city, state):
+        # (latitude, longitude) of the city, None when it is not in the table
+        if self.table is None:
+            self.table = self.load()
+        return self.table.get(Location.normalize(city, state))
+
+
+geocoder = Geocoder()
+
+
+def locate(values):
+    # completes a dict of Venue column values: coordinates entered by hand
+    # win, blank ones (or a new city and state without any) are looked up in
+    # the geocoding table; geohash always follows the coordinates
+    latitude, longitude = values.get('latitude'), values.get('longitude')
+    if (latitude is None) != (longitude is None):
+        raise ValueError('latitude and longitude have to be given together')
+    if latitude is None:
+        if not values.keys() & {'latitude', 'longitude', 'city', 'state'}:
+            return values
+        latitude, longitude = geocoder.lookup(values.get('city'), values.get('state')) or (None, None)
+    else:
+        # PATCH bodies are JSON, not checked by the form's validators
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            raise ValueError('latitude and longitude have to be numbers') from None
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError('latitude or longitude out of range')
+    values.update(latitude=latitude, longitude=longitude,
+                  geohash=encode(latitude, longitude) if latitude is not None else None)
+    return values
+
+
+@event.listens_for(Venue, 'before_insert')
+@event.listens_for(Venue, 'before_update')
+def _locate_venue(mapper, connection, target):
+    state = inspect(target)
+    changed = set()
+    for names in (('latitude', 'longitude'), ('city', 'state')):
+        if not state.has_identity or any(state.attrs[name].history.has_changes() for name in names):
+            changed.update(names)
+    if changed:
+        for name, value in locate({name: getattr(target, name) for name in changed}).items():
+            setattr(target, name, value)
+
+
+def geocode_venues():
+    # fills in the coordinates of venues without any from the geocoding
+    # table, one UPDATE per city; returns the number of venues located
+    located = 0
+    locations = db.session.query(Location).filter(
+        Location.id.in_(db.session.query(Venue.location_id).filter(Venue.latitude.is_(None))))
+    for location in locations.all():
+        point = geocoder.lookup(location.city, location.state)
+        if point is None:
+            continue
+        # a Core UPDATE, so PostgreSQL returns the ids the indexes need, see
+        # models._notify_set_based_write
+        venue = Venue.__table__
+        statement = update(venue).where(venue.c.location_id == location.id, venue.c.latitude.is_(None)) \
+            .values(latitude=point[0], longitude=point[1], geohash=encode(*point), version=venue.c.version + 1)
+        located += db.session.execute(statement).rowcount
+        db.session.commit()
+    return located
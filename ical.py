@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from models import db, after_set_based_write, Venue, Artist, Show
+
+
+#----------------------------------------------------------------------------#
+# iCalendar feeds.
+#----------------------------------------------------------------------------#
+
+def _escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    # content lines are folded at 75 octets, continuations start with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(encoded):
+        end = min(start + (75 if not parts else 74), len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1  # do not split a UTF-8 sequence
+        parts.append(encoded[start:end].decode())
+        start = end
+    return '\r\n '.join(parts)
+
+
+def _timestamp(value):
+    # floating local time, the way start times are stored
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def _utc_timestamp(value):
+    # DTSTAMP has to be UTC (RFC 5545 3.8.7.2); updated_at is naive local time
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_feed(name, shows, base_url):
+    # `shows`: rows with id, start_time, end_time, updated_at, venue_name,
+    # address, city, state and artist_name
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Fyyur//Upcoming shows//EN',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_escape(name)}',
+    ]
+    for show in shows:
+        where = ', '.join(part for part in (show.venue_name, show.address, show.city, show.state) if part)
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:show-{show.id}@fyyur',
+            # stable across regenerations, so an unchanged feed keeps its ETag
+            f'DTSTAMP:{_utc_timestamp(show.updated_at)}',
+            f'DTSTART:{_timestamp(show.start_time)}',
+            f'DTEND:{_timestamp(show.end_time)}',
+            f'SUMMARY:{_escape(f"{show.artist_name} at {show.venue_name}")}',
+            f'LOCATION:{_escape(where)}',
+            f'URL:{base_url}venues/{show.venue_id}',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ''.join(_fold(line) + '\r\n' for line in lines)
+
+
+def upcoming_for(model, id):
+    column = Show.venue_id if model is Venue else Show.artist_id
+    return db.session.execute(
+        select(Show.id, Show.start_time, Show.end_time, Show.updated_at, Show.venue_id,
+               Venue.name.label('venue_name'), Venue.address, Venue.city, Venue.state,
+               Artist.name.label('artist_name'))
+        .join(Venue, Venue.id == Show.venue_id)
+        .join(Artist, Artist.id == Show.artist_id)
+        .where(column == id, Show.start_time > datetime.now())
+        .order_by(Show.start_time)
+    ).all()
+
+
+#----------------------------------------------------------------------------#
+# Feed cache.
+#----------------------------------------------------------------------------#
+
+# (table, id) -> (expires, etag, body), least recently used evicted first.
+# Entries are dropped by show, venue and artist writes in this process; the
+# TTL bounds how long other worker processes (and shows slipping into the
+# past) can serve a stale feed.
+
+class FeedCache:
+    def __init__(self, size=1000, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.size = app.config.get('FEED_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('FEED_CACHE_SECONDS', self.ttl)
+
+    def get(self, key, build):
+        # (etag, body), calling build() -> body on a miss
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1], entry[2]
+        body = build()
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, etag, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return etag, body
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+feeds = FeedCache()
+
+
+def feed(model, id, base_url):
+    # (etag, body) for the venue or artist, None when it does not exist
+    entity = db.session.get(model, id)
+    if entity is None or not entity.active:
+        return None
+    return feeds.get((model.__tablename__, id),
+                     lambda: render_feed(entity.name, upcoming_for(model, id), base_url))
+
+
+def _show_changed(mapper, connection, target):
+    keys = [('Venue', target.venue_id), ('Artist', target.artist_id)]
+    for column, table in (('venue_id', 'Venue'), ('artist_id', 'Artist')):
+        # a show moved to another venue or artist leaves the old feed too
+        keys += [(table, id) for id in inspect(target).attrs[column].history.deleted]
+    feeds.invalidate(*keys)
+
+
+def _entity_changed(*args):
+    # names and addresses appear in the other side's feeds too
+    feeds.clear()
+
+
+event.listen(Show, 'after_insert', _show_changed)
+event.listen(Show, 'after_update', _show_changed)
+event.listen(Show, 'after_delete', _show_changed)
+for _model in (Venue, Artist):
+    event.listen(_model, 'after_update', _entity_changed)
+    event.listen(_model, 'after_delete', _entity_changed)
+event.listen(Session, 'after_rollback', _entity_changed)
+after_set_based_write('Show', 'Venue', 'Artist')(_entity_changed)
@@ -0,0 +1,303 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # pages then link the original images
+    Image = None
+
+
+#----------------------------------------------------------------------------#
+# Thumbnails.
+#----------------------------------------------------------------------------#
+
+# image_link values point at full-size remote images. The proxy downloads one
+# once, renders every width in WIDTHS from it and serves those with long-lived
+# cache headers; templates use the `thumbnail` and `srcset` filters so the
+# browser picks a width. Proxy URLs carry the signed source URL, so only
+# images the app itself linked to can be fetched through it.
+
+WIDTHS = (160, 320, 640)
+MAX_AGE = 365 * 24 * 3600
+_mimetypes = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+
+# image_link is user input, so the proxy must not become a way to reach the
+# app's own network: every connection, redirects included, is checked
+# against the address it actually reached (whatever DNS said when the URL
+# was checked), and only http(s) redirects are followed. Environment proxies
+# are not used, they would hide the address. Hosts (names or addresses) in
+# IMAGE_PROXY_ALLOWED_HOSTS skip the check, e.g. a local image server in
+# development or tests.
+
+def _public(address):
+    ip = ipaddress.ip_address(address)
+    return ip.is_global and not ip.is_multicast
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    allowed_hosts = frozenset()
+
+    def connect(self):
+        super().connect()
+        address = self.sock.getpeername()[0]
+        if not (_public(address) or self.host in self.allowed_hosts or address in self.allowed_hosts):
+            self.sock.close()
+            self.sock = None
+            raise ValueError(f'{self.host} is {address}, not a public address')
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection, _PublicHTTPConnection):
+    # HTTPSConnection.connect() reaches _PublicHTTPConnection.connect()
+    # through super(), so the address is checked before the TLS handshake
+    pass
+
+
+def _connections(connection_class, allowed_hosts):
+    # the connection factory do_open() expects, with the allow-list set
+    def connect(host, **kwargs):
+        connection = connection_class(host, **kwargs)
+        connection.allowed_hosts = allowed_hosts
+        return connection
+    return connect
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, allowed_hosts=frozenset()):
+        super().__init__()
+        self.allowed_hosts = allowed_hosts
+
+    def http_open(self, request):
+        return self.do_open(_connections(_PublicHTTPConnection, self.allowed_hosts), request)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, allowed_hosts=frozenset()):
+        super().__init__()
+        self.allowed_hosts = allowed_hosts
+
+    def https_open(self, request):
+        return self.do_open(_connections(_PublicHTTPSConnection, self.allowed_hosts), request,
+                            context=self._context)
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, request, fp, code, msg, headers, new_url):
+        if not new_url.startswith(('http://', 'https://')):
+            raise ValueError(f'{request.full_url} redirects to {new_url!r}')
+        return super().redirect_request(request, fp, code, msg, headers, new_url)
+
+
+def fetch(url, timeout=10, max_bytes=10 * 1024 * 1024, allowed_hosts=frozenset()):
+    if not url.startswith(('http://', 'https://')):
+        raise ValueError(f'not an http(s) URL: {url!r}')
+    allowed_hosts = frozenset(allowed_hosts)
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _PublicHTTPHandler(allowed_hosts),
+                                         _PublicHTTPSHandler(allowed_hosts), _RedirectHandler)
+    request = urllib.request.Request(url, headers={'User-Agent': 'fyyur-image-proxy'})
+    with opener.open(request, timeout=timeout) as response:
+        if response.headers.get_content_maintype() != 'image':
+            raise ValueError(f'{url} is {response.headers.get_content_type()}, not an image')
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f'{url} is larger than {max_bytes} bytes')
+    return data
+
+
+def render_thumbnails(data, widths=WIDTHS):
+    # {width: (extension, bytes)}; never scaled up, PNG only where there is
+    # transparency to keep
+    result = {}
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', (max(widths) * 2, max(widths) * 2)) # JPEGs decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        for width in widths:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((width, width * 4), Image.LANCZOS)
+            buffer = io.BytesIO()
+            if transparent:
+                thumbnail.save(buffer, 'PNG', optimize=True)
+                result[width] = ('png', buffer.getvalue())
+            else:
+                thumbnail.convert('RGB').save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+                result[width] = ('jpg', buffer.getvalue())
+    return result
+
+
+#----------------------------------------------------------------------------#
+# Disk cache.
+#----------------------------------------------------------------------------#
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+class ThumbnailCache:
+    # blobs/ab/<sha256 of the bytes>.jpg holds each thumbnail once, however
+    # many URLs lead to the same image; refs/cd/<sha256 of the URL>-<width>
+    # names the blob for a source URL. A blob's mtime is its last use, and
+    # once the blobs outgrow IMAGE_CACHE_BYTES the least recently used ones
+    # are deleted (refs to them then count as misses). Workers share the
+    # directory; every file is written under a temporary name and renamed.
+    def __init__(self):
+        self.directory = None
+        self.serializer = None
+        self.lock = threading.Lock()
+        self.used = None
+        self.fetching = {} # image_link -> [lock, threads using it]
+        self.failed = OrderedDict() # image_link -> monotonic time until which it is not retried
+
+    def init_app(self, app):
+        self.directory = app.config.get('IMAGE_CACHE_DIR') or os.path.join(app.instance_path, 'thumbnails')
+        self.max_bytes = app.config.get('IMAGE_CACHE_BYTES', 256 * 1024 * 1024)
+        self.fetch_timeout = app.config.get('IMAGE_FETCH_TIMEOUT', 10)
+        self.max_image_bytes = app.config.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+        self.allowed_hosts = frozenset(app.config.get('IMAGE_PROXY_ALLOWED_HOSTS', ()))
+        self.failure_ttl = app.config.get('IMAGE_FAILURE_SECONDS', 300)
+        self.enabled = Image is not None and app.config.get('IMAGE_PROXY', True)
+        self.serializer = URLSafeSerializer(app.secret_key, salt='image-proxy')
+
+    # template filters: {{ artist.image_link|thumbnail(320) }} and |srcset
+
+    def url(self, image_link, width=WIDTHS[-1]):
+        if not image_link or not self.enabled:
+            return image_link
+        return f'/images/{self.serializer.dumps(image_link)}/{width}'
+
+    def srcset(self, image_link):
+        if not image_link or not self.enabled:
+            return ''
+        token = self.serializer.dumps(image_link)
+        return ', '.join(f'/images/{token}/{width} {width}w' for width in WIDTHS)
+
+    def source(self, token):
+        # the image_link a proxy URL was made for, None if it was tampered with
+        try:
+            return self.serializer.loads(token)
+        except BadSignature:
+            return None
+
+    def _ref_path(self, image_link, width):
+        digest = hashlib.sha256(image_link.encode()).hexdigest()
+        return os.path.join(self.directory, 'refs', digest[:2], f'{digest}-{width}')
+
+    def _blob_path(self, name):
+        return os.path.join(self.directory, 'blobs', name[:2], name)
+
+    def lookup(self, image_link, width):
+        # (path, name, mimetype) of a cached thumbnail or None
+        try:
+            with open(self._ref_path(image_link, width)) as ref:
+                name = ref.read()
+            path = self._blob_path(name)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path, name, _mimetypes[name.rsplit('.', 1)[1]]
+
+    def get(self, image_link, width):
+        # fetches and renders every width on a miss; raises when the source
+        # cannot be fetched or decoded. Concurrent misses for one image_link
+        # in this process wait for the first one instead of fetching it again.
+        # A failed image_link (every width, they are rendered together) is
+        # not fetched again for IMAGE_FAILURE_SECONDS, get() returns None.
+        found = self.lookup(image_link, width)
+        if found is not None or self.recently_failed(image_link):
+            return found
+        with self.lock:
+            entry = self.fetching.setdefault(image_link, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                found = self.lookup(image_link, width)
+                if found is None and not self.recently_failed(image_link):
+                    try:
+                        data = fetch(image_link, self.fetch_timeout, self.max_image_bytes, self.allowed_hosts)
+                        rendered = render_thumbnails(data)
+                    except Exception:
+                        self.fetch_failed(image_link)
+                        raise
+                    for thumbnail_width, (extension, thumbnail) in rendered.items():
+                        self.store(image_link, thumbnail_width, extension, thumbnail)
+                    found = self.lookup(image_link, width)
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.fetching[image_link]
+        return found
+
+    def recently_failed(self, image_link):
+        with self.lock:
+            until = self.failed.get(image_link)
+            if until is None:
+                return False
+            if until > time.monotonic():
+                return True
+            del self.failed[image_link]
+            return False
+
+    def fetch_failed(self, image_link, max_entries=10000):
+        with self.lock:
+            self.failed[image_link] = time.monotonic() + self.failure_ttl
+            self.failed.move_to_end(image_link)
+            while len(self.failed) > max_entries:
+                self.failed.popitem(last=False)
+
+    def store(self, image_link, width, extension, data):
+        name = f'{hashlib.sha256(data).hexdigest()}.{extension}'
+        path = self._blob_path(name)
+        if not os.path.exists(path):
+            _write(path, data)
+            self._grew(len(data))
+        _write(self._ref_path(image_link, width), name.encode())
+
+    def _grew(self, size):
+        with self.lock:
+            if self.used is None:
+                self.used = sum(size for _, size, _ in self._blobs())
+            else:
+                self.used += size
+            if self.used > self.max_bytes:
+                self.evict()
+
+    def _blobs(self):
+        for root, _, files in os.walk(os.path.join(self.directory, 'blobs')):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError: # evicted by another worker
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        # least recently used first, down to 90% of the budget so that not
+        # every new thumbnail triggers another scan
+        blobs = sorted(self._blobs())
+        self.used = sum(size for _, size, _ in blobs)
+        for _, size, path in blobs:
+            if self.used <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.used -= size
+
+
+thumbnails = ThumbnailCache()
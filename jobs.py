@@ -0,0 +1,162 @@
+import signal
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, or_, select, update
+
+from models import db, Job
+
+
+#----------------------------------------------------------------------------#
+# Background job queue.
+#----------------------------------------------------------------------------#
+
+# Request handlers call enqueue() inside their own transaction, so a job exists
+# exactly when the write it belongs to was committed, and return right away.
+# `flask worker` claims runnable jobs in batches, hands each kind's payloads to
+# its handler and deletes them once the handler returned. Delivery is at least
+# once: a worker that dies mid-batch leaves its jobs leased, and they are picked
+# up again when the lease runs out, so handlers have to be idempotent.
+
+LEASE = timedelta(minutes=5)
+BACKOFF_BASE = 2 # seconds before the first retry, doubled for every further one
+BACKOFF_MAX = 3600
+
+_handlers = {}
+
+
+def handler(kind):
+    # @handler('kind') registers fn(payloads), called with the payload dicts of
+    # all jobs of that kind claimed in one batch
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, run_at=None, max_attempts=5, session=None, **payload):
+    # adds the job to `session` (the current one by default), the caller
+    # commits
+    job = Job(kind=kind, payload=payload, run_at=run_at or datetime.now(), max_attempts=max_attempts)
+    (session or db.session).add(job)
+    return job
+
+
+def enqueue_once(kind, session=None):
+    # enqueue() for payload-less jobs where one run covers any number of
+    # requests (refreshes): adds nothing while a job of `kind` is still
+    # pending. One that is already running may have read its data before
+    # this transaction's write, so it does not count.
+    session = session or db.session
+    with session.no_autoflush:
+        waiting = session.execute(select(Job.id).where(Job.kind == kind, Job.status == 'pending').limit(1)).first()
+    if waiting is None:
+        return enqueue(kind, session=session)
+    return None
+
+
+def claim(batch_size, lease=LEASE):
+    # leases up to `batch_size` runnable jobs to this worker and commits;
+    # returns rows with id, kind, payload, attempts and max_attempts
+    now = datetime.now()
+    runnable = and_(Job.run_at <= now, or_(
+        Job.status == 'pending',
+        and_(Job.status == 'running', Job.locked_until < now), # its worker died
+    ))
+    ids = [id for id, in db.session.query(Job.id)
+           .filter(runnable)
+           .order_by(Job.run_at, Job.id)
+           .limit(batch_size)
+           .with_for_update(skip_locked=True)]
+    if not ids:
+        db.session.rollback()
+        return []
+
+    # PostgreSQL has the rows locked already; elsewhere repeating the condition
+    # keeps two workers from both claiming a job they selected at the same time
+    jobs = db.session.execute(
+        update(Job).where(Job.id.in_(ids), runnable)
+        .values(status='running', attempts=Job.attempts + 1, locked_until=now + lease)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts),
+        execution_options={'synchronize_session': False},
+    ).all()
+    db.session.commit()
+    return sorted(jobs, key=lambda job: job.id)
+
+
+def _succeeded(jobs):
+    db.session.execute(delete(Job).where(Job.id.in_([job.id for job in jobs])),
+                       execution_options={'synchronize_session': False})
+    db.session.commit()
+
+
+def _failed(jobs, error):
+    now = datetime.now()
+    for job in jobs:
+        if job.attempts >= job.max_attempts:
+            values = {'status': 'failed'}
+        else:
+            delay = min(BACKOFF_BASE * 2 ** (job.attempts - 1), BACKOFF_MAX)
+            values = {'status': 'pending', 'run_at': now + timedelta(seconds=delay)}
+        db.session.execute(
+            update(Job).where(Job.id == job.id)
+            .values(locked_until=None, last_error=repr(error), **values),
+            execution_options={'synchronize_session': False},
+        )
+    db.session.commit()
+
+
+def _run(kind, jobs):
+    try:
+        fn = _handlers.get(kind)
+        if fn is None:
+            raise LookupError(f'no handler for job kind {kind!r}')
+        fn([job.payload for job in jobs])
+    except Exception as e:
+        db.session.rollback()
+        error = e
+    else:
+        _succeeded(jobs)
+        return
+
+    if len(jobs) > 1:
+        # retry one by one so a single bad payload does not hold back the rest
+        for job in jobs:
+            _run(kind, [job])
+        return
+    current_app.logger.error('job %s (%s) failed, attempt %s of %s',
+                             jobs[0].id, kind, jobs[0].attempts, jobs[0].max_attempts, exc_info=error)
+    _failed(jobs, error)
+
+
+def run_batch(batch_size=100, lease=LEASE):
+    # claims and runs one batch, returns the number of jobs claimed
+    jobs = claim(batch_size, lease)
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, batch in by_kind.items():
+        _run(kind, batch)
+    return len(jobs)
+
+
+def work(batch_size=100, poll_interval=1.0, once=False):
+    # the worker loop; SIGTERM/SIGINT stop it after the current batch
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopping.append(True))
+
+    processed = 0
+    while not stopping:
+        try:
+            count = run_batch(batch_size)
+        finally:
+            db.session.remove()
+        processed += count
+        if once and not count:
+            break
+        if not count:
+            time.sleep(poll_interval)
+    return processed
+
@@ -0,0 +1,109 @@
+import atexit
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request
+
+
+#----------------------------------------------------------------------------#
+# Formatters and filters.
+#----------------------------------------------------------------------------#
+
+class JSONFormatter(logging.Formatter):
+    # one JSON object per line so the log can be grepped or shipped as-is
+    def format(self, record):
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "path": record.pathname,
+            "line": record.lineno,
+        }
+        for key in ('endpoint', 'method', 'url', 'remote_addr'):
+            value = getattr(record, key, None)
+            if value is not None:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    # copies request details onto the record while we are still on the request
+    # thread; the listener thread formats the record later without a context
+    def filter(self, record):
+        if has_request_context():
+            record.endpoint = request.endpoint
+            record.method = request.method
+            record.url = request.path
+            record.remote_addr = request.remote_addr
+        return True
+
+
+class EndpointSamplingFilter(logging.Filter):
+    # keeps 1-in-N records below `level` for the configured endpoints,
+    # warnings and errors always go through
+    def __init__(self, rates, level=logging.WARNING):
+        super().__init__()
+        self.rates = dict(rates)
+        self.level = level
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        rate = self.rates.get(getattr(record, 'endpoint', None))
+        if not rate or rate <= 1:
+            return True
+        return random.randrange(rate) == 0
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never block the request when the listener falls behind, drop instead
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+#----------------------------------------------------------------------------#
+# Setup.
+#----------------------------------------------------------------------------#
+
+def configure_logging(app):
+    # the request thread only puts records on an in-memory queue, a listener
+    # thread does the formatting and the (possibly slow) disk write
+    log_queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+
+    file_handler = RotatingFileHandler(
+        app.config.get('LOG_FILE', 'error.log'),
+        maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+        backupCount=app.config.get('LOG_BACKUP_COUNT', 5),
+        delay=True,
+    )
+    file_handler.setFormatter(JSONFormatter())
+    file_handler.setLevel(logging.INFO)
+
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.setLevel(logging.INFO)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(EndpointSamplingFilter(app.config.get('LOG_SAMPLE_RATES', {
+        'edit_artist_submission': 10,
+        'edit_venue_submission': 10,
+    })))
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(queue_handler)
+    app.extensions['log_listener'] = listener
+    return listener
+
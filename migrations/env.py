@@ -91,15 +91,44 @@ def run_migrations_online():
                 logger.info('No changes in schema detected.')
 
     connectable = get_engine()
+    dry_run = context.get_x_argument(as_dictionary=True).get('dry_run', '').lower() in ('1', 'true', 'yes')
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # fail fast instead of queueing behind a long transaction while
+            # every later query queues behind the migration's lock; see
+            # online_migrations.lock_timeout() to raise it for one step
+            connection.exec_driver_sql("SET lock_timeout = '{}'".format(
+                current_app.config.get('MIGRATION_LOCK_TIMEOUT', '5s')))
+            connection.commit()
+        elif dry_run:
+            raise RuntimeError('dry runs need transactional DDL, run them against PostgreSQL')
+
+        if dry_run:
+            # one outer transaction, begun before configure() so Alembic
+            # sees it as external and neither begins nor commits its own;
+            # everything, alembic_version included, is rolled back and the
+            # online_migrations helpers only report what they would do
+            transaction = connection.begin()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            # one transaction per revision, so a long upgrade does not hold
+            # every lock it took until the very end (a dry run has just one)
+            transaction_per_migration=not dry_run,
             **current_app.extensions['migrate'].configure_args
         )
 
+        if dry_run:
+            try:
+                context.run_migrations()
+            finally:
+                transaction.rollback()
+            logger.info('Dry run, nothing was changed.')
+            return
+
         with context.begin_transaction():
             context.run_migrations()
 
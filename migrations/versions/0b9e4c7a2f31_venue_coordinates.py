@@ -0,0 +1,37 @@
+"""latitude, longitude and geohash on Venue for nearby searches
+
+Revision ID: 0b9e4c7a2f31
+Revises: d41f7a2c6e95
+Create Date: 2026-10-19 21:14:37.602118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import create_index_concurrently, drop_index_concurrently, lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = '0b9e4c7a2f31'
+down_revision = 'd41f7a2c6e95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nullable columns without defaults, no table rewrite; fill them in
+    # afterwards with `flask geocode-venues`
+    with lock_timeout():
+        op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+        op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+        op.add_column('Venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    create_index_concurrently('ix_Venue_geohash', 'Venue', ['geohash'],
+                              postgresql_ops={'geohash': 'text_pattern_ops'})
+
+
+def downgrade():
+    drop_index_concurrently('ix_Venue_geohash', 'Venue')
+    with op.batch_alter_table('Venue', schema=None) as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,49 @@
+"""Show.end_time and no-double-booking exclusion constraints
+
+Revision ID: 1b6e93d0c5a8
+Revises: f08d4c61a2e7
+Create Date: 2026-10-19 14:05:42.907713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b6e93d0c5a8'
+down_revision = 'f08d4c61a2e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('end_time', sa.DateTime(), nullable=True))
+
+    # existing shows get the default three-hour slot
+    if postgresql:
+        op.execute('''UPDATE "Show" SET end_time = start_time + interval '3 hours' ''')
+    else:
+        op.execute('''UPDATE "Show" SET end_time = datetime(start_time, '+3 hours')''')
+
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    if postgresql:
+        # fails if existing shows already overlap; resolve those before upgrading
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_venue_booking" '
+                   'EXCLUDE USING gist (venue_id WITH =, tsrange(start_time, end_time) WITH &&)')
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_artist_booking" '
+                   'EXCLUDE USING gist (artist_id WITH =, tsrange(start_time, end_time) WITH &&)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE "Show" DROP CONSTRAINT "ex_Show_artist_booking"')
+        op.execute('ALTER TABLE "Show" DROP CONSTRAINT "ex_Show_venue_booking"')
+
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.drop_column('end_time')
@@ -0,0 +1,58 @@
+"""venue_directory materialized view
+
+Revision ID: 3d7a0b42e916
+Revises: 1b6e93d0c5a8
+Create Date: 2026-10-19 15:21:09.438150
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d7a0b42e916'
+down_revision = '1b6e93d0c5a8'
+branch_labels = None
+depends_on = None
+
+
+DIRECTORY_SELECT = '''
+    SELECT "Location".id AS location_id, "Location".city, "Location".state,
+           "Venue".id AS venue_id, "Venue".name AS venue_name,
+           coalesce(upcoming.num_upcoming_shows, 0) AS num_upcoming_shows
+    FROM "Location"
+    JOIN "Venue" ON "Venue".location_id = "Location".id
+    LEFT OUTER JOIN (
+        SELECT venue_id, count(id) AS num_upcoming_shows
+        FROM "Show"
+        WHERE start_time > {now}
+        GROUP BY venue_id
+    ) AS upcoming ON upcoming.venue_id = "Venue".id
+'''
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE MATERIALIZED VIEW venue_directory AS ' + DIRECTORY_SELECT.format(now='LOCALTIMESTAMP'))
+    else:
+        # snapshot table, refreshed by venue_directory.refresh_directory
+        op.create_table('venue_directory',
+        sa.Column('location_id', sa.Integer(), nullable=True),
+        sa.Column('city', sa.String(length=120), nullable=True),
+        sa.Column('state', sa.String(length=120), nullable=True),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('venue_name', sa.String(), nullable=True),
+        sa.Column('num_upcoming_shows', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('venue_id')
+        )
+        op.execute('INSERT INTO venue_directory ' + DIRECTORY_SELECT.format(now="datetime('now', 'localtime')"))
+
+    op.create_index('ix_venue_directory_venue_id', 'venue_directory', ['venue_id'], unique=True)
+    op.create_index('ix_venue_directory_area', 'venue_directory', ['state', 'city', 'location_id', 'venue_name'], unique=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP MATERIALIZED VIEW venue_directory')
+    else:
+        op.drop_table('venue_directory')
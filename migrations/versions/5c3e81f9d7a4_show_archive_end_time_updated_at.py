@@ -0,0 +1,51 @@
+"""end_time and updated_at on ShowArchive, as on Show
+
+Revision ID: 5c3e81f9d7a4
+Revises: 0b9e4c7a2f31
+Create Date: 2026-10-20 09:31:52.184760
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import backfill, lock_timeout, set_not_null
+
+
+# revision identifiers, used by Alembic.
+revision = '5c3e81f9d7a4'
+down_revision = '0b9e4c7a2f31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+
+    # on PostgreSQL the columns are added to every partition as well; now()
+    # is fixed for the statement, so updated_at is filled in without a table
+    # rewrite. SQLite cannot add a column with a non-constant default in
+    # place, so it copies the table.
+    with lock_timeout():
+        op.add_column('ShowArchive', sa.Column('end_time', sa.DateTime(), nullable=True))
+        if postgresql:
+            op.add_column('ShowArchive', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(),
+                                                   nullable=False))
+    if not postgresql:
+        with op.batch_alter_table('ShowArchive', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(),
+                                          nullable=False))
+
+    # shows archived before this revision lost their end time, assume the
+    # default three-hour slot as the end_time migration on Show did
+    if postgresql:
+        backfill('ShowArchive', "end_time = start_time + interval '3 hours'", where='end_time IS NULL')
+    else:
+        backfill('ShowArchive', "end_time = datetime(start_time, '+3 hours')", where='end_time IS NULL')
+
+    set_not_null('ShowArchive', 'end_time', sa.DateTime())
+
+
+def downgrade():
+    with op.batch_alter_table('ShowArchive', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('end_time')
@@ -0,0 +1,74 @@
+"""ON DELETE CASCADE for Show foreign keys, active flag on Venue and Artist
+
+Revision ID: 7c4f25b8d031
+Revises: 3d7a0b42e916
+Create Date: 2026-10-19 16:37:55.781204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4f25b8d031'
+down_revision = '3d7a0b42e916'
+branch_labels = None
+depends_on = None
+
+
+# lets batch mode on SQLite find the originally unnamed foreign keys
+naming_convention = {
+    "fk": "%(table_name)s_%(column_0_name)s_fkey",
+}
+
+DIRECTORY_SELECT = '''
+    SELECT "Location".id AS location_id, "Location".city, "Location".state,
+           "Venue".id AS venue_id, "Venue".name AS venue_name,
+           coalesce(upcoming.num_upcoming_shows, 0) AS num_upcoming_shows
+    FROM "Location"
+    JOIN "Venue" ON "Venue".location_id = "Location".id
+    LEFT OUTER JOIN (
+        SELECT venue_id, count(id) AS num_upcoming_shows
+        FROM "Show"
+        WHERE start_time > LOCALTIMESTAMP
+        GROUP BY venue_id
+    ) AS upcoming ON upcoming.venue_id = "Venue".id
+    {where}
+'''
+
+
+def _recreate_directory(where):
+    op.execute('DROP MATERIALIZED VIEW venue_directory')
+    op.execute('CREATE MATERIALIZED VIEW venue_directory AS ' + DIRECTORY_SELECT.format(where=where))
+    op.create_index('ix_venue_directory_venue_id', 'venue_directory', ['venue_id'], unique=True)
+    op.create_index('ix_venue_directory_area', 'venue_directory', ['state', 'city', 'location_id', 'venue_name'], unique=False)
+
+
+def _show_foreign_keys(ondelete):
+    with op.batch_alter_table('Show', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('Show_artist_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('Show_venue_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('Show_artist_id_fkey', 'Artist', ['artist_id'], ['id'], ondelete=ondelete)
+        batch_op.create_foreign_key('Show_venue_id_fkey', 'Venue', ['venue_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _show_foreign_keys('CASCADE')
+
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('active', sa.Boolean(), server_default=sa.true(), nullable=False))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        _recreate_directory('WHERE "Venue".active')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _recreate_directory('')
+
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('active')
+
+    _show_foreign_keys(None)
@@ -0,0 +1,28 @@
+"""version column on Venue and Artist for optimistic locking
+
+Revision ID: 9e2d6a17f4b0
+Revises: 7c4f25b8d031
+Create Date: 2026-10-19 17:44:18.209376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2d6a17f4b0'
+down_revision = '7c4f25b8d031'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
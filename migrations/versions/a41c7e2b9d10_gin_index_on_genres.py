@@ -0,0 +1,43 @@
+"""GIN index on Venue.genres and Artist.genres
+
+Revision ID: a41c7e2b9d10
+Revises: 6af63dccd952
+Create Date: 2026-10-19 09:12:04.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7e2b9d10'
+down_revision = '6af63dccd952'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # JSON genres on SQLite are served by the in-process index in genres.py
+        return
+
+    # Artist.genres is still the original VARCHAR column unless the table was
+    # recreated from the models (dummy_data.py does that)
+    columns = {c['name']: c['type'] for c in sa.inspect(op.get_bind()).get_columns('Artist')}
+    if not isinstance(columns['genres'], sa.ARRAY):
+        with op.batch_alter_table('Artist', schema=None) as batch_op:
+            batch_op.alter_column('genres',
+                   existing_type=sa.String(length=120),
+                   type_=sa.ARRAY(sa.String(length=120)),
+                   postgresql_using="string_to_array(trim(both '{}' from genres), ',')")
+
+    op.create_index('ix_Venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_Artist_genres', table_name='Artist', postgresql_using='gin')
+    op.drop_index('ix_Venue_genres', table_name='Venue', postgresql_using='gin')
@@ -0,0 +1,38 @@
+"""Job table for the background worker
+
+Revision ID: b58e0c3a9d71
+Revises: 9e2d6a17f4b0
+Create Date: 2026-10-19 18:21:40.517302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b58e0c3a9d71'
+down_revision = '9e2d6a17f4b0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=120), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Job_status_run_at', 'Job', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Job_status_run_at', table_name='Job')
+    op.drop_table('Job')
@@ -0,0 +1,61 @@
+"""Location table for normalized city/state
+
+Revision ID: c7d2f0e8b513
+Revises: a41c7e2b9d10
+Create Date: 2026-10-19 10:02:37.540911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2f0e8b513'
+down_revision = 'a41c7e2b9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Location',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('city_key', sa.String(length=120), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('city_key', 'state')
+    )
+
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('location_id', sa.Integer(), nullable=True))
+            batch_op.create_index(batch_op.f('ix_{}_location_id'.format(table)), ['location_id'], unique=False)
+            batch_op.create_foreign_key('fk_{}_location_id'.format(table), 'Location', ['location_id'], ['id'])
+
+    # backfill: one Location per trimmed, case-folded city and state, keeping
+    # the first spelling in sort order ("San Francisco" before "san francisco ")
+    op.execute('''
+        INSERT INTO "Location" (city, city_key, state)
+        SELECT min(trim(city)), lower(trim(city)), upper(trim(state))
+        FROM (SELECT city, state FROM "Venue" UNION ALL SELECT city, state FROM "Artist") AS places
+        WHERE city IS NOT NULL AND state IS NOT NULL
+        GROUP BY lower(trim(city)), upper(trim(state))
+    ''')
+    for table in ('Venue', 'Artist'):
+        op.execute('''
+            UPDATE "{0}" SET location_id = (
+                SELECT "Location".id FROM "Location"
+                WHERE "Location".city_key = lower(trim("{0}".city))
+                  AND "Location".state = upper(trim("{0}".state))
+            )
+        '''.format(table))
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint('fk_{}_location_id'.format(table), type_='foreignkey')
+            batch_op.drop_index(batch_op.f('ix_{}_location_id'.format(table)))
+            batch_op.drop_column('location_id')
+
+    op.drop_table('Location')
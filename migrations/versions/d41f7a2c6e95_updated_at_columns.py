@@ -0,0 +1,30 @@
+"""updated_at on Venue, Artist and Show for incremental exports
+
+Revision ID: d41f7a2c6e95
+Revises: b58e0c3a9d71
+Create Date: 2026-10-19 19:02:11.730418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f7a2c6e95'
+down_revision = 'b58e0c3a9d71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+            batch_op.create_index(f'ix_{table}_updated_at', ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_updated_at')
+            batch_op.drop_column('updated_at')
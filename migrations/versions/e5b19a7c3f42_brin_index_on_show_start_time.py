@@ -0,0 +1,26 @@
+"""BRIN index on Show.start_time
+
+Revision ID: e5b19a7c3f42
+Revises: c7d2f0e8b513
+Create Date: 2026-10-19 11:26:51.093217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b19a7c3f42'
+down_revision = 'c7d2f0e8b513'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # BRIN on PostgreSQL (shows are inserted in roughly start_time order),
+    # a plain B-tree everywhere else
+    op.create_index('ix_Show_start_time', 'Show', ['start_time'], unique=False, postgresql_using='brin')
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time', table_name='Show', postgresql_using='brin')
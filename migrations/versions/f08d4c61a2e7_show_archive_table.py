@@ -0,0 +1,45 @@
+"""ShowArchive table for past shows
+
+Revision ID: f08d4c61a2e7
+Revises: e5b19a7c3f42
+Create Date: 2026-10-19 12:48:15.662390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f08d4c61a2e7'
+down_revision = 'e5b19a7c3f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+
+    # range-partitioned by month on PostgreSQL; monthly partitions are created
+    # on demand by show_archive.ensure_partitions
+    op.create_table('ShowArchive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id', 'start_time'),
+    **({'postgresql_partition_by': 'RANGE (start_time)'} if postgresql else {})
+    )
+    with op.batch_alter_table('ShowArchive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ShowArchive_artist_id'), ['artist_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_ShowArchive_venue_id'), ['venue_id'], unique=False)
+
+    if postgresql:
+        # catches rows outside any monthly partition instead of failing the insert
+        op.execute('CREATE TABLE "ShowArchive_default" PARTITION OF "ShowArchive" DEFAULT')
+
+
+def downgrade():
+    # partitions are dropped together with the parent table
+    op.drop_table('ShowArchive')
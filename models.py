@@ -1,14 +1,134 @@
+from datetime import datetime, timedelta
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, 'connect')
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only honours ON DELETE CASCADE with foreign keys switched on
+    if type(dbapi_connection).__module__ == 'sqlite3':
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
+def is_postgres():
+    # several queries have a PostgreSQL form and a portable (SQLite) fallback
+    return db.engine.dialect.name == 'postgresql'
+
+
+def written_table(orm_execute_state):
+    # name of the table a Session.execute() INSERT/UPDATE/DELETE writes to, or
+    # None; set-based statements never reach the mapper events, and with 2.0
+    # style execution not the after_bulk_* session events either
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        return orm_execute_state.statement.table.name
+    return None
+
+
+_row_listeners = {}
+
+
+def after_set_based_write(*tables):
+    # @after_set_based_write('Venue', ...) registers fn(session, table, ids, rows),
+    # called after an UPDATE/DELETE run through Session.execute() on one of
+    # `tables` with the ids of the rows it targeted and {id: row} of those
+    # still there afterwards (ids and rows are None for INSERTs), so
+    # in-process indexes can follow writes that skip the mapper events
+    def register(fn):
+        for table in tables:
+            _row_listeners.setdefault(table, []).append(fn)
+        return fn
+    return register
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _notify_set_based_write(orm_execute_state):
+    # the targeted ids come from the caller (execution option target_ids,
+    # when the WHERE clause already names them), else on PostgreSQL from an
+    # added RETURNING id, else from a SELECT ahead of the write. RETURNING
+    # is only added to Core statements: ORM ones then return no rowcount
+    # (and SQLite reports none with RETURNING either). The rows the
+    # listeners need are then read once for all of them.
+    table = written_table(orm_execute_state)
+    listeners = _row_listeners.get(table)
+    if not listeners:
+        return None
+    session = orm_execute_state.session
+    if orm_execute_state.is_insert:
+        result = orm_execute_state.invoke_statement()
+        for fn in listeners:
+            fn(session, table, None, None)
+        return result
+
+    statement, target = orm_execute_state.statement, db.metadata.tables[table]
+    ids = orm_execute_state.execution_options.get('target_ids')
+    if ids is not None:
+        result = orm_execute_state.invoke_statement()
+    elif (session.get_bind().dialect.name == 'postgresql' and not orm_execute_state.is_orm_statement
+          and not statement.exported_columns):
+        result = orm_execute_state.invoke_statement(statement=statement.returning(target.c.id))
+        result.rowcount # kept for the caller before the ids are fetched
+        ids = result.scalars().all()
+    else:
+        targeted = select(target.c.id)
+        if statement.whereclause is not None:
+            targeted = targeted.where(statement.whereclause)
+        ids = [id for id, in session.execute(targeted)]
+        result = orm_execute_state.invoke_statement()
+
+    ids, rows = list(ids), {}
+    if ids and orm_execute_state.is_update:
+        rows = {row.id: row for row in session.execute(select(target).where(target.c.id.in_(ids)))}
+    for fn in listeners:
+        fn(session, table, ids, rows)
+    return result
+
+
+# PostgreSQL stores genres as a native (GIN-indexable) array, SQLite as JSON
+GenreList = db.ARRAY(db.String(120)).with_variant(db.JSON(), 'sqlite')
+
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+class Location(db.Model):
+    __tablename__ = 'Location'
+    __table_args__ = (
+        db.UniqueConstraint('city_key', 'state'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(120), nullable=False) # display name, first spelling seen
+    city_key = db.Column(db.String(120), nullable=False) # trimmed, lower-cased city
+    state = db.Column(db.String(120), nullable=False)
+
+    @staticmethod
+    def normalize(city, state):
+        return (city or '').strip().lower(), (state or '').strip().upper()
+
+    @classmethod
+    def get_or_create(cls, city, state):
+        # "San Francisco" and "san francisco " resolve to the same row
+        city_key, state_key = cls.normalize(city, state)
+        location = cls.query.filter_by(city_key=city_key, state=state_key).first()
+        if location is None:
+            location = cls(city=(city or '').strip(), city_key=city_key, state=state_key)
+            db.session.add(location)
+        return location
+
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        # prefix (LIKE '9q8y%') lookups for nearby venues, see geo.py
+        db.Index('ix_Venue_geohash', 'geohash', postgresql_ops={'geohash': 'text_pattern_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True, nullable=False)
@@ -20,20 +140,34 @@ class Venue(db.Model):
     facebook_link = db.Column(db.String(120))
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate >> done!
-    genres = db.Column(db.ARRAY(db.String(120))) # To store multiple genres
+    genres = db.Column(GenreList) # To store multiple genres
     website = db.Column(db.String(500)) # New field for the website link
     seeking_talent = db.Column(db.Boolean, default=False) # New field for 'Seeking Talent'
     seeking_description = db.Column(db.String(500)) # New field for 'Seeking Description'
+    location_id = db.Column(db.Integer, db.ForeignKey('Location.id'), index=True) # Normalized city/state
+    location = db.relationship('Location')
+    latitude = db.Column(db.Float) # entered by hand or from the geocoding table, see geo.py
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12)) # kept in step with latitude/longitude by geo.py
     
     # Relationship with Artist model using Show model as secondary
     # artists = db.relationship('Artist', secondary='Show', backref=db.backref('venues', lazy=True))
 
-    # Relationship with Show model. If a Venue is deleted, its associated Show instances are also deleted.
-    shows = db.relationship('Show', backref='venue_shows', lazy=True, cascade='all, delete-orphan', overlaps="artists,venues")
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true()) # False hides the venue from listings
+    version = db.Column(db.Integer, nullable=False, server_default='1') # optimistic locking, see updates.py
+    __mapper_args__ = {'version_id_col': version}
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=func.now(), index=True) # incremental exports, see export.py
+
+    # Relationship with Show model. If a Venue is deleted, its associated Show instances are also deleted
+    # by the database (ON DELETE CASCADE), passive_deletes keeps SQLAlchemy from loading them first.
+    shows = db.relationship('Show', backref='venue_shows', lazy=True, cascade='all, delete-orphan', passive_deletes=True, overlaps="artists,venues")
 
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String, unique=True, nullable=False)
@@ -45,23 +179,88 @@ class Artist(db.Model):
     facebook_link = db.Column(db.String(120))
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate >> done!
-    genres = db.Column(db.ARRAY(db.String(120))) # To store multiple genres
+    genres = db.Column(GenreList) # To store multiple genres
     website = db.Column(db.String(500)) # New field for the website link
     seeking_venue = db.Column(db.Boolean, default=False) # New field for 'Looking for Venues'
     seeking_description = db.Column(db.String(500)) # New field for 'Seeking Description'
+    location_id = db.Column(db.Integer, db.ForeignKey('Location.id'), index=True) # Normalized city/state
+    location = db.relationship('Location')
 
     # Relationship with Venue model using Show model as secondary
     # venues = db.relationship('Venue', secondary='Show', backref=db.backref('artists', lazy=True))
 
-    shows = db.relationship('Show', backref='artist_shows', lazy=True, overlaps="venues")
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true()) # False hides the artist from listings
+    version = db.Column(db.Integer, nullable=False, server_default='1') # optimistic locking, see updates.py
+    __mapper_args__ = {'version_id_col': version}
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=func.now(), index=True) # incremental exports, see export.py
+
+    shows = db.relationship('Show', backref='artist_shows', lazy=True, cascade='all, delete-orphan', passive_deletes=True, overlaps="venues")
+
+def _default_end_time(context):
+    # shows listed without an end time are booked for SHOW_DURATION
+    return context.get_current_parameters()['start_time'] + SHOW_DURATION
+
+
+SHOW_DURATION = timedelta(hours=3)
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # shows are appended roughly in start_time order, BRIN stays tiny on PostgreSQL
+        # (other dialects ignore postgresql_using and build a B-tree)
+        db.Index('ix_Show_start_time', 'start_time', postgresql_using='brin'),
+        # no double-booking of a venue or an artist; other dialects use booking.py
+        ExcludeConstraint(('venue_id', '='), (func.tsrange(db.text('start_time'), db.text('end_time')), '&&'),
+                          name='ex_Show_venue_booking', using='gist').ddl_if(dialect='postgresql'),
+        ExcludeConstraint(('artist_id', '='), (func.tsrange(db.text('start_time'), db.text('end_time')), '&&'),
+                          name='ex_Show_artist_booking', using='gist').ddl_if(dialect='postgresql'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)  # Foreign Key reference to Artist model
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)  # Foreign Key reference to Venue model
+    end_time = db.Column(db.DateTime, nullable=False, default=_default_end_time)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)  # Foreign Key reference to Artist model
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)  # Foreign Key reference to Venue model
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=func.now(), index=True) # incremental exports, see export.py
     # Establish relationship with Artist and Venue models
     artist = db.relationship('Artist', overlaps="artist_shows,shows")  # 'shows' relationship in Artist model
     venue = db.relationship('Venue', overlaps="venue_shows,shows,venues")  # 'shows' relationship in Venue models
+
+
+# the GiST exclusion constraints on Show need = on integer columns
+event.listen(Show.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+
+
+class ShowArchive(db.Model):
+    # past shows moved out of Show by show_archive.archive_past_shows()
+    __tablename__ = 'ShowArchive'
+    __table_args__ = {
+        # monthly range partitions on PostgreSQL, see show_archive.ensure_partitions
+        'postgresql_partition_by': 'RANGE (start_time)',
+    }
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False) # id the show had in Show
+    start_time = db.Column(db.DateTime, primary_key=True) # partition key, must be part of the primary key
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False, index=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False, index=True)
+    end_time = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=func.now()) # as it was in Show
+
+
+class Job(db.Model):
+    # background work queued by request handlers, run by `flask worker`; see jobs.py
+    __tablename__ = 'Job'
+    __table_args__ = (
+        # the worker's claim query: runnable jobs in run_at order
+        db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, running or failed; done jobs are deleted
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now) # not before; pushed back on retry
+    locked_until = db.Column(db.DateTime) # lease of the worker running it, expired leases are claimed again
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -0,0 +1,211 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from alembic import context, op
+
+
+#----------------------------------------------------------------------------#
+# Online migration helpers.
+#----------------------------------------------------------------------------#
+
+# For migrations that touch large tables (Show in particular) on a live
+# PostgreSQL database: indexes are built CONCURRENTLY, backfills run as many
+# short transactions over primary key ranges, and lock waits are bounded so a
+# migration stuck behind a long transaction fails instead of queueing every
+# later reader behind its own lock. On other dialects the helpers fall back
+# to the plain operations.
+#
+# `flask db upgrade -x dry_run=1` runs the migrations inside a transaction
+# that is rolled back (see migrations/env.py); the helpers then only log what
+# they would do and how many rows they would touch.
+
+logger = logging.getLogger('alembic.online')
+
+DEFAULT_LOCK_TIMEOUT = '5s'
+
+
+def dry_run():
+    return context.get_x_argument(as_dictionary=True).get('dry_run', '').lower() in ('1', 'true', 'yes')
+
+
+def _postgres(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+@contextmanager
+def lock_timeout(timeout=DEFAULT_LOCK_TIMEOUT):
+    # with lock_timeout('2s'): op.add_column(...) -- the statements inside
+    # give up on a lock after `timeout`; PostgreSQL only
+    bind = op.get_bind()
+    if not _postgres(bind):
+        yield
+        return
+    previous = bind.exec_driver_sql('SHOW lock_timeout').scalar()
+    bind.execute(sa.text('SELECT set_config(\'lock_timeout\', :timeout, false)'), {'timeout': timeout})
+    yield
+    # on an error the transaction rolls back, and the setting with it
+    bind.execute(sa.text('SELECT set_config(\'lock_timeout\', :timeout, false)'), {'timeout': previous})
+
+
+def estimate_rows(bind, table, where=None):
+    # the planner's row estimate on PostgreSQL (a count would scan the
+    # table), an exact count elsewhere
+    condition = f' WHERE {where}' if where else ''
+    if _postgres(bind):
+        plan = bind.exec_driver_sql(f'EXPLAIN (FORMAT JSON) SELECT 1 FROM "{table}"{condition}').scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return bind.exec_driver_sql(f'SELECT count(*) FROM "{table}"{condition}').scalar()
+
+
+#----------------------------------------------------------------------------#
+# Indexes.
+#----------------------------------------------------------------------------#
+
+def _index_valid(bind, name):
+    # True, False for an INVALID index, None when there is none
+    return bind.execute(sa.text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'),
+                        {'name': f'"{name}"'}).scalar()
+
+
+def create_index_concurrently(name, table, columns, **kw):
+    # op.create_index() without blocking writes on PostgreSQL. CONCURRENTLY
+    # cannot run in a transaction, so whatever the migration did before this
+    # call is committed first.
+    bind = op.get_bind()
+    if dry_run():
+        logger.info('would create index %s on %s (about %d rows)', name, table, estimate_rows(bind, table))
+        return
+    if not _postgres(bind):
+        op.create_index(name, table, columns, **kw)
+        return
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        # a rerun skips a finished index; an interrupted concurrent build
+        # leaves an INVALID one behind, which is dropped and built again
+        valid = _index_valid(bind, name)
+        if valid:
+            logger.info('index %s already exists', name)
+            return
+        if valid is False:
+            logger.info('dropping invalid index %s left by an earlier attempt', name)
+            bind.exec_driver_sql(f'DROP INDEX CONCURRENTLY "{name}"')
+        op.create_index(name, table, columns, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(name, table, **kw):
+    bind = op.get_bind()
+    if dry_run():
+        logger.info('would drop index %s on %s', name, table)
+        return
+    if not _postgres(bind):
+        op.drop_index(name, table_name=table, **kw)
+        return
+    with op.get_context().autocommit_block():
+        if _index_valid(op.get_bind(), name) is not None:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, **kw)
+
+
+#----------------------------------------------------------------------------#
+# Backfills.
+#----------------------------------------------------------------------------#
+
+def backfill_rows(connection, table, assignments, where=None, batch_size=1000, pause=0.1, key='id',
+                  report_every=5.0):
+    # UPDATE "table" SET <assignments> [WHERE <where>] as one statement per
+    # range of `batch_size` primary keys, sleeping `pause` seconds between
+    # them so replicas and other writers keep up. Each range is an index range
+    # scan, unlike OFFSET paging, and `connection` must be in autocommit mode
+    # so every range commits (and releases its row locks) on its own.
+    # Progress is logged every `report_every` seconds. Returns rows updated.
+    low, high = connection.exec_driver_sql(f'SELECT min({key}), max({key}) FROM "{table}"').one()
+    if low is None:
+        logger.info('%s: empty, nothing to backfill', table)
+        return 0
+    condition = f' AND ({where})' if where else ''
+    statement = sa.text(f'UPDATE "{table}" SET {assignments} WHERE {key} >= :low AND {key} < :high{condition}')
+    total = high - low + 1
+    updated = 0
+    started = reported = time.monotonic()
+    for start in range(low, high + 1, batch_size):
+        updated += connection.execute(statement, {'low': start, 'high': start + batch_size}).rowcount
+        now = time.monotonic()
+        done = min(start + batch_size, high + 1) - low
+        if now - reported >= report_every or done == total:
+            elapsed = now - started
+            logger.info('%s: %d rows updated, %.1f%% of ids, %.0fs elapsed, about %.0fs left',
+                        table, updated, 100 * done / total, elapsed, elapsed * (total - done) / done)
+            reported = now
+        if pause and done < total:
+            time.sleep(pause)
+    return updated
+
+
+def plan_backfill(connection, table, where=None, batch_size=1000, key='id'):
+    # (estimated rows, number of statements) backfill_rows() would run
+    low, high = connection.exec_driver_sql(f'SELECT min({key}), max({key}) FROM "{table}"').one()
+    if low is None:
+        return 0, 0
+    return estimate_rows(connection, table, where), -(-(high - low + 1) // batch_size)
+
+
+def backfill(table, assignments, where=None, batch_size=1000, pause=0.1, key='id'):
+    # backfill_rows() from a migration, e.g.
+    #   backfill('Show', "end_time = start_time + interval '3 hours'", where='end_time IS NULL')
+    # `where` should exclude rows already done, so a rerun after a failure
+    # resumes instead of starting over. Commits what the migration did so far.
+    if dry_run():
+        rows, statements = plan_backfill(op.get_bind(), table, where, batch_size, key)
+        logger.info('would update about %d rows of %s in %d statements of up to %d ids, %.0fs of pauses',
+                    rows, table, statements, batch_size, statements * pause)
+        return rows
+    with op.get_context().autocommit_block():
+        return backfill_rows(op.get_bind(), table, assignments, where, batch_size, pause, key)
+
+
+#----------------------------------------------------------------------------#
+# Constraints.
+#----------------------------------------------------------------------------#
+
+def _set_not_null(bind, table, column):
+    # a NOT VALID check is added under a short lock, validated without
+    # blocking writes, and then lets SET NOT NULL skip its own full scan
+    constraint = f'"{column}_not_null"'
+    with lock_timeout():
+        bind.exec_driver_sql(f'ALTER TABLE {table} ADD CONSTRAINT {constraint} CHECK ("{column}" IS NOT NULL) NOT VALID')
+    bind.exec_driver_sql(f'ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}')
+    with lock_timeout():
+        bind.exec_driver_sql(f'ALTER TABLE {table} ALTER COLUMN "{column}" SET NOT NULL')
+        bind.exec_driver_sql(f'ALTER TABLE {table} DROP CONSTRAINT {constraint}')
+
+
+def set_not_null(table, column, existing_type):
+    # op.alter_column(table, column, nullable=False) without holding an
+    # exclusive lock for a scan of the whole table on PostgreSQL. A partitioned
+    # table cannot take a NOT VALID check, so each partition is done on its
+    # own first and the parent's SET NOT NULL then finds them all done.
+    # Commits what the migration did so far.
+    bind = op.get_bind()
+    if dry_run():
+        logger.info('would set %s.%s NOT NULL (about %d rows to check)', table, column, estimate_rows(bind, table))
+        return
+    if not _postgres(bind):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=existing_type, nullable=False)
+        return
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        partitions = bind.execute(sa.text('SELECT inhrelid::regclass::text FROM pg_inherits '
+                                          'WHERE inhparent = to_regclass(:table)'),
+                                  {'table': f'"{table}"'}).scalars().all()
+        if not partitions:
+            _set_not_null(bind, f'"{table}"', column)
+            return
+        for partition in partitions:
+            _set_not_null(bind, partition, column)
+        with lock_timeout():
+            bind.exec_driver_sql(f'ALTER TABLE "{table}" ALTER COLUMN "{column}" SET NOT NULL')
@@ -0,0 +1,148 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+
+#----------------------------------------------------------------------------#
+# Sampling profiler.
+#----------------------------------------------------------------------------#
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    # records the stack of one thread every `interval` seconds from a helper
+    # thread; the profiled code runs untouched, so timings stay realistic
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        # "root;caller;callee count" lines, the input of flamegraph.pl and speedscope
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def summary(self, top=30):
+        # functions by samples spent in them (self) and under them (inclusive)
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = sum(self.stacks.values()) or 1
+        lines = []
+        for title, counter in (('self', own), ('inclusive', inclusive)):
+            lines.append(f'top {top} by {title} samples')
+            for frame, count in counter.most_common(top):
+                lines.append(f'{count:>7} {100 * count / total:>6.1f}%  {frame}')
+            lines.append('')
+        return '\n'.join(lines)
+
+
+#----------------------------------------------------------------------------#
+# Request hook.
+#----------------------------------------------------------------------------#
+
+class RequestProfiler:
+    # opt-in: nothing is hooked into the app unless PROFILE_DIR is configured.
+    # A request is profiled when it carries a valid token (X-Profile header or
+    # ?_profile= query flag, see `flask profile-token`) or is the 1-in-N of
+    # PROFILE_SAMPLE_RATE. Each profile leaves <id>.folded (collapsed stacks)
+    # and <id>.txt (top functions) in PROFILE_DIR; the id is sent back in the
+    # X-Profile-Id response header.
+    def __init__(self):
+        self.app = None
+        self.counter = itertools.count(1)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('PROFILE_DIR')
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+        self.interval = app.config.get('PROFILE_INTERVAL', 0.001)
+        self.top = app.config.get('PROFILE_TOP', 30)
+        self.max_age = app.config.get('PROFILE_TOKEN_MAX_AGE', 24 * 3600)
+        app.before_request(self.start)
+        app.after_request(self.add_header)
+        app.teardown_request(self.finish)
+
+    def serializer(self):
+        return URLSafeTimedSerializer(self.app.secret_key, salt='request-profiler')
+
+    def make_token(self):
+        return self.serializer().dumps('profile')
+
+    def wanted(self):
+        token = request.headers.get('X-Profile') or request.args.get('_profile')
+        if token:
+            try:
+                self.serializer().loads(token, max_age=self.max_age)
+                return True
+            except BadSignature:
+                self.app.logger.warning('invalid profiling token')
+        return bool(self.sample_rate) and next(self.counter) % self.sample_rate == 0
+
+    def start(self):
+        if not self.wanted():
+            return
+        g.profile_id = '{:%Y%m%d-%H%M%S-%f}-{}-{}'.format(
+            datetime.now(), os.getpid(), (request.endpoint or 'unknown').replace('.', '-'))
+        g.profile_started = time.perf_counter()
+        g.profile_sampler = StackSampler(threading.get_ident(), self.interval)
+        g.profile_sampler.start()
+
+    def add_header(self, response):
+        profile_id = g.get('profile_id')
+        if profile_id is not None:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def finish(self, exc=None):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        sampler.stop()
+        elapsed = (time.perf_counter() - g.profile_started) * 1000
+        path = os.path.join(self.directory, g.profile_id)
+        with open(path + '.folded', 'w') as folded:
+            folded.write(sampler.collapsed())
+        with open(path + '.txt', 'w') as summary:
+            summary.write(f'{request.method} {request.full_path.rstrip("?")}\n'
+                          f'{elapsed:.1f} ms, {sum(sampler.stacks.values())} samples '
+                          f'every {self.interval * 1000:g} ms\n\n')
+            summary.write(sampler.summary(self.top))
+        self.app.logger.info('profiled %s %s in %.1f ms: %s', request.method, request.path, elapsed, path)
+
+
+profiler = RequestProfiler()
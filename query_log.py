@@ -0,0 +1,151 @@
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+
+#----------------------------------------------------------------------------#
+# Statement shapes.
+#----------------------------------------------------------------------------#
+
+# SQLAlchemy already sends bound parameters separately, so the statement text
+# is the shape of a query, except for IN lists, whose length varies
+_in_list = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)')
+_whitespace = re.compile(r'\s+')
+_shapes = {}
+
+
+def statement_shape(statement):
+    shape = _shapes.get(statement)
+    if shape is None:
+        shape = _whitespace.sub(' ', _in_list.sub('(...)', statement)).strip()
+        if len(_shapes) < 10000:
+            _shapes[statement] = shape
+    return shape
+
+
+_HERE = os.path.abspath(__file__)
+_ROOT = os.path.dirname(_HERE)
+
+
+def app_stack():
+    # the frames of this repository that led to the query, innermost last
+    return [frame for frame in traceback.extract_stack()
+            if frame.filename.startswith(_ROOT) and 'site-packages' not in frame.filename
+            and frame.filename != _HERE]
+
+
+#----------------------------------------------------------------------------#
+# Slow-query and N+1 recorder.
+#----------------------------------------------------------------------------#
+
+class SlowQueryLog:
+    # opt-in through SLOW_QUERY_MS. Statements slower than that are logged to
+    # the app.sql logger with their parameters, the view and the stack that
+    # issued them, and a plan fetched by a background thread (EXPLAIN, or
+    # EXPLAIN ANALYZE with SLOW_QUERY_EXPLAIN_ANALYZE on PostgreSQL). Every
+    # request also counts its statement shapes; one shape run
+    # SLOW_QUERY_N_PLUS_ONE or more times in a request is reported as an N+1.
+    def __init__(self):
+        self.logger = None
+        self.engine = None
+        self.plans = queue.Queue(maxsize=100)
+        self.explained = {}
+        self.thread = None
+        self.flagged = Counter()
+
+    def init_app(self, app):
+        threshold = app.config.get('SLOW_QUERY_MS')
+        if threshold is None:
+            return
+        self.threshold = threshold / 1000
+        self.explain = app.config.get('SLOW_QUERY_EXPLAIN', True)
+        self.analyze = app.config.get('SLOW_QUERY_EXPLAIN_ANALYZE', False)
+        self.n_plus_one = app.config.get('SLOW_QUERY_N_PLUS_ONE', 10)
+        self.logger = app.logger.getChild('sql')
+        with app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self.before_execute)
+        event.listen(self.engine, 'after_cursor_execute', self.after_execute)
+        app.teardown_request(self.report_request)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if threading.current_thread() is self.thread:
+            return  # our own EXPLAIN
+        if has_request_context():
+            shapes = g.setdefault('query_shapes', {})
+            shape = statement_shape(statement)
+            count, total = shapes.get(shape, (0, 0.0))
+            shapes[shape] = (count + 1, total + elapsed)
+        if elapsed >= self.threshold:
+            self.slow(statement, parameters, executemany, elapsed)
+
+    def slow(self, statement, parameters, executemany, elapsed):
+        stack = app_stack()
+        view = request.endpoint if has_request_context() else None
+        caller = f'{os.path.basename(stack[-1].filename)}:{stack[-1].lineno} in {stack[-1].name}' if stack else None
+        self.logger.warning(
+            'slow query %.1f ms in %s (%s): %s\nparameters: %.500r\nstack:\n%s',
+            elapsed * 1000, view, caller, statement, parameters,
+            ''.join(traceback.format_list(stack)).rstrip(),
+        )
+        if self.explain and not executemany and statement.split(None, 1)[0].upper() in ('SELECT', 'WITH'):
+            self.queue_explain(statement, parameters)
+
+    def queue_explain(self, statement, parameters):
+        # each shape at most every ten minutes, dropped when the thread lags behind
+        shape = statement_shape(statement)
+        now = time.monotonic()
+        if now - self.explained.get(shape, -600) < 600:
+            return
+        self.explained[shape] = now
+        try:
+            self.plans.put_nowait((statement, parameters))
+        except queue.Full:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run_explains, name='slow-query-explain', daemon=True)
+            self.thread.start()
+
+    def run_explains(self):
+        while True:
+            statement, parameters = self.plans.get()
+            if self.engine.dialect.name == 'postgresql':
+                prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if self.analyze else 'EXPLAIN '
+            else:
+                prefix = 'EXPLAIN QUERY PLAN '
+            try:
+                with self.engine.connect() as conn:
+                    rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+                    conn.rollback()
+                plan = '\n'.join(str(row[-1]) for row in rows)
+                self.logger.warning('plan for slow query: %s\n%s', statement, plan)
+            except Exception:
+                self.logger.exception('EXPLAIN of slow query failed: %s', statement)
+
+    def report_request(self, exc=None):
+        shapes = g.pop('query_shapes', None)
+        if not shapes:
+            return
+        for shape, (count, total) in shapes.items():
+            if count >= self.n_plus_one:
+                self.flagged[(request.endpoint, shape)] += 1
+                self.logger.warning(
+                    'possible N+1 in %s: %d runs, %.1f ms total (seen in %d requests): %s',
+                    request.endpoint, count, total * 1000, self.flagged[(request.endpoint, shape)], shape,
+                )
+
+
+query_log = SlowQueryLog()
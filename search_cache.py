@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import after_set_based_write, Venue, Artist
+
+
+#----------------------------------------------------------------------------#
+# Search result cache.
+#----------------------------------------------------------------------------#
+
+# Most searches repeat a handful of terms. Results are cached per kind
+# ('Venue' or 'Artist'), normalized term and genre filter for
+# SEARCH_CACHE_SECONDS, at most SEARCH_CACHE_SIZE of them. An entry keeps the
+# ids it found, so a write only drops the entries it can change: those whose
+# results hold the written row (it may have been renamed away or
+# deactivated), those whose term is in the row's new name, and truncated
+# ones, whose facets count rows beyond the ids kept. Each process has its own
+# cache; the TTL bounds how long another worker's write can go unseen.
+
+def normalize(search_term):
+    # lower-cased, trimmed, inner whitespace collapsed. lower(), not
+    # casefold(): the term goes on to ILIKE, and casefold() turns "ß" into
+    # "ss", which the database does not match against "ß"
+    return ' '.join(search_term.split()).lower()
+
+
+class SearchCache:
+    def __init__(self):
+        self.app = None
+        self.entries = OrderedDict() # key -> (expires, ids, result)
+        self.lock = threading.Lock()
+        self.size = 1000
+        self.ttl = 60
+        self.enabled = True
+        self.hits = self.misses = self.invalidations = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.size = app.config.get('SEARCH_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('SEARCH_CACHE_SECONDS', self.ttl)
+        self.enabled = app.config.get('SEARCH_CACHE_ENABLED', True)
+        self.stats_interval = app.config.get('SEARCH_STATS_INTERVAL', 60)
+        self.reported = time.monotonic()
+
+    def get(self, kind, term, genres, limit, search):
+        # the result of search() -> {"count", "truncated", "data", "facets"}
+        # for a normalized term, from the cache when it is fresh
+        if not self.enabled:
+            return search()
+        key = (kind, term, tuple(sorted(genres)), limit)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self._report(now)
+                return entry[2]
+            self.misses += 1
+            self._report(now)
+        result = search()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, frozenset(row['id'] for row in result['data']), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return result
+
+    def invalidate(self, kind, ids, names):
+        # drops the entries a write to rows `ids`, now named `names`, can change
+        ids, names = set(ids), [normalize(name) for name in names if name]
+        with self.lock:
+            stale = [key for key, (_, found, result) in self.entries.items()
+                     if key[0] == kind and (result['truncated'] or not found.isdisjoint(ids)
+                                            or any(key[1] in name for name in names))]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self, kind=None):
+        with self.lock:
+            stale = [key for key in self.entries if kind is None or key[0] == kind]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def _report(self, now):
+        # called with the lock held
+        if now - self.reported < self.stats_interval:
+            return
+        self.reported = now
+        lookups = self.hits + self.misses
+        self.app.logger.info('search cache since start (this process): %.0f%% hits (%d of %d), '
+                             '%d invalidated, %d entries', 100 * self.hits / lookups, self.hits,
+                             lookups, self.invalidations, len(self.entries))
+
+
+search_cache = SearchCache()
+
+
+#----------------------------------------------------------------------------#
+# Invalidation.
+#----------------------------------------------------------------------------#
+
+# Writes invalidate at flush time and once more after the commit: a search
+# running between the two still sees the old rows and may cache them again.
+
+def _stale(session, kind, ids, names):
+    search_cache.invalidate(kind, ids, names)
+    session.info.setdefault('search_cache_stale', []).append((kind, ids, names))
+
+
+def _row_changed(mapper, connection, target):
+    names = [target.name, *inspect(target).attrs.name.history.deleted]
+    _stale(Session.object_session(target), mapper.class_.__tablename__, [target.id], names)
+
+
+for _model in (Venue, Artist):
+    event.listen(_model, 'after_insert', _row_changed)
+    event.listen(_model, 'after_update', _row_changed)
+    event.listen(_model, 'after_delete', _row_changed)
+
+
+@after_set_based_write('Venue', 'Artist')
+def _rows_changed(session, table, ids, rows):
+    if ids is None:
+        search_cache.clear(table)
+        session.info.setdefault('search_cache_stale', []).append((table, None, None))
+        return
+    _stale(session, table, ids, [row.name for row in rows.values()])
+
+
+@event.listens_for(Session, 'after_commit')
+def _committed(session):
+    for kind, ids, names in session.info.pop('search_cache_stale', ()):
+        if ids is None:
+            search_cache.clear(kind)
+        else:
+            search_cache.invalidate(kind, ids, names)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _rolled_back(session):
+    # other sessions never saw the rows, the flush-time invalidation was enough
+    session.info.pop('search_cache_stale', None)
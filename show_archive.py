@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, union_all, text
+
+from models import db, is_postgres, Show, ShowArchive, Venue, Artist
+
+
+#----------------------------------------------------------------------------#
+# Hot Show table vs. ShowArchive.
+#----------------------------------------------------------------------------#
+
+# Show only keeps upcoming and recently played shows; archive_past_shows()
+# moves older rows into ShowArchive (monthly range partitions on PostgreSQL).
+# Readers that need history go through shows_source(), which only unions the
+# archive in when the requested range reaches into the past.
+
+def _columns(table):
+    return select(table.c.id, table.c.start_time, table.c.venue_id, table.c.artist_id)
+
+
+def shows_source(start=None):
+    # selectable with id, start_time, venue_id and artist_id columns
+    if start is not None and start >= datetime.now():
+        return Show.__table__
+    return union_all(_columns(Show.__table__), _columns(ShowArchive.__table__)).subquery('all_shows')
+
+
+def upcoming_shows(venue_id=None, artist_id=None):
+    # rows with id, start_time, venue_id, venue_name, venue_image_link,
+    # venue_version, artist_id, artist_name, artist_image_link and
+    # artist_version
+    return _with_names(Show.__table__, Show.start_time > datetime.now(), venue_id, artist_id)
+
+
+def past_shows(venue_id=None, artist_id=None):
+    source = shows_source()
+    return _with_names(source, source.c.start_time < datetime.now(), venue_id, artist_id)
+
+
+def _with_names(source, when, venue_id, artist_id):
+    query = db.session.query(source.c.id, source.c.start_time,
+                             Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+                             Venue.image_link.label('venue_image_link'), Venue.version.label('venue_version'),
+                             Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+                             Artist.image_link.label('artist_image_link'),
+                             Artist.version.label('artist_version')) \
+        .select_from(source) \
+        .join(Venue, Venue.id == source.c.venue_id) \
+        .join(Artist, Artist.id == source.c.artist_id) \
+        .filter(when)
+    if venue_id is not None:
+        query = query.filter(source.c.venue_id == venue_id)
+    if artist_id is not None:
+        query = query.filter(source.c.artist_id == artist_id)
+    return query.order_by(source.c.start_time).all()
+
+
+#----------------------------------------------------------------------------#
+# Mover job.
+#----------------------------------------------------------------------------#
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return (_month_start(value) + timedelta(days=32)).replace(day=1)
+
+
+def ensure_partitions(oldest, newest):
+    # CREATE the monthly ShowArchive partitions covering [oldest, newest]
+    month = _month_start(oldest)
+    while month <= newest:
+        following = _next_month(month)
+        db.session.execute(text(
+            'CREATE TABLE IF NOT EXISTS "ShowArchive_{:%Y_%m}" PARTITION OF "ShowArchive" '
+            "FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(month, month, following)
+        ))
+        month = following
+
+
+def archive_past_shows(cutoff, batch_size=1000):
+    # moves shows that started before `cutoff` into ShowArchive, one committed
+    # batch at a time so the hot table is never locked for long; returns the
+    # number of rows moved
+    moved = 0
+    while True:
+        batch = db.session.query(Show.id, Show.start_time) \
+            .filter(Show.start_time < cutoff) \
+            .order_by(Show.id) \
+            .limit(batch_size) \
+            .all()
+        if not batch:
+            return moved
+
+        ids = [id for id, _ in batch]
+        if is_postgres():
+            ensure_partitions(min(start for _, start in batch), max(start for _, start in batch))
+        hot = Show.__table__
+        db.session.execute(ShowArchive.__table__.insert().from_select(
+            ['id', 'start_time', 'venue_id', 'artist_id', 'end_time', 'updated_at'],
+            select(hot.c.id, hot.c.start_time, hot.c.venue_id, hot.c.artist_id, hot.c.end_time, hot.c.updated_at)
+            .where(hot.c.id.in_(ids)),
+        ))
+        db.session.execute(Show.__table__.delete().where(Show.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
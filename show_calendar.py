@@ -0,0 +1,82 @@
+import calendar
+from datetime import date, datetime, timedelta
+
+import dateutil.parser
+from sqlalchemy import func
+
+from models import db, is_postgres, Venue, Artist
+from show_archive import shows_source
+
+
+#----------------------------------------------------------------------------#
+# Date-range queries over Show.start_time.
+#----------------------------------------------------------------------------#
+
+# Both helpers filter on a half-open [start, end) range so the planner can use
+# ix_Show_start_time (BRIN on PostgreSQL, B-tree elsewhere). Ranges that reach
+# into the past also read ShowArchive, see show_archive.shows_source.
+
+def parse_range(args):
+    # ?from=2035-04-01&to=2035-05-01, either bound may be omitted;
+    # raises ValueError on unparseable dates
+    start = args.get('from')
+    end = args.get('to')
+    return (dateutil.parser.parse(start) if start else None,
+            dateutil.parser.parse(end) if end else None)
+
+
+def range_criteria(source, start=None, end=None):
+    criteria = []
+    if start is not None:
+        criteria.append(source.c.start_time >= start)
+    if end is not None:
+        criteria.append(source.c.start_time < end)
+    return criteria
+
+
+def shows_between(start=None, end=None):
+    # shows with venue and artist names in one joined query, oldest first
+    source = shows_source(start)
+    return db.session.query(source.c.id, source.c.start_time, source.c.venue_id, Venue.name,
+                            source.c.artist_id, Artist.name, Artist.image_link, Venue.version, Artist.version) \
+        .select_from(source) \
+        .join(Venue, Venue.id == source.c.venue_id) \
+        .join(Artist, Artist.id == source.c.artist_id) \
+        .filter(*range_criteria(source, start, end)) \
+        .order_by(source.c.start_time, source.c.id) \
+        .all()
+
+
+def daily_counts(start, end):
+    # {date: number of shows} for every day in [start, end) that has shows
+    source = shows_source(start)
+    if is_postgres():
+        day = func.date_trunc('day', source.c.start_time)
+    else:
+        day = func.date(source.c.start_time)
+    rows = db.session.query(day, func.count(source.c.id)) \
+        .select_from(source) \
+        .filter(*range_criteria(source, start, end)) \
+        .group_by(day) \
+        .all()
+
+    counts = {}
+    for value, count in rows:
+        if isinstance(value, str):
+            value = date.fromisoformat(value)
+        elif isinstance(value, datetime):
+            value = value.date()
+        counts[value] = count
+    return counts
+
+
+def month_calendar(year, month):
+    # weeks of (day, count) for the month grid, None pads days outside the month
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    counts = daily_counts(datetime.combine(first, datetime.min.time()),
+                          datetime.combine(last + timedelta(days=1), datetime.min.time()))
+    return [
+        [(day, counts.get(day, 0)) if day.month == month else None for day in week]
+        for week in calendar.Calendar().monthdatescalendar(year, month)
+    ]
@@ -0,0 +1,164 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+from models import db, Artist
+from venue_directory import read_directory, refresher
+
+
+#----------------------------------------------------------------------------#
+# Shared read snapshot.
+#----------------------------------------------------------------------------#
+
+# The venue directory and the active artist list, written to one file of
+# fixed-width records plus a UTF-8 string table:
+#
+#   header   magic, built_at, area/venue/artist counts, string table size
+#   areas    location_id, city, state
+#   venues   id, area index, num_upcoming_shows, name     (directory order)
+#   artists  id, name                                     (id order)
+#   strings  every name, city and state back to back
+#
+# Strings are (offset, length) pairs into the table. Every worker maps the
+# file read-only, so the pages are shared through the OS page cache however
+# many workers run. A new snapshot is written next to the old one and renamed
+# over it; readers notice the new inode on their next read and remap, while
+# reads already running keep the old mapping.
+
+MAGIC = b'FYSNAP01'
+HEADER = struct.Struct('<8sdIIII')
+AREA = struct.Struct('<iIIII')
+VENUE = struct.Struct('<iiiII')
+ARTIST = struct.Struct('<iII')
+
+
+class StringTable:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        # (offset, length), identical strings (cities, states) stored once
+        encoded = (text or '').encode()
+        offset = self.offsets.get(encoded)
+        if offset is None:
+            offset = self.offsets[encoded] = len(self.data)
+            self.data += encoded
+        return offset, len(encoded)
+
+
+def encode_snapshot(areas, artists, built_at=None):
+    # `areas` in the read_directory() shape, `artists` [(id, name)]
+    strings = StringTable()
+    area_records, venue_records = bytearray(), bytearray()
+    venue_count = 0
+    for index, area in enumerate(areas):
+        area_records += AREA.pack(area["id"], *strings.add(area["city"]), *strings.add(area["state"]))
+        for venue in area["venues"]:
+            venue_records += VENUE.pack(venue["id"], index, venue["num_upcoming_shows"], *strings.add(venue["name"]))
+            venue_count += 1
+    artist_records = bytearray()
+    for id, name in artists:
+        artist_records += ARTIST.pack(id, *strings.add(name))
+    header = HEADER.pack(MAGIC, built_at or time.time(), len(areas), venue_count, len(artists), len(strings.data))
+    return b''.join((header, area_records, venue_records, artist_records, strings.data))
+
+
+class SnapshotView:
+    # decodes records straight out of a mapped buffer
+    def __init__(self, buffer):
+        magic, self.built_at, areas, venues, artists, size = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError('not a snapshot file')
+        view = memoryview(buffer)
+        start = HEADER.size
+        self.area_records = view[start:start + areas * AREA.size]
+        start += areas * AREA.size
+        self.venue_records = view[start:start + venues * VENUE.size]
+        start += venues * VENUE.size
+        self.artist_records = view[start:start + artists * ARTIST.size]
+        start += artists * ARTIST.size
+        self.strings = view[start:start + size]
+
+    def string(self, offset, length):
+        return str(self.strings[offset:offset + length], 'utf-8')
+
+    def areas(self):
+        # the same shape read_directory() returns
+        areas = [{"id": location_id, "city": self.string(city, city_length),
+                  "state": self.string(state, state_length), "venues": []}
+                 for location_id, city, city_length, state, state_length in AREA.iter_unpack(self.area_records)]
+        for id, area, num_upcoming_shows, *name in VENUE.iter_unpack(self.venue_records):
+            areas[area]["venues"].append({"id": id, "name": self.string(*name),
+                                          "num_upcoming_shows": num_upcoming_shows})
+        return areas
+
+    def venues(self):
+        # [(id, name)] of active venues
+        return [(id, self.string(*name)) for id, _, _, *name in VENUE.iter_unpack(self.venue_records)]
+
+    def artists(self):
+        # [(id, name)] of active artists
+        return [(id, self.string(*name)) for id, *name in ARTIST.iter_unpack(self.artist_records)]
+
+
+#----------------------------------------------------------------------------#
+# Building and mapping the file.
+#----------------------------------------------------------------------------#
+
+class Snapshot:
+    # opt-in: without SNAPSHOT_PATH configured current() is always None and
+    # the views query the database as before. The file is rebuilt after every
+    # refresh of the venue directory (see venue_directory.py): every
+    # DIRECTORY_REFRESH_SECONDS, and after writes either about
+    # DIRECTORY_REFRESH_DEBOUNCE seconds after the commit or, with
+    # JOB_WORKER, once `flask worker` gets to the queued refresh. Reads trail
+    # writes by that much.
+    def __init__(self):
+        self.path = None
+        self.mapped = None # (st_ino, st_mtime_ns, SnapshotView)
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.path = app.config.get('SNAPSHOT_PATH')
+        if self.path:
+            refresher.after_refresh(self.build)
+
+    def build(self):
+        # workers take turns; each one reads the database while holding the
+        # lock, so the file renamed last always holds the newest data
+        with open(f'{self.path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            artists = db.session.query(Artist.id, Artist.name).filter(Artist.active).order_by(Artist.id).all()
+            data = encode_snapshot(read_directory(), artists)
+            temporary = f'{self.path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+
+    def current(self):
+        # SnapshotView of the newest file, or None when there is none yet
+        if not self.path:
+            return None
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        mapped = self.mapped
+        if mapped is not None and mapped[:2] == (stat.st_ino, stat.st_mtime_ns):
+            return mapped[2]
+        with self.lock:
+            with open(self.path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                # the old mapping is released once no reader holds it any more
+                view = SnapshotView(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            self.mapped = (stat.st_ino, stat.st_mtime_ns, view)
+        return view
+
+
+snapshot = Snapshot()
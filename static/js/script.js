@@ -2,3 +2,43 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// typeahead for the navbar search boxes, filled from /search/autocomplete
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var pending = null;
+  input.addEventListener('input', function () {
+    clearTimeout(pending);
+    pending = setTimeout(function () {
+      var q = input.value.trim();
+      if (!q) {
+        list.innerHTML = '';
+        return;
+      }
+      fetch('/search/autocomplete?type=' + input.dataset.autocomplete + '&q=' + encodeURIComponent(q))
+        .then(function (response) { return response.json(); })
+        .then(function (suggestions) {
+          list.innerHTML = '';
+          suggestions.forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            list.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+});
+
+// "Near me" on the venue directory: the browser's position instead of a city
+document.querySelectorAll('button[data-near-me]').forEach(function (button) {
+  if (!navigator.geolocation) {
+    button.style.display = 'none';
+    return;
+  }
+  button.addEventListener('click', function () {
+    navigator.geolocation.getCurrentPosition(function (position) {
+      window.location = '/venues/nearby?lat=' + position.coords.latitude + '&lon=' + position.coords.longitude +
+        '&radius=' + button.form.elements.radius.value;
+    });
+  });
+});
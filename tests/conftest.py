@@ -0,0 +1,45 @@
+import os
+import runpy
+import sys
+import tempfile
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py reads its settings from a `config` module; the tests bring their own
+# so they never touch a developer's database. FLASK_* environment variables
+# still override it, e.g. FLASK_SQLALCHEMY_DATABASE_URI for PostgreSQL.
+_directory = tempfile.mkdtemp(prefix='fyyur-tests-')
+config = types.ModuleType('config')
+config.SECRET_KEY = 'tests'
+config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(_directory, "fyyur.db")}'
+config.WTF_CSRF_ENABLED = False
+config.TYPEAHEAD_PRELOAD = False
+config.JOB_WORKER = True # no refresh thread waking up mid-test
+config.IMAGE_CACHE_DIR = os.path.join(_directory, 'thumbnails')
+sys.modules['config'] = config
+
+from app import app as flask_app, db  # noqa: E402
+import booking  # noqa: E402
+import matching  # noqa: E402
+import typeahead  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    # the seed data of dummy_data.py: venues 1-3, artists 4-6, version 2
+    runpy.run_path(os.path.join(ROOT, 'dummy_data.py'))
+    # the in-process indexes were built from the previous test's rows
+    for module in (booking, matching, typeahead):
+        module._index = None
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from booking import import_shows
+from models import db, Show
+
+# seeded: venue 3 / artist 6 from 2035-04-01 20:00 to 23:00
+
+
+def create_show(client, venue_id, artist_id, start_time, end_time=''):
+    return client.post('/shows/create', data={'venue_id': venue_id, 'artist_id': artist_id,
+                                              'start_time': start_time, 'end_time': end_time})
+
+
+def show_count():
+    return db.session.query(Show).count()
+
+
+def test_overlapping_venue_booking_is_refused(client):
+    before = show_count()
+    create_show(client, 3, 4, '2035-04-01 21:00:00')
+    assert show_count() == before
+
+
+def test_overlapping_artist_booking_is_refused(client):
+    before = show_count()
+    create_show(client, 1, 6, '2035-04-01 22:30:00', '2035-04-02 01:00:00')
+    assert show_count() == before
+
+
+def test_back_to_back_bookings_are_accepted(client):
+    before = show_count()
+    create_show(client, 3, 4, '2035-04-01 23:00:00')
+    create_show(client, 1, 6, '2035-04-01 17:00:00', '2035-04-01 20:00:00')
+    assert show_count() == before + 2
+
+
+def test_import_refuses_rows_overlapping_each_other(app):
+    rows = [
+        {'venue_id': 1, 'artist_id': 4, 'start_time': datetime(2036, 1, 1, 20)},
+        {'venue_id': 1, 'artist_id': 5, 'start_time': datetime(2036, 1, 1, 21)},
+        {'venue_id': 2, 'artist_id': 6, 'start_time': datetime(2035, 4, 1, 19)},
+        {'venue_id': 2, 'artist_id': 5, 'start_time': datetime(2036, 1, 1, 23)},
+    ]
+    accepted, rejected = import_shows(rows)
+    assert [(show.venue_id, show.artist_id) for show in accepted] == [(1, 4), (2, 5)]
+    assert [(row['artist_id'], conflict[0]) for row, conflict in rejected] == [(5, 'venue'), (6, 'artist')]
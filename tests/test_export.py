@@ -0,0 +1,57 @@
+import json
+from datetime import datetime, timedelta
+
+import dateutil.parser
+
+from export import export_rows
+from models import db, Show, Venue
+from show_archive import archive_past_shows
+
+
+def export(client, kind, since=None):
+    response = client.get(f'/export/{kind}.jsonl', query_string={'since': since.isoformat()} if since else {})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    return rows, dateutil.parser.parse(response.headers['X-Export-Until'])
+
+
+def touch(venue_id, updated_at):
+    db.session.execute(Venue.__table__.update().where(Venue.__table__.c.id == venue_id).values(updated_at=updated_at))
+    db.session.commit()
+
+
+def test_full_export_has_rows_written_just_now(client):
+    # the seed data was written within COMMIT_LAG of the export
+    rows, _ = export(client, 'venues')
+    assert [row['id'] for row in rows] == [1, 2, 3]
+
+
+def test_incremental_export_window(client):
+    now = datetime.now()
+    touch(1, now - timedelta(hours=2))
+    touch(2, now - timedelta(minutes=30))
+    touch(3, now)
+
+    rows, until = export(client, 'venues', since=now - timedelta(hours=1))
+    # venue 1 is older than `since`, venue 3 is newer than `until`
+    assert [row['id'] for row in rows] == [2]
+    assert now - timedelta(minutes=2) < until < now
+
+    # the next export, starting at this one's until, picks venue 3 up
+    later = [row.id for row in export_rows('venues', since=until, until=now + timedelta(minutes=2))]
+    assert later == [3]
+
+
+def test_archived_shows_only_in_full_exports(client):
+    archived = archive_past_shows(datetime(2020, 1, 1))
+    assert archived == 2
+
+    rows, _ = export(client, 'shows')
+    assert sum(row['archived'] for row in rows) == archived
+    assert len(rows) == 5
+
+    db.session.execute(Show.__table__.update().values(updated_at=datetime.now() - timedelta(hours=1)))
+    db.session.commit()
+    rows, _ = export(client, 'shows', since=datetime.now() - timedelta(days=1))
+    assert len(rows) == 3
+    assert not any(row['archived'] for row in rows)
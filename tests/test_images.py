@@ -0,0 +1,104 @@
+import io
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from images import fetch, thumbnails
+
+
+class Origin(BaseHTTPRequestHandler):
+    # a stand-in image server on the loopback address: /image.png, /missing,
+    # and /redirect?<url>
+    requests = []
+    image = b''
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path == '/image.png':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(self.image)))
+            self.end_headers()
+            self.wfile.write(self.image)
+        elif self.path.startswith('/redirect?'):
+            self.send_response(302)
+            self.send_header('Location', self.path.split('?', 1)[1])
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    Image = pytest.importorskip('PIL.Image')
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), 'red').save(buffer, 'PNG')
+    Origin.image = buffer.getvalue()
+    Origin.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    monkeypatch.setattr(thumbnails, 'enabled', True)
+    monkeypatch.setattr(thumbnails, 'failed', OrderedDict())
+    return monkeypatch
+
+
+def test_fetch_refuses_private_addresses(origin):
+    with pytest.raises(ValueError, match='not a public address'):
+        fetch(f'{origin}/image.png')
+    assert Origin.requests == []
+
+
+def test_fetch_from_allowed_host(origin):
+    assert fetch(f'{origin}/image.png', allowed_hosts={'127.0.0.1'}) == Origin.image
+
+
+def test_fetch_refuses_redirect_to_private_address(origin):
+    # localhost is allowed by name, the redirect leaves it for 127.0.0.1
+    port = origin.rsplit(':', 1)[1]
+    with pytest.raises(ValueError, match='not a public address'):
+        fetch(f'http://localhost:{port}/redirect?{origin}/image.png', allowed_hosts={'localhost'})
+    assert Origin.requests == ['/redirect?' + f'{origin}/image.png']
+
+
+def test_fetch_refuses_other_schemes(origin):
+    with pytest.raises(ValueError):
+        fetch('file:///etc/passwd')
+    # refused by urllib (HTTPError) before our own redirect check
+    with pytest.raises((ValueError, OSError)):
+        fetch(f'{origin}/redirect?file:///etc/passwd', allowed_hosts={'127.0.0.1'})
+
+
+def test_proxy_sends_refused_images_to_the_origin(app, client, origin, proxy):
+    image_link = f'{origin}/image.png'
+    response = client.get(thumbnails.url(image_link, 320))
+    assert response.status_code == 302
+    assert response.headers['Location'] == image_link
+    assert Origin.requests == []
+
+
+def test_proxy_serves_allowed_hosts(app, client, origin, proxy):
+    proxy.setattr(thumbnails, 'allowed_hosts', frozenset({'127.0.0.1'}))
+    response = client.get(thumbnails.url(f'{origin}/image.png', 320))
+    assert response.status_code == 200
+    assert response.mimetype.startswith('image/')
+
+
+def test_proxy_does_not_refetch_failed_images(app, client, origin, proxy):
+    proxy.setattr(thumbnails, 'allowed_hosts', frozenset({'127.0.0.1'}))
+    url = thumbnails.url(f'{origin}/missing', 320)
+    assert client.get(url).status_code == 302
+    assert client.get(url).status_code == 302
+    assert Origin.requests == ['/missing']
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+from matching import matches_for
+from models import db, Artist, Venue
+from venue_directory import refresher
+
+SEEDED_VERSION = 2
+
+# seeded: venue 1 (Jazz, Classical, ...) seeks talent, venue 3 (Rock n Roll,
+# Jazz, ...) does not; artist 4 (Rock n Roll) and artist 6 (Jazz, Classical)
+
+
+def venues_for(artist_id):
+    return [id for _, id in matches_for(db.session.get(Artist, artist_id))]
+
+
+def artists_for(venue_id):
+    return [id for _, id in matches_for(db.session.get(Venue, venue_id))]
+
+
+def test_patch_updates_the_index(client):
+    assert venues_for(4) == []
+    response = client.patch('/venues/3', json={'version': SEEDED_VERSION, 'seeking_talent': True})
+    assert response.status_code == 200
+    assert venues_for(4) == [3]
+
+    response = client.patch('/artists/6', json={'version': SEEDED_VERSION, 'seeking_venue': True})
+    assert response.status_code == 200
+    assert artists_for(1) == [6]
+
+
+@pytest.mark.parametrize('action', ['delete', 'deactivate'])
+def test_bulk_statements_remove_from_the_index(client, action):
+    assert venues_for(6) == [1]
+    response = client.post('/venues/bulk', json={'ids': [1], 'action': action})
+    assert response.get_json()['affected'] == 1
+    assert venues_for(6) == []
+
+
+def test_writes_from_other_processes_show_up_after_a_refresh(app):
+    assert venues_for(4) == []
+    with sqlite3.connect(db.engine.url.database) as connection:
+        connection.execute('UPDATE Venue SET seeking_talent = 1 WHERE id = 3')
+    assert venues_for(4) == []
+    refresher.refresh()
+    assert venues_for(4) == [3]
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import update
+
+from models import db, Venue
+from typeahead import suggest
+from venue_directory import refresher
+
+SEEDED_VERSION = 2
+
+
+def venues(text):
+    return [(id, name) for _, id, name in suggest(text, kind='venue')]
+
+
+def test_patch_renames_in_the_index(client):
+    assert venues('musical') == [(1, 'The Musical Hop')]
+    response = client.patch('/venues/1', json={'version': SEEDED_VERSION, 'name': 'Blue Room'})
+    assert response.status_code == 200
+    assert venues('musical') == []
+    assert venues('blue r') == [(1, 'Blue Room')]
+
+
+@pytest.mark.parametrize('action', ['delete', 'deactivate'])
+def test_bulk_statements_remove_from_the_index(client, action):
+    assert venues('musical') == [(1, 'The Musical Hop')]
+    response = client.post('/venues/bulk', json={'ids': [1], 'action': action})
+    assert response.get_json()['affected'] == 1
+    assert venues('musical') == []
+
+
+def test_statement_without_target_ids_is_followed(app):
+    assert venues('musical') == [(1, 'The Musical Hop')]
+    db.session.execute(update(Venue).where(Venue.name == 'The Musical Hop').values(name='Zebra Hall'),
+                       execution_options={'synchronize_session': False})
+    db.session.commit()
+    assert venues('musical') == []
+    assert venues('zebra') == [(1, 'Zebra Hall')]
+
+
+def test_writes_from_other_processes_show_up_after_a_refresh(app):
+    assert venues('musical') == [(1, 'The Musical Hop')]
+    # another process: a separate connection, no events in this one
+    with sqlite3.connect(db.engine.url.database) as connection:
+        connection.execute("UPDATE Venue SET name = 'Zebra Hall' WHERE id = 1")
+    assert venues('musical') == [(1, 'The Musical Hop')]
+    refresher.refresh()
+    assert venues('musical') == []
+    assert venues('zebra') == [(1, 'Zebra Hall')]
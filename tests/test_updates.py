@@ -0,0 +1,80 @@
+import pytest
+
+from models import db, Venue
+
+SEEDED_VERSION = 2
+
+
+def patch(client, payload, headers=None, id=1):
+    return client.patch(f'/venues/{id}', json=payload, headers=headers)
+
+
+def test_patch_updates_only_the_given_fields(client):
+    response = patch(client, {'version': SEEDED_VERSION, 'phone': '(123) 456-7890'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['updated'] == ['phone']
+    assert body['version'] == SEEDED_VERSION + 1
+    assert response.headers['ETag'] == f'"{SEEDED_VERSION + 1}"'
+    venue = db.session.get(Venue, 1)
+    assert (venue.phone, venue.name) == ('(123) 456-7890', 'The Musical Hop')
+
+
+def test_stale_version_is_a_conflict(client):
+    assert patch(client, {'version': SEEDED_VERSION, 'name': 'First'}).status_code == 200
+    response = patch(client, {'version': SEEDED_VERSION, 'name': 'Second'})
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'version conflict', 'version': SEEDED_VERSION + 1}
+    assert db.session.get(Venue, 1).name == 'First'
+
+
+def test_version_from_if_match(client):
+    response = patch(client, {'name': 'Renamed'}, headers={'If-Match': f'"{SEEDED_VERSION}"'})
+    assert response.status_code == 200
+    assert patch(client, {'name': 'Again'}, headers={'If-Match': f'"{SEEDED_VERSION}"'}).status_code == 409
+
+
+def test_missing_version(client):
+    assert patch(client, {'name': 'Renamed'}).status_code == 428
+
+
+def test_missing_venue(client):
+    assert patch(client, {'version': SEEDED_VERSION, 'name': 'Renamed'}, id=999).status_code == 404
+
+
+@pytest.mark.parametrize('payload', [
+    ['not', 'an', 'object'],
+    {'version': 'two', 'name': 'Renamed'},
+    {'version': SEEDED_VERSION, 'capacity': 100},
+    {'version': SEEDED_VERSION, 'name': 123},
+    {'version': SEEDED_VERSION, 'phone': 12345},
+    {'version': SEEDED_VERSION, 'facebook_link': 5},
+    {'version': SEEDED_VERSION, 'image_link': ['x']},
+    {'version': SEEDED_VERSION, 'genres': 'Jazz'},
+    {'version': SEEDED_VERSION, 'seeking_talent': 'yes'},
+    {'version': SEEDED_VERSION, 'phone': '12345'},
+    {'version': SEEDED_VERSION, 'name': ''},
+])
+def test_bad_input_is_a_400(client, payload):
+    assert patch(client, payload).status_code == 400
+    assert db.session.get(Venue, 1).version == SEEDED_VERSION
+
+
+def test_duplicate_name_is_a_conflict(client):
+    name = db.session.get(Venue, 2).name
+    response = patch(client, {'version': SEEDED_VERSION, 'name': name})
+    assert response.status_code == 409
+    assert 'already has that name' in response.get_json()['error']
+
+
+def test_csrf_token_for_api_clients(app, client):
+    app.config['WTF_CSRF_ENABLED'] = True
+    try:
+        response = patch(client, {'version': SEEDED_VERSION, 'name': 'Renamed'})
+        assert response.status_code == 400
+        assert 'CSRF' in response.get_json()['error']
+        token = client.get('/csrf-token').get_json()['csrf_token']
+        response = patch(client, {'version': SEEDED_VERSION, 'name': 'Renamed'}, headers={'X-CSRFToken': token})
+        assert response.status_code == 200
+    finally:
+        app.config['WTF_CSRF_ENABLED'] = False
@@ -0,0 +1,181 @@
+import bisect
+import re
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from models import db, after_set_based_write, Venue, Artist
+from venue_directory import refresher
+
+
+#----------------------------------------------------------------------------#
+# Name prefix index.
+#----------------------------------------------------------------------------#
+
+# A sorted list of (key, kind, id) where the keys of a name are its lower-cased
+# words from each of the first MAX_WORDS words on ("the musical hop", "musical
+# hop", "hop"), so "mus" and "musical h" both find The Musical Hop. A lookup is
+# one bisect plus a scan of at most a few entries past the first match. Memory
+# is bounded by MAX_WORDS keys of at most MAX_KEY_LENGTH characters per name.
+#
+# Each process holds its own index. Writes made through this process update it
+# as they commit; writes made by other processes (other web workers, `flask
+# worker`, scripts) only show up when the index is rebuilt after the next
+# venue directory refresh, at most DIRECTORY_REFRESH_SECONDS later.
+
+MAX_WORDS = 6
+MAX_KEY_LENGTH = 48
+MODELS = {'venue': Venue, 'artist': Artist}
+
+_word = re.compile(r'\w+')
+
+
+def normalize(text):
+    return ' '.join(_word.findall((text or '').casefold()))[:MAX_KEY_LENGTH]
+
+
+def name_keys(name):
+    words = _word.findall((name or '').casefold())
+    return {' '.join(words[start:])[:MAX_KEY_LENGTH] for start in range(min(len(words), MAX_WORDS))}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.entries = []
+        self.names = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, kind, id, name):
+        self.remove(kind, id)
+        keys = name_keys(name)
+        self.names[(kind, id)] = (name, keys)
+        for key in keys:
+            bisect.insort(self.entries, (key, kind, id))
+
+    def remove(self, kind, id):
+        name, keys = self.names.pop((kind, id), (None, ()))
+        for key in keys:
+            position = bisect.bisect_left(self.entries, (key, kind, id))
+            if position < len(self.entries) and self.entries[position] == (key, kind, id):
+                del self.entries[position]
+
+    def search(self, text, limit=10, kind=None):
+        # [(kind, id, name)] whose name has a word sequence starting with `text`
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        found = {}
+        position = bisect.bisect_left(self.entries, (prefix,))
+        while position < len(self.entries) and len(found) < limit:
+            key, entry_kind, id = self.entries[position]
+            if not key.startswith(prefix):
+                break
+            if kind is None or entry_kind == kind:
+                found.setdefault((entry_kind, id), None)
+            position += 1
+        return [(entry_kind, id, self.names[(entry_kind, id)][0]) for entry_kind, id in found]
+
+    @classmethod
+    def load(cls):
+        # one sort over every key rather than an insort per key
+        index = cls()
+        for kind, model in MODELS.items():
+            for id, name in db.session.query(model.id, model.name).filter(model.active):
+                keys = name_keys(name)
+                index.names[(kind, id)] = (name, keys)
+                index.entries.extend((key, kind, id) for key in keys)
+        index.entries.sort()
+        return index
+
+
+_index = None
+
+
+def preload_index(app):
+    # build the index while the app starts rather than in the first request
+    # that needs it; without a schema yet (flask db upgrade, a fresh
+    # database) it is built on first use instead
+    global _index
+    if not app.config.get('TYPEAHEAD_PRELOAD', True):
+        return
+    with app.app_context():
+        try:
+            _index = PrefixIndex.load()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.warning('typeahead index not preloaded: %s', e.__class__.__name__)
+
+
+def prefix_index():
+    # built at startup or on first use in each process, then kept current by
+    # the events and the rebuild below
+    global _index
+    if _index is None:
+        _index = PrefixIndex.load()
+    return _index
+
+
+def suggest(text, kind=None, limit=10):
+    return prefix_index().search(text, limit, kind)
+
+
+#----------------------------------------------------------------------------#
+# Keeping the index current.
+#----------------------------------------------------------------------------#
+
+def _kind(target):
+    return 'venue' if isinstance(target, Venue) else 'artist'
+
+
+def _after_write(mapper, connection, target):
+    if _index is not None:
+        if target.active:
+            _index.add(_kind(target), target.id, target.name)
+        else:
+            _index.remove(_kind(target), target.id)
+
+
+def _after_delete(mapper, connection, target):
+    if _index is not None:
+        _index.remove(_kind(target), target.id)
+
+
+for _model in MODELS.values():
+    event.listen(_model, 'after_insert', _after_write)
+    event.listen(_model, 'after_update', _after_write)
+    event.listen(_model, 'after_delete', _after_delete)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_index(*args):
+    global _index
+    _index = None
+
+
+@after_set_based_write('Venue', 'Artist')
+def _reload_rows(session, table, ids, rows):
+    # PATCH, edit forms and bulk endpoints: follow just the targeted rows
+    if _index is None:
+        return
+    if ids is None:
+        _drop_index()
+        return
+    kind = table.lower()
+    for id in ids:
+        row = rows.get(id)
+        if row is not None and row.active:
+            _index.add(kind, id, row.name)
+        else:
+            _index.remove(kind, id)
+
+
+@refresher.after_refresh
+def _rebuild_index():
+    # picks up other processes' writes; requests keep searching the old index
+    # until the new one is swapped in
+    global _index
+    if _index is not None:
+        _index = PrefixIndex.load()
@@ -0,0 +1,86 @@
+from sqlalchemy import update
+from wtforms import BooleanField, FloatField, SelectMultipleField
+
+from geo import locate
+from models import db, Location, Venue
+
+
+#----------------------------------------------------------------------------#
+# Partial updates with optimistic locking.
+#----------------------------------------------------------------------------#
+
+# Columns a client may change, keyed by the form field name used in forms.py.
+ARTIST_FIELDS = {
+    'name': 'name', 'city': 'city', 'state': 'state', 'phone': 'phone', 'genres': 'genres',
+    'website_link': 'website', 'facebook_link': 'facebook_link', 'seeking_venue': 'seeking_venue',
+    'seeking_description': 'seeking_description', 'image_link': 'image_link',
+}
+VENUE_FIELDS = {
+    'name': 'name', 'city': 'city', 'state': 'state', 'address': 'address', 'phone': 'phone',
+    'genres': 'genres', 'website_link': 'website', 'facebook_link': 'facebook_link',
+    'seeking_talent': 'seeking_talent', 'seeking_description': 'seeking_description',
+    'image_link': 'image_link', 'latitude': 'latitude', 'longitude': 'longitude',
+}
+
+
+def type_error(field_class, value):
+    # JSON values skip the fields' own coercion, so they must already have
+    # the type the field holds; null clears an optional field
+    if issubclass(field_class, BooleanField):
+        return None if isinstance(value, bool) else 'Not a boolean value.'
+    if value is None:
+        return None
+    if issubclass(field_class, SelectMultipleField):
+        ok = isinstance(value, list) and all(isinstance(item, str) for item in value)
+        return None if ok else 'Not a list of strings.'
+    if issubclass(field_class, FloatField):
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        return None if ok else 'Not a number.'
+    return None if isinstance(value, str) else 'Not a string.'
+
+
+def validate_changes(form_class, fields, changes):
+    # {field: [errors]} for the submitted fields only, untouched required
+    # fields are not the client's problem in a partial update. Values of the
+    # wrong JSON type are reported before the form's validators see them.
+    errors = {}
+    for field, value in changes.items():
+        if field in fields:
+            message = type_error(getattr(form_class, field).field_class, value)
+            if message:
+                errors[field] = [message]
+    if errors:
+        return errors
+    form = form_class(formdata=None, data=changes, meta={'csrf': False})
+    form.validate()
+    return {field: errors for field, errors in form.errors.items() if field in changes and field in fields}
+
+
+def patch_row(model, id, version, changes):
+    # one UPDATE ... WHERE id = ? AND version = ?, no SELECT beforehand;
+    # `changes` maps column names to new values. Returns (status, version)
+    # with status 'ok', 'stale' (someone saved in between) or 'missing'.
+    # The caller commits.
+    values = dict(changes)
+    if 'city' in values or 'state' in values:
+        if not ('city' in values and 'state' in values):
+            raise ValueError('city and state have to be changed together')
+        location = Location.get_or_create(values['city'], values['state'])
+        db.session.flush()
+        values['location_id'] = location.id
+    if model is Venue:
+        locate(values) # coordinates and geohash, see geo.py
+
+    statement = update(model).where(model.id == id)
+    if version is not None:
+        statement = statement.where(model.version == version)
+    statement = statement.values(version=model.version + 1, **values).returning(model.version)
+
+    new_version = db.session.execute(statement, execution_options={'synchronize_session': False,
+                                                                   'target_ids': [id]}).scalar()
+    if new_version is not None:
+        return 'ok', new_version
+
+    # only the failure path reads the row, to tell a conflict from a 404
+    current = db.session.query(model.version).filter(model.id == id).scalar()
+    return ('missing', None) if current is None else ('stale', current)
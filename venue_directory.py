@@ -0,0 +1,216 @@
+import threading
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from jobs import enqueue_once, handler
+from models import db, is_postgres, written_table, Venue, Artist, Show, Location
+
+
+#----------------------------------------------------------------------------#
+# Precomputed area -> venue -> upcoming show count directory.
+#----------------------------------------------------------------------------#
+
+# A materialized view on PostgreSQL (refreshed CONCURRENTLY, readers are never
+# blocked) and a snapshot table elsewhere. It lives outside db.metadata so
+# create_all()/drop_all() leave it alone; use create_directory()/drop_directory().
+
+directory = sa.Table(
+    'venue_directory', sa.MetaData(),
+    sa.Column('location_id', sa.Integer),
+    sa.Column('city', sa.String(120)),
+    sa.Column('state', sa.String(120)),
+    sa.Column('venue_id', sa.Integer, primary_key=True),
+    sa.Column('venue_name', sa.String),
+    sa.Column('num_upcoming_shows', sa.Integer),
+)
+
+
+def directory_select(now):
+    upcoming = sa.select(Show.venue_id, sa.func.count(Show.id).label('num_upcoming_shows')) \
+        .where(Show.start_time > now) \
+        .group_by(Show.venue_id) \
+        .subquery()
+    return sa.select(Location.id.label('location_id'), Location.city, Location.state,
+                     Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+                     sa.func.coalesce(upcoming.c.num_upcoming_shows, 0).label('num_upcoming_shows')) \
+        .join_from(Location, Venue, Venue.location_id == Location.id) \
+        .outerjoin(upcoming, upcoming.c.venue_id == Venue.id) \
+        .where(Venue.active)
+
+
+_indexes = (
+    # CONCURRENTLY needs a unique index; the other serves the ordered full read
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_venue_directory_venue_id ON venue_directory (venue_id)',
+    'CREATE INDEX IF NOT EXISTS ix_venue_directory_area ON venue_directory (state, city, location_id, venue_name)',
+)
+
+
+def create_directory(connection):
+    if connection.dialect.name == 'postgresql':
+        select = directory_select(sa.literal_column('LOCALTIMESTAMP'))
+        sql = select.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+        connection.execute(sa.text(f'CREATE MATERIALIZED VIEW IF NOT EXISTS venue_directory AS {sql}'))
+    else:
+        directory.create(connection, checkfirst=True)
+    for statement in _indexes:
+        connection.execute(sa.text(statement))
+
+
+def drop_directory(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(sa.text('DROP MATERIALIZED VIEW IF EXISTS venue_directory'))
+    else:
+        directory.drop(connection, checkfirst=True)
+
+
+def refresh_directory():
+    if is_postgres():
+        db.session.execute(sa.text('REFRESH MATERIALIZED VIEW CONCURRENTLY venue_directory'))
+    else:
+        # swapped inside one transaction, readers see the old or the new snapshot
+        db.session.execute(directory.delete())
+        db.session.execute(directory.insert().from_select(
+            [c.name for c in directory.c], directory_select(datetime.now())))
+    db.session.commit()
+
+
+def read_directory(*criteria):
+    # [{"id", "city", "state", "venues": [...]}] in the shape venues.html expects
+    rows = db.session.query(directory) \
+        .filter(*criteria) \
+        .order_by(directory.c.state, directory.c.city, directory.c.location_id, directory.c.venue_name)
+
+    areas = []
+    for row in rows:
+        if not areas or areas[-1]["id"] != row.location_id:
+            areas.append({"id": row.location_id, "city": row.city, "state": row.state, "venues": []})
+        areas[-1]["venues"].append({
+            "id": row.venue_id,
+            "name": row.venue_name,
+            "num_upcoming_shows": row.num_upcoming_shows,
+        })
+    return areas
+
+
+#----------------------------------------------------------------------------#
+# Refresh after writes and on a timer.
+#----------------------------------------------------------------------------#
+
+# Every process refreshes on a timer, every DIRECTORY_REFRESH_SECONDS, as
+# shows pass into the past. After a commit that changes venues, shows,
+# artists or locations:
+#
+#   JOB_WORKER = True   the transaction enqueues a refresh-directory job along
+#                       with its own rows (see jobs.py) unless one is already
+#                       pending, and `flask worker` refreshes and runs the
+#                       after_refresh hooks. The worker has to be running.
+#   otherwise           the committing process wakes its refresh thread, which
+#                       waits DIRECTORY_REFRESH_DEBOUNCE seconds so a burst of
+#                       writes becomes a single refresh.
+
+class DirectoryRefresher:
+    def __init__(self):
+        self.app = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.hooks = []
+        self.use_worker = False
+
+    def init_app(self, app):
+        self.app = app
+        self.use_worker = app.config.get('JOB_WORKER', False)
+        app.before_request(self.start)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='venue-directory-refresh', daemon=True)
+                self.thread.start()
+
+    def after_refresh(self, fn):
+        # fn() runs in the app context after every successful refresh
+        self.hooks.append(fn)
+
+    def request_refresh(self):
+        self.wakeup.set()
+
+    def refresh(self):
+        refresh_directory()
+        for fn in self.hooks:
+            fn()
+
+    def run(self):
+        interval = self.app.config.get('DIRECTORY_REFRESH_SECONDS', 60)
+        debounce = self.app.config.get('DIRECTORY_REFRESH_DEBOUNCE', 1.0)
+        while True:
+            # commits after this point wake us up for another round
+            self.wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('venue directory refresh failed')
+                finally:
+                    db.session.remove()
+            if self.wakeup.wait(interval):
+                # let a burst of writes settle into a single refresh
+                time.sleep(debounce)
+
+
+refresher = DirectoryRefresher()
+
+
+@handler('refresh-directory')
+def _refresh_directory(payloads):
+    refresher.refresh()
+
+
+def _queue_refresh(session):
+    if not refresher.use_worker:
+        session.info['venue_directory_refresh'] = True
+    elif not session.info.get('venue_directory_queued'):
+        session.info['venue_directory_queued'] = True
+        enqueue_once('refresh-directory', session=session)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_directory_changes(session, flush_context):
+    # deleting an artist cascades to its shows in the database; artist writes
+    # also feed the refresh hooks (the shared snapshot lists artists)
+    if any(isinstance(obj, (Venue, Show, Location, Artist)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['venue_directory_stale'] = True
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _queue_after_flush(session, flush_context):
+    # the job is flushed by the next round of the same commit
+    if session.info.pop('venue_directory_stale', False):
+        _queue_refresh(session)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_changes(orm_execute_state):
+    if written_table(orm_execute_state) in ('Venue', 'Show', 'Location', 'Artist'):
+        _queue_refresh(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    session.info.pop('venue_directory_stale', None)
+    session.info.pop('venue_directory_queued', None)
+    if session.info.pop('venue_directory_refresh', False):
+        refresher.request_refresh()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    for key in ('venue_directory_stale', 'venue_directory_queued', 'venue_directory_refresh'):
+        session.info.pop(key, None)